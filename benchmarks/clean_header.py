@@ -0,0 +1,137 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Compare the output and the run time of the shell implementation of
+clean_header.sh with clean_header.py on a set of patches.
+
+Run it from the directory which contains series.conf, with LINUX_GIT set:
+    kernel-source$ ~/programming/suse/ksapply/benchmarks/clean_header.py
+
+By default, the patches of the sorted section of series.conf are used. The
+patches are cleaned in copies under a temporary directory; the originals are
+not modified. Patches for which the two implementations give a different
+output or a different exit status are listed.
+"""
+
+from __future__ import print_function
+
+import argparse
+import difflib
+import os
+import os.path
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+libdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, libdir)
+
+import lib
+
+
+def run_shell(paths, args):
+    env = dict(os.environ)
+    env.pop("CLEAN_HEADER_PY", None)
+    statuses = []
+    with open(os.devnull) as devnull:
+        for path in paths:
+            statuses.append(subprocess.call(
+                [os.path.join(libdir, "clean_header.sh")] + args + [path],
+                stdin=devnull, stderr=devnull, env=env))
+    return statuses
+
+
+def run_native(paths, args):
+    statuses = []
+    with open(os.devnull) as devnull:
+        if args:
+            # --commit applies to a single patch
+            for path in paths:
+                statuses.append(subprocess.call(
+                    [os.path.join(libdir, "clean_header.py")] + args + [path],
+                    stdin=devnull, stderr=devnull))
+        else:
+            # the patches that fail are left untouched, which is what the
+            # comparison of the outputs checks
+            subprocess.call([os.path.join(libdir, "clean_header.py")] + paths,
+                            stdin=devnull, stderr=devnull)
+            statuses = [None] * len(paths)
+    return statuses
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare clean_header.sh with clean_header.py.")
+    parser.add_argument("-n", "--number", type=int,
+                        help="Use only the first NUMBER patches.")
+    parser.add_argument("-c", "--commit",
+                        help="Pass --commit to both implementations. Each "
+                        "patch is then cleaned in a separate process.")
+    parser.add_argument("-d", "--diff", action="store_true",
+                        help="Print the differences between the outputs.")
+    parser.add_argument("patches", nargs="*", metavar="patch",
+                        help="Default: the patches of the sorted section of "
+                        "series.conf")
+    args = parser.parse_args()
+
+    if "LINUX_GIT" not in os.environ:
+        print("Error: \"LINUX_GIT\" environment variable not set.",
+              file=sys.stderr)
+        sys.exit(1)
+
+    patches = args.patches
+    if not patches:
+        with open("series.conf") as f:
+            before, inside, after = lib.split_series(f)
+        patches = [os.path.join("patches", lib.firstword(line))
+                   for line in inside if lib.filter_patches(line)]
+    if args.number is not None:
+        patches = patches[:args.number]
+    options = []
+    if args.commit:
+        options = ["--commit=%s" % (args.commit,)]
+
+    tmpdir = tempfile.mkdtemp(prefix="clean_header.")
+    try:
+        copies = {}
+        for name in ("shell", "native",):
+            copies[name] = []
+            for i, patch in enumerate(patches):
+                path = os.path.join(tmpdir, name, "%05d.patch" % (i,))
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                shutil.copyfile(patch, path)
+                copies[name].append(path)
+
+        start = time.time()
+        shell_statuses = run_shell(copies["shell"], options)
+        shell_time = time.time() - start
+        start = time.time()
+        native_statuses = run_native(copies["native"], options)
+        native_time = time.time() - start
+
+        different = 0
+        for i, patch in enumerate(patches):
+            with open(copies["shell"][i]) as f:
+                shell = f.readlines()
+            with open(copies["native"][i]) as f:
+                native = f.readlines()
+            if shell == native and (native_statuses[i] is None or (
+                    shell_statuses[i] == 0) == (native_statuses[i] == 0)):
+                continue
+            different += 1
+            print("%s: differs" % (patch,))
+            if args.diff:
+                sys.stdout.writelines(difflib.unified_diff(
+                    shell, native, "clean_header.sh", "clean_header.py"))
+    finally:
+        shutil.rmtree(tmpdir)
+
+    print("%d patches, %d different" % (len(patches), different,))
+    print("clean_header.sh: %.3f seconds" % (shell_time,))
+    print("clean_header.py: %.3f seconds" % (native_time,))
+    if different:
+        sys.exit(1)
@@ -0,0 +1,327 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Generate a synthetic LINUX_GIT repository and kernel-source tree to measure
+how the tools scale, without network access.
+
+The repository has one remote head for each of the first remotes of
+git_sort.remotes. Each head continues the previous one, so that commits are
+spread over the heads like in a real repository. The commits carry no
+files; only their ids and log messages matter to the tools.
+
+The tree has the layout of kernel-source, with series.conf and the patches
+under patches.suse/, and the layout of a quilt tree in "current", where
+"patches" links to kernel-source. The sorted section of series.conf is in
+the order that series_sort.py gives. Some commits are left out of the series
+("spare") and some patches are written but not listed ("added"), for the
+benchmarks which insert new entries.
+
+Example:
+    $ benchmarks/generate.py -n 10000 /tmp/scale-10000
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import os.path
+import random
+import re
+import subprocess
+import sys
+import time
+
+libdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, libdir)
+
+from git_helpers import git_sort
+
+import lib
+
+
+_subsystems = ("drivers/net/ethernet/intel/e1000e", "drivers/scsi/lpfc",
+               "drivers/gpu/drm/i915", "net/ipv4", "fs/xfs", "mm",
+               "kernel/sched", "arch/x86/kvm", "drivers/infiniband/hw/mlx5",
+               "drivers/nvme/host", "block", "fs/btrfs",)
+_verbs = ("fix", "add", "remove", "use", "avoid", "handle", "convert",
+          "simplify", "check", "update",)
+_objects = ("a race in the reset path", "support for the new device id",
+            "an unused variable", "the refcount on error",
+            "a NULL pointer dereference", "the lock ordering",
+            "an off-by-one in the ring size", "the error message",
+            "the helper for the common case", "the return value of probe",)
+_names = ("Jane Developer", "John Hacker", "Ana Maintainer", "Li Wei",
+          "Petr Novak", "Sam Reviewer",)
+_start_time = 1483228800
+
+
+def format_date(t):
+    return time.strftime("%a, %d %b %Y %H:%M:%S +0000", time.gmtime(t))
+
+
+def remote_name(head_name):
+    return re.sub("[^a-zA-Z0-9]+", "-", head_name)
+
+
+def email(name):
+    return "%s@example.org" % (name.split()[0].lower(),)
+
+
+class Generator(object):
+    def __init__(self, path, patches, heads, ratio, spare, added, seed):
+        self.path = os.path.abspath(path)
+        self.git_dir = os.path.join(self.path, "linux", ".git")
+        self.source = os.path.join(self.path, "kernel-source")
+        self.patches = patches
+        self.heads = git_sort.remotes[:heads]
+        self.ratio = ratio
+        self.spare = spare
+        self.added = added
+        self.random = random.Random(seed)
+
+    def message(self, i):
+        subsys = self.random.choice(_subsystems)
+        subject = "%s: %s %s" % (subsys.rsplit("/", 1)[-1],
+                                 self.random.choice(_verbs),
+                                 self.random.choice(_objects),)
+        author = self.random.choice(_names)
+        body = ["The code in %s did not %s. This is change %d." % (
+                    subsys, self.random.choice(_verbs), i,),
+                "",
+                "Signed-off-by: %s <%s>" % (author, email(author),)]
+        return (subsys, subject, author, "%s\n\n%s\n" % (
+            subject, "\n".join(body),),)
+
+    def build_repo(self):
+        """
+        Returns a list of
+            (head name, [(commit id, subsystem, subject, author, time,)],)
+        """
+        os.makedirs(os.path.dirname(self.git_dir))
+        subprocess.check_call(("git", "init", "-q", os.path.dirname(
+            self.git_dir),))
+        env = dict(os.environ, GIT_DIR=self.git_dir)
+
+        total = (self.patches + self.spare + self.added) * self.ratio
+        per_head = [total // len(self.heads)] * len(self.heads)
+        per_head[0] += total - sum(per_head)
+
+        stream = []
+        commits = []
+        mark = 0
+        for (url, branch), count in zip(self.heads, per_head):
+            head_name = git_sort.head_name(url, branch)
+            name = remote_name(head_name)
+            subprocess.check_call(("git", "remote", "add", name, url,),
+                                  env=env)
+            ref = "refs/remotes/%s/%s" % (name, branch,)
+            head_commits = []
+            for i in range(count):
+                subsys, subject, author, message = self.message(mark)
+                data = message.encode("utf-8")
+                t = _start_time + mark * 60
+                stream.append(("commit %s\nmark :%d\n" % (ref, mark + 1,)
+                               ).encode("utf-8"))
+                ident = ("%s <%s> %d +0000" % (author, email(author), t,)
+                         ).encode("utf-8")
+                stream.append(b"author " + ident + b"\n")
+                stream.append(b"committer " + ident + b"\n")
+                stream.append(("data %d\n" % (len(data),)).encode("utf-8"))
+                stream.append(data + b"\n")
+                if i == 0 and mark:
+                    # continue the previous head
+                    stream.append(("from :%d\n" % (mark,)).encode("utf-8"))
+                mark += 1
+                head_commits.append((mark, subsys, subject, author, t,))
+            commits.append((head_name, head_commits,))
+
+        marks_path = os.path.join(self.path, "marks")
+        p = subprocess.Popen(("git", "fast-import", "--quiet",
+                              "--export-marks=%s" % (marks_path,),),
+                             stdin=subprocess.PIPE, env=env)
+        p.communicate(b"".join(stream))
+        if p.returncode:
+            raise subprocess.CalledProcessError(p.returncode, "git fast-import")
+        ids = {}
+        with open(marks_path) as f:
+            for line in f:
+                m, commit = line.split()
+                ids[int(m[1:])] = commit
+        os.unlink(marks_path)
+        subprocess.check_call(("git", "update-ref", "HEAD",
+                               ids[mark],), env=env)
+
+        return [(head_name, [(ids[c[0]],) + c[1:] for c in head_commits],)
+                for head_name, head_commits in commits]
+
+    def write_patch(self, name, commit, subsys, subject, author, t,
+                    head_name, url):
+        if head_name == git_sort.head_name(*git_sort.remotes[0]):
+            mainline = ["Patch-mainline: v4.%d-rc1" % (t % 20,)]
+        else:
+            mainline = ["Patch-mainline: Queued in subsystem maintainer "
+                        "repository",
+                        "Git-repo: %s" % (url,)]
+        if commit is None:
+            mainline = ["Patch-mainline: Never, SUSE specific"]
+        path = "%s/%s.c" % (subsys, subsys.rsplit("/", 1)[-1],)
+        lines = ["From: %s <%s>" % (author, email(author),),
+                 "Date: %s" % (format_date(t),),
+                 "Subject: %s" % (subject,)] + mainline
+        if commit is not None:
+            lines.append("Git-commit: %s" % (commit,))
+        lines.extend([
+            "References: bsc#%d" % (1000000 + t % 100000,),
+            "",
+            "The code in %s needed a change." % (subsys,),
+            "",
+            "Signed-off-by: %s <%s>" % (author, email(author),),
+            "Acked-by: Sam Reviewer <sam@suse.com>",
+            "---",
+            " %s | 2 +-" % (path,),
+            " 1 file changed, 1 insertion(+), 1 deletion(-)",
+            "",
+            "--- a/%s" % (path,),
+            "+++ b/%s" % (path,),
+            "@@ -1,3 +1,3 @@",
+            " #include <linux/kernel.h>",
+            "-int value = 0;",
+            "+int value = 1;",
+            " ",
+            ""])
+        with open(os.path.join(self.source, name), "wb") as f:
+            f.write("\n".join(lines).encode("utf-8"))
+
+    def generate(self):
+        heads = self.build_repo()
+        urls = dict([(git_sort.head_name(*remote), remote[0],)
+                     for remote in self.heads])
+        os.makedirs(os.path.join(self.source, "patches.suse"))
+
+        everything = [(head_name,) + commit for head_name, commits in heads
+                      for commit in commits]
+        # every ratio-th commit is used, in upstream order
+        used = everything[::self.ratio]
+        self.random.shuffle(used)
+        listed = used[:self.patches]
+        spare = used[self.patches:self.patches + self.spare]
+        added = used[self.patches + self.spare:]
+        order = dict([(commit[1], i,) for i, commit in enumerate(everything)])
+        listed.sort(key=lambda commit: order[commit[1]])
+
+        names = set()
+
+        def patch_name(subject, commit):
+            name = "patches.suse/%s.patch" % (
+                re.sub("[^a-zA-Z0-9_.]+", "-", subject).strip("-"),)
+            if name in names:
+                name = "%s-%s.patch" % (name[:-6], commit[:8],)
+            names.add(name)
+            return name
+
+        groups = [(head_name, [],) for head_name, commits in heads]
+        group_index = dict([(head_name, i,)
+                            for i, (head_name, commits) in enumerate(heads)])
+        for head_name, commit, subsys, subject, author, t in listed:
+            name = patch_name(subject, commit)
+            self.write_patch(name, commit, subsys, subject, author, t,
+                             head_name, urls[head_name])
+            groups[group_index[head_name]][1].append("\t%s\n" % (name,))
+
+        added_names = []
+        for head_name, commit, subsys, subject, author, t in added:
+            name = patch_name(subject, commit)
+            self.write_patch(name, commit, subsys, subject, author, t,
+                             head_name, urls[head_name])
+            added_names.append(name)
+
+        oot = []
+        for i in range(max(1, self.patches // 100)):
+            subsys, subject, author, message = self.message(i)
+            name = patch_name("suse-%s" % (subject,), "%08d" % (i,))
+            self.write_patch(name, None, subsys, subject, author,
+                             _start_time + i, None, None)
+            oot.append("\t%s\n" % (name,))
+        groups.append(("out-of-tree patches", oot,))
+
+        with open(os.path.join(self.source, "series.conf"), "w") as f:
+            f.writelines(["# Kernel patches configuration file\n",
+                          "\n",
+                          "\t########################################\n",
+                          "\t# sorted patches\n",
+                          "\t########################################\n"])
+            f.writelines(lib.series_format(groups))
+            f.writelines(["\t########################################\n",
+                          "\t# end of sorted patches\n",
+                          "\t########################################\n",
+                          "\n",
+                          "\t# Wireless Networking\n",
+                          "\tpatches.suse/suse-wireless.patch\n"])
+        self.write_patch("patches.suse/suse-wireless.patch", None,
+                         "drivers/net/wireless", "wireless: SUSE change",
+                         _names[0], _start_time, None, None)
+
+        current = os.path.join(self.path, "current")
+        os.makedirs(current)
+        os.symlink(os.path.join("..", "kernel-source"),
+                   os.path.join(current, "patches"))
+        os.symlink(os.path.join("patches", "series.conf"),
+                   os.path.join(current, "series"))
+
+        metadata = {
+            "patches": self.patches,
+            "heads": [head_name for head_name, commits in heads],
+            "commits": len(everything),
+            "spare": [commit[1] for commit in spare],
+            "added": added_names,
+            # the last patch of the sorted section, the worst case for a
+            # linear search
+            "probe": listed[-1][1],
+        }
+        with open(os.path.join(self.path, "metadata.json"), "w") as f:
+            json.dump(metadata, f, indent=1, sort_keys=True)
+        return metadata
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Generate a synthetic LINUX_GIT repository and "
+        "kernel-source tree.")
+    parser.add_argument("-n", "--patches", type=int, default=1000,
+                        help="Number of patches in the sorted section of "
+                        "series.conf. Default: %(default)s")
+    parser.add_argument("--heads", type=int, default=3,
+                        help="Number of remote heads, taken from "
+                        "git_sort.remotes. Default: %(default)s")
+    parser.add_argument("--ratio", type=int, default=3,
+                        help="Number of upstream commits for each patch. "
+                        "Default: %(default)s")
+    parser.add_argument("--spare", type=int, default=100,
+                        help="Number of commits which are not in the series. "
+                        "Default: %(default)s")
+    parser.add_argument("--added", type=int, default=100,
+                        help="Number of patches which are written but not "
+                        "listed in series.conf. Default: %(default)s")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed of the random choices. Default: "
+                        "%(default)s")
+    parser.add_argument("path", help="Directory to create.")
+    args = parser.parse_args()
+
+    if os.path.exists(args.path):
+        print("Error: \"%s\" already exists." % (args.path,), file=sys.stderr)
+        sys.exit(1)
+    if not 0 < args.heads <= len(git_sort.remotes):
+        print("Error: there are %d remotes in git_sort.remotes." % (
+            len(git_sort.remotes),), file=sys.stderr)
+        sys.exit(1)
+
+    metadata = Generator(args.path, args.patches, args.heads, args.ratio,
+                         args.spare, args.added, args.seed).generate()
+    print("%d patches, %d commits on %d heads in %s" % (
+        metadata["patches"], metadata["commits"], len(metadata["heads"]),
+        args.path,))
+    print("LINUX_GIT=%s" % (os.path.join(os.path.abspath(args.path),
+                                         "linux"),))
@@ -0,0 +1,92 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Measure how loading the patches of the sorted section of series.conf, as
+done by series_sort.py and merge_tool.py, scales with the number of worker
+processes.
+
+Run it from the directory which contains series.conf, with LINUX_GIT set:
+    kernel-source$ ~/programming/suse/ksapply/benchmarks/load_entries.py
+
+The cache of patch header tags is emptied before each run so that the headers
+are read again, like on a cold cache. Nothing is written to the cache files.
+"""
+
+from __future__ import print_function
+
+import argparse
+import multiprocessing
+import os
+import os.path
+import sys
+import time
+
+os.environ["KSAPPLY_NO_CACHE"] = "1"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import lib
+import lib_tag
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time lib.load_entries() with different numbers of "
+        "worker processes.")
+    parser.add_argument("-j", "--jobs", type=int, action="append",
+                        help="Number of processes to try. May be specified "
+                        "more than once. Default: powers of 2 up to the "
+                        "number of cpus.")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="Number of runs for each number of processes; "
+                        "the fastest one is reported. Default: 3")
+    parser.add_argument("--warm", action="store_true",
+                        help="Keep the header tags in memory between runs.")
+    parser.add_argument("series", nargs="?", default="series.conf",
+                        metavar="series.conf",
+                        help="Default: series.conf")
+    args = parser.parse_args()
+
+    if args.jobs is None:
+        args.jobs = []
+        jobs = 1
+        while jobs < multiprocessing.cpu_count():
+            args.jobs.append(jobs)
+            jobs *= 2
+        args.jobs.append(multiprocessing.cpu_count())
+
+    repo = lib.open_repo()
+    with open(args.series) as f:
+        before, inside, after = lib.split_series(f)
+    os.chdir(os.path.dirname(os.path.abspath(args.series)))
+    patches = [(patch, "\t%s\n" % (patch,),)
+               for patch in [lib.firstword(line) for line in inside
+                             if lib.filter_patches(line)]]
+    print("%d patches, %d cpus" % (len(patches), multiprocessing.cpu_count(),))
+
+    reference = None
+    serial = None
+    print("%6s %10s %8s" % ("jobs", "seconds", "speedup",))
+    for jobs in args.jobs:
+        best = None
+        for i in range(args.repeat):
+            if not args.warm:
+                lib_tag.tag_cache().clear()
+            start = time.time()
+            entries = lib.load_entries(repo, patches, jobs)
+            elapsed = time.time() - start
+            if best is None or elapsed < best:
+                best = elapsed
+
+        result = [(entry.value, entry.commit, entry.subsys, entry.oot,)
+                  for entry in entries]
+        if reference is None:
+            reference = result
+        elif result != reference:
+            print("Error: the result with %d processes differs from the "
+                  "result with %d." % (jobs, args.jobs[0],), file=sys.stderr)
+            sys.exit(1)
+        if serial is None:
+            serial = best
+        print("%6d %10.3f %8.2f" % (jobs, best, serial / best,))
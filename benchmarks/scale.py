@@ -0,0 +1,284 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Measure how the series tools scale with the size of series.conf, on trees
+made by generate.py.
+
+Each benchmark is timed in a separate process, with an empty cache directory
+("cold") and with the cache files left by a previous run ("warm"). Only the
+call of the function being measured is timed, not the start of the process
+or the setup. The memory is the growth of the peak resident size of the
+process during that call. The results are printed as JSON so that they can
+be compared between revisions:
+    $ benchmarks/scale.py -s 1000,10000 -w /tmp/scale > before.json
+    (change something)
+    $ benchmarks/scale.py -s 1000,10000 -w /tmp/scale -c before.json > after.json
+
+With -w, the generated trees are kept in that directory and reused by later
+runs.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import os.path
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+libdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, libdir)
+
+
+def read_series(tree):
+    with open(os.path.join(tree, "kernel-source", "series.conf")) as f:
+        return f.readlines()
+
+
+def sorted_patches(lines):
+    import lib
+
+    before, inside, after = lib.split_series(lines)
+    return [lib.firstword(line) for line in inside if lib.filter_patches(line)]
+
+
+# Each benchmark does its setup and returns the function to time.
+
+def bench_split_series(tree, metadata):
+    import lib
+
+    lines = read_series(tree)
+    return lambda: lib.split_series(lines)
+
+
+def bench_filter_sorted(tree, metadata):
+    import lib
+
+    before, inside, after = lib.split_series(read_series(tree))
+    return lambda: lib.filter_sorted(inside)
+
+
+def bench_load_entries(tree, metadata):
+    import lib
+
+    patches = [(patch, "\t%s\n" % (patch,),)
+               for patch in sorted_patches(read_series(tree))]
+    repo = lib.open_repo()
+    os.chdir(os.path.join(tree, "kernel-source"))
+    return lambda: lib.load_entries(repo, patches)
+
+
+def bench_series_sort(tree, metadata):
+    import lib
+
+    lines = read_series(tree)
+    repo = lib.open_repo()
+    os.chdir(os.path.join(tree, "kernel-source"))
+    return lambda: lib.sort_series(repo, lines)
+
+
+def bench_sequence_insert(tree, metadata):
+    import lib
+
+    lines = read_series(tree)
+    repo = lib.open_repo()
+    os.chdir(os.path.join(tree, "kernel-source"))
+    return lambda: lib.sequence_insert(lines, metadata["spare"][0], None,
+                                       repo)
+
+
+def bench_find_commit_in_series(tree, metadata):
+    import lib
+
+    lines = read_series(tree)
+    os.chdir(os.path.join(tree, "current"))
+    return lambda: lib.find_commit_in_series(metadata["probe"], lines)
+
+
+def bench_merge_tool(tree, metadata):
+    import lib
+
+    before, inside, after = lib.split_series(read_series(tree))
+    repo = lib.open_repo()
+    os.chdir(os.path.join(tree, "kernel-source"))
+
+    def merge():
+        # what merge_tool.py does for the patches added in remote
+        entries = lib.load_entries(repo, [(patch, "\t%s\n" % (patch,),)
+                                          for patch in metadata["added"]])
+        return lib.merge_sorted(repo, inside, set(), entries)
+    return merge
+
+
+def bench_tag_get(tree, metadata):
+    import lib_tag
+
+    patches = sorted_patches(read_series(tree))
+    os.chdir(os.path.join(tree, "kernel-source"))
+
+    def get():
+        for patch in patches:
+            with open(patch) as f:
+                lib_tag.tag_get(f, "Git-commit")
+    return get
+
+
+benchmarks = (
+    ("split_series", bench_split_series,),
+    ("filter_sorted", bench_filter_sorted,),
+    ("load_entries", bench_load_entries,),
+    ("series_sort", bench_series_sort,),
+    ("sequence_insert", bench_sequence_insert,),
+    ("find_commit_in_series", bench_find_commit_in_series,),
+    ("merge_tool", bench_merge_tool,),
+    ("tag_get", bench_tag_get,),
+)
+
+
+def run_one(name, tree):
+    """
+    Time one benchmark in this process and print the result.
+    """
+    with open(os.path.join(tree, "metadata.json")) as f:
+        metadata = json.load(f)
+    function = dict(benchmarks)[name](tree, metadata)
+    # in kB on linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    result = function()
+    elapsed = time.time() - start
+    memory = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - peak) * 1024
+    del result
+    # write the tag cache now rather than at exit, like a command would
+    import lib_tag
+    lib_tag.tag_cache().save()
+    print(json.dumps({"seconds": elapsed, "memory": memory}))
+
+
+def get_tree(workdir, size):
+    tree = os.path.join(workdir, "series-%d" % (size,))
+    try:
+        with open(os.path.join(tree, "metadata.json")) as f:
+            if json.load(f)["patches"] == size:
+                return tree
+    except (IOError, ValueError, KeyError):
+        pass
+    if os.path.exists(tree):
+        shutil.rmtree(tree)
+    print("Generating %d patches in %s" % (size, tree,), file=sys.stderr)
+    with open(os.devnull, "w") as devnull:
+        subprocess.check_call([sys.executable,
+                               os.path.join(libdir, "benchmarks",
+                                            "generate.py"),
+                               "-n", str(size), tree], stdout=devnull)
+    return tree
+
+
+def measure(name, tree, cold):
+    cache = os.path.join(tree, "cache")
+    if cold and os.path.exists(cache):
+        shutil.rmtree(cache)
+    env = dict(os.environ, LINUX_GIT=os.path.join(tree, "linux"),
+               KSAPPLY_CACHE=cache, KSAPPLY_NO_SERVER="1")
+    env.pop("GIT_DIR", None)
+    env.pop("KSAPPLY_NO_CACHE", None)
+    output = subprocess.check_output([sys.executable, os.path.abspath(__file__),
+                                      "--run-one", name, tree], env=env)
+    result = json.loads(output.decode("utf-8"))
+    return (result["seconds"], result["memory"],)
+
+
+def revision():
+    try:
+        with open(os.devnull, "w") as devnull:
+            return subprocess.check_output(
+                ("git", "describe", "--always", "--dirty",), cwd=libdir,
+                stderr=devnull).decode("utf-8").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time the series tools on generated trees of several "
+        "sizes and print the results as JSON.")
+    parser.add_argument("-s", "--sizes", default="1000,5000,10000",
+                        help="Comma separated numbers of patches in the "
+                        "sorted section. Default: %(default)s")
+    parser.add_argument("-b", "--benchmark", action="append",
+                        choices=[name for name, function in benchmarks],
+                        help="Benchmark to run. May be specified more than "
+                        "once. Default: all")
+    parser.add_argument("-r", "--repeat", type=int, default=3,
+                        help="Number of runs of each measurement; the "
+                        "fastest one is reported. Default: %(default)s")
+    parser.add_argument("-w", "--workdir",
+                        help="Directory where the generated trees are kept "
+                        "between runs. Default: a temporary directory.")
+    parser.add_argument("-c", "--compare", metavar="FILE",
+                        help="Print, on stderr, the ratio of each result to "
+                        "the one in FILE, the output of a previous run.")
+    parser.add_argument("--run-one", nargs=2, metavar=("BENCHMARK", "TREE",),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        run_one(*args.run_one)
+        sys.exit(0)
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    names = args.benchmark or [name for name, function in benchmarks]
+    workdir = args.workdir
+    if workdir is None:
+        workdir = tempfile.mkdtemp(prefix="ksapply-scale.")
+    elif not os.path.isdir(workdir):
+        os.makedirs(workdir)
+
+    previous = {}
+    if args.compare:
+        with open(args.compare) as f:
+            for result in json.load(f)["results"]:
+                previous[(result["size"], result["benchmark"],
+                          result["cache"],)] = (result["seconds"],
+                                                result.get("memory"),)
+
+    results = []
+    try:
+        for size in sizes:
+            tree = get_tree(workdir, size)
+            for name in names:
+                for cache in ("cold", "warm",):
+                    runs = [measure(name, tree, cache == "cold")
+                            for i in range(args.repeat)]
+                    seconds = min([run[0] for run in runs])
+                    memory = min([run[1] for run in runs])
+                    results.append({"size": size, "benchmark": name,
+                                    "cache": cache, "seconds": seconds,
+                                    "memory": memory})
+                    line = "%6d %-22s %-5s %9.4f %8dk" % (
+                        size, name, cache, seconds, memory // 1024,)
+                    key = (size, name, cache,)
+                    if key in previous:
+                        old_seconds, old_memory = previous[key]
+                        if old_seconds:
+                            line += " %6.2fx" % (seconds / old_seconds,)
+                        if old_memory:
+                            line += " %6.2fx" % (float(memory) / old_memory,)
+                    print(line, file=sys.stderr)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir)
+
+    json.dump({"revision": revision(),
+               "python": platform.python_version(),
+               "date": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+               "repeat": args.repeat,
+               "results": results}, sys.stdout, indent=1, sort_keys=True)
+    print()
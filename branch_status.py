@@ -0,0 +1,225 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Check which branches of kernel-source.git already carry a list of upstream
+commits, without checking them out.
+
+series.conf and the patch headers are read from the git objects of each
+branch. The tags of the patch headers are cached by blob id (see
+lib_tag.BlobTagCache), so a patch which is the same on several branches is
+only read once, and later runs only read the patches which changed.
+
+Read git references from stdin, like refs_in_series.py, resolve them in the
+repository at LINUX_GIT and print a matrix with one line per commit and one
+column per branch:
+    + the commit is in the Git-commit tag of a patch of the branch
+    - it is not
+    ? the series of the branch could not be read
+"""
+
+from __future__ import print_function
+
+import argparse
+import bisect
+import fnmatch
+import multiprocessing
+import pygit2
+import sys
+
+import lib
+import lib_tag
+
+
+def tracking_branches(repo):
+    """
+    Returns a list
+        [(branch name, remote tracking ref,)]
+    for the local branches which track the remote branch of the same name,
+    like update-configs.sh.
+    """
+    result = []
+    for name in repo.listall_branches():
+        try:
+            remote = repo.config["branch.%s.remote" % (name,)]
+            merge = repo.config["branch.%s.merge" % (name,)]
+        except KeyError:
+            continue
+        if merge != "refs/heads/%s" % (name,):
+            continue
+        result.append((name, "refs/remotes/%s/%s" % (remote, name,),))
+    return result
+
+
+def series_patches(repo, tree):
+    """
+    Returns a list
+        [(patch name, blob id,)]
+    for the patches of the series.conf of tree which are present in tree.
+    """
+    series = repo[tree["series.conf"].id].data.decode("utf-8", "replace")
+    # patch name: blob id, for the files of the patches.* directories
+    blobs = {}
+    for entry in tree:
+        if not entry.name.startswith("patches."):
+            continue
+        obj = repo[entry.id]
+        if not isinstance(obj, pygit2.Tree):
+            continue
+        stack = [(entry.name, obj,)]
+        while stack:
+            path, subtree = stack.pop()
+            for sub in subtree:
+                name = "%s/%s" % (path, sub.name,)
+                if sub.filemode == pygit2.GIT_FILEMODE_TREE:
+                    stack.append((name, repo[sub.id],))
+                else:
+                    blobs[name] = sub.id
+    return [(name, blobs[name],)
+            for name in [lib.firstword(line)
+                         for line in series.splitlines()
+                         if lib.filter_patches(line)]
+            if name in blobs]
+
+
+def find_commits(commits, tags):
+    """
+    Returns the subset of commits which match one of tags. Either may be an
+    abbreviated id of the other.
+    """
+    tags = sorted(tags)
+    result = set()
+    for commit in commits:
+        # a tag which starts with commit comes right after it
+        i = bisect.bisect_left(tags, commit)
+        if i < len(tags) and tags[i].startswith(commit):
+            result.add(commit)
+            continue
+        # a tag which is a prefix of commit
+        for n in range(1, len(commit)):
+            j = bisect.bisect_left(tags, commit[:n], 0, i)
+            if j < i and tags[j] == commit[:n]:
+                result.add(commit)
+                break
+    return result
+
+
+_repo = None
+_commits = None
+
+
+def _init(repo_path, commits):
+    global _repo, _commits
+    _repo = pygit2.Repository(repo_path)
+    _commits = commits
+
+
+def _check_branch(ref):
+    """
+    Returns a tuple
+        (set of the commits present, {new blob tag cache entries},
+         error or None,)
+    """
+    cache = lib_tag.blob_tag_cache()
+    try:
+        tree = _repo.revparse_single(ref).peel(pygit2.Commit).tree
+        patches = series_patches(_repo, tree)
+    except (KeyError, ValueError):
+        return (set(), {}, "could not read series.conf from \"%s\"" % (ref,),)
+    tags = set()
+    for name, oid in patches:
+        tags.update([lib.firstword(tag).lower()
+                     for tag in cache.get_all(_repo, oid)["Git-commit"]
+                     if tag.strip()])
+    entries = cache.new
+    cache.new = {}
+    return (find_commits(_commits, tags), entries, None,)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Read git references from stdin, resolve them in the "
+        "repository at LINUX_GIT and print which branches of "
+        "kernel-source.git carry them, without checking out the branches.")
+    parser.add_argument("-b", "--branch", action="append",
+                        help="Pattern (fnmatch) of the names of the branches "
+                        "to check, among the local branches which track the "
+                        "remote branch of the same name. May be specified "
+                        "more than once. Default: all of them")
+    parser.add_argument("-r", "--ref", action="append", default=[],
+                        help="Also check this ref. May be specified more "
+                        "than once.")
+    parser.add_argument("-j", "--jobs", type=int,
+                        default=multiprocessing.cpu_count(),
+                        help="Number of processes used to read the "
+                        "branches. Default: number of cpus")
+    parser.add_argument("-g", "--git-dir", default=".",
+                        help="Path of the kernel-source.git repository. "
+                        "Default: the repository of the current directory")
+    args = parser.parse_args()
+
+    repo_path = pygit2.discover_repository(args.git_dir)
+    if repo_path is None:
+        print("Error: no git repository found at \"%s\"." % (args.git_dir,),
+              file=sys.stderr)
+        sys.exit(1)
+    repo = pygit2.Repository(repo_path)
+
+    branches = [(name, ref,) for name, ref in tracking_branches(repo)
+                if args.branch is None or
+                [pattern for pattern in args.branch
+                 if fnmatch.fnmatchcase(name, pattern)]]
+    branches.extend([(ref, ref,) for ref in args.ref])
+    if not branches:
+        print("Error: no branch to check.", file=sys.stderr)
+        sys.exit(1)
+
+    lines = [line.rstrip("\n") for line in sys.stdin if line.strip()]
+    try:
+        commits = lib.resolve_commits(lib.open_repo(),
+                                      [lib.firstword(line) for line in lines])
+    except lib.KSException as err:
+        print("Error: %s" % (err,), file=sys.stderr)
+        sys.exit(1)
+
+    cache = lib_tag.blob_tag_cache()
+    # load it once, before the workers are forked
+    cache.load()
+    refs = [ref for name, ref in branches]
+    if args.jobs > 1 and len(refs) > 1:
+        pool = multiprocessing.Pool(min(args.jobs, len(refs)), _init,
+                                    (repo_path, commits,))
+        try:
+            results = pool.map(_check_branch, refs, 1)
+        except:
+            pool.terminate()
+            raise
+        else:
+            pool.close()
+        finally:
+            pool.join()
+    else:
+        _init(repo_path, commits)
+        results = [_check_branch(ref) for ref in refs]
+
+    for (name, ref,), (found, entries, error,) in zip(branches, results):
+        cache.update(entries)
+        if error:
+            print("Warning: %s" % (error,), file=sys.stderr)
+    cache.save()
+
+    widths = [max(len(name), 1) for name, ref in branches]
+    print("%-12s %s" % ("", " ".join([name for name, ref in branches]),))
+    for line, commit in zip(lines, commits):
+        cells = []
+        for width, (found, entries, error,) in zip(widths, results):
+            if error:
+                cell = "?"
+            elif commit in found:
+                cell = "+"
+            else:
+                cell = "-"
+            cells.append(cell.center(width))
+        rest = line.split(None, 1)[1:]
+        print(("%-12s %s%s" % (commit[:12], " ".join(cells),
+                               " %s" % (rest[0],) if rest else "",)).rstrip())
@@ -0,0 +1,72 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Check if a commit is referenced in the log of later commits.
+Useful to identify missing followup commits.
+
+Read a list of git hashes from stdin and print information about commits which
+reference these hashes in their log and which are not part of the list.
+
+The input list must be partially ordered such that if it already contains some
+fixes, they appear after the commit they fix. Otherwise, fixes may appear
+multiple times in the output. Use `git sort` if needed.
+
+The log messages are searched through an index (see lib_fixes.py) which is
+kept under the cache directory and updated when new commits are fetched.
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import pygit2
+import sys
+
+import lib
+import lib_fixes
+import lib_patch
+
+
+indent = "    "
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Read a list of git hashes from stdin and print "
+        "information about commits which reference these hashes in their log "
+        "and which are not part of the list.")
+    parser.parse_args()
+
+    repo = pygit2.Repository(pygit2.discover_repository(
+        os.environ.get("GIT_DIR", os.getcwd())))
+    index = lib_fixes.ReferenceIndex.open(repo)
+    head = str(repo.head.target)
+
+    lines = [line.rstrip("\n") for line in sys.stdin if line.strip()]
+    output = []
+    # abbreviated ids of the commits which are after the current one in the
+    # list
+    known = set()
+    for line in reversed(lines):
+        rev = lib.firstword(line)
+        try:
+            commit = repo.revparse_single(rev).peel(pygit2.Commit)
+        except (KeyError, ValueError, pygit2.GitError):
+            print("Error: revision \"%s\" not found." % (rev,),
+                  file=sys.stderr)
+            sys.exit(1)
+        short = commit.short_id
+        fixes = []
+        for fix in index.find(commit, short, head):
+            fix_id = str(fix.id)
+            if [k for k in known if fix_id.startswith(k)]:
+                continue
+            fixes.append("%s%s %s" % (indent, fix.short_id,
+                                      lib_patch.subject(fix),))
+        known.add(short)
+        output.extend(fixes)
+        output.append(line)
+
+    for line in reversed(output):
+        print(line)
@@ -0,0 +1,578 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Filter patch files such that they are properly formatted per SUSE rules.
+Useful when importing patches into SUSE's kernel-source.git.
+
+This gives the same result as the shell implementation in clean_header.sh
+but works on lib_tag.Header instead of running the lib_tag.sh pipelines for
+each tag. Several patches can be cleaned in one run; the upstream status of
+their commits is then described with a single `git name-rev` call.
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import os.path
+import pygit2
+import re
+import subprocess
+import sys
+import tempfile
+
+import lib
+import lib_patch
+import lib_tag
+import lib_trace
+
+
+def native(text):
+    """
+    Returns text as the str type, for output on python 2.
+    """
+    if not isinstance(text, str):
+        return text.encode("utf-8")
+    return text
+
+
+def decode(data):
+    """
+    Returns (text, encoding,) for the content of a patch file.
+    """
+    for encoding in ("utf-8", "latin-1",):
+        try:
+            return (data.decode(encoding), encoding,)
+        except UnicodeDecodeError:
+            pass
+
+
+def from_extract(lines):
+    """
+    Remove the "From <commit id>" line of a patch generated by git.
+    """
+    if lines and re.match("From [0-9a-f]+", lines[0]):
+        return lines[1:]
+    return lines
+
+
+def clean_conflicts(lines):
+    """
+    Remove the "Conflicts:" section of a cherry-picked commit, like
+    clean_conflicts.awk.
+    """
+    result = []
+    conflicts = 0
+    last = ""
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        i += 1
+        if line == "Conflicts:":
+            conflicts = 1
+            i += 1
+            continue
+        if line == "---":
+            if conflicts == 0:
+                result.append(last)
+            conflicts = 2
+        if conflicts == 0:
+            if i != 1:
+                result.append(last)
+            last = line
+        elif conflicts == 2:
+            result.append(line)
+    return result
+
+
+def remove_subject_annotation(subject):
+    return re.sub(r"^( *\[[^]]*\] *)+", "", subject)
+
+
+def diffstat_files(lines):
+    """
+    Returns the number of files that `diffstat -l -p1` lists for a patch
+    after going through cheat_diffstat, which makes it list renames.
+    """
+    files = set()
+    git_file = None
+    for i, line in enumerate(lines):
+        if line.startswith("diff --git "):
+            git_file = line.split()[-1].split("/", 1)[-1]
+        elif line.startswith("+++ ") and i > 0 and lines[i - 1].startswith(
+                "--- "):
+            path = line[4:].split("\t", 1)[0].strip()
+            if path == "/dev/null":
+                path = lines[i - 1][4:].split("\t", 1)[0].strip()
+            files.add(path.split("/", 1)[-1])
+        elif (line.startswith(("rename to ", "GIT binary patch",)) or
+              re.match("Binary files .* differ$", line)) and git_file:
+            files.add(git_file)
+    return len(files)
+
+
+def bre_to_re(pattern):
+    """
+    Convert a grep basic regular expression to a Python one.
+    """
+    result = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "\\" and i + 1 < len(pattern):
+            c = pattern[i + 1]
+            i += 2
+            if c in "(){}|+?":
+                result.append(c)
+            elif c in "<>":
+                result.append(r"\b")
+            elif c.isalnum():
+                result.append("\\" + c)
+            else:
+                result.append(re.escape(c))
+            continue
+        if c == "[":
+            end = pattern.find("]", i + (3 if pattern[i + 1:i + 2] == "^"
+                                         else 2))
+            if end < 0:
+                raise re.error("unmatched [")
+            result.append(pattern[i:end + 1].replace("\\", "\\\\"))
+            i = end + 1
+            continue
+        if c in "+?(){}|" or (c == "*" and (
+                not result or result[-1] in ("^", "(",))) or (
+                    c == "^" and i != 0) or (
+                        c == "$" and i != len(pattern) - 1):
+            result.append("\\" + c)
+        else:
+            result.append(c)
+        i += 1
+    return re.compile("".join(result))
+
+
+def missing_attributions(patch_attributions, original_attributions):
+    """
+    Returns the original attributions that are not in the patch, like
+        grep -vf <(echo "$patch_attributions") \
+            <(echo "$original_attributions")
+    does.
+    """
+    try:
+        patterns = [bre_to_re(line) for line in patch_attributions or [""]]
+    except re.error:
+        return []
+    return [line for line in original_attributions or [""]
+            if not [p for p in patterns if p.search(line)]]
+
+
+class Override(object):
+    """
+    Value that is set from several sources in increasing order of priority,
+    like var_override() in lib.sh.
+    """
+    def __init__(self, warn):
+        self.warn = warn
+        self.value = ""
+        self.src = ""
+
+    def set(self, value, src="", allow_empty=False):
+        value = value or ""
+        if not value and not allow_empty:
+            return
+        if self.value and value != self.value and self.src:
+            self.warn("Warning: %s (\"%s\") and %s (\"%s\") differ. Using %s." %
+                      (src, value, self.src, self.value, src,))
+        if not self.value or value != self.value:
+            self.value = value
+            self.src = src
+
+
+class PatchCleaner(object):
+    """
+    Clean the header of a patch like clean_header.sh. This is done in two
+    steps so that the commits of several patches can be described together:
+        cleaners = [PatchCleaner(repo, text) for text in texts]
+        descriptions = lib_patch.describe_commits(
+            [c.commit for c in cleaners if c.commit])
+        results = [c.finish(descriptions) for c in cleaners]
+    """
+    def __init__(self, repo, text, commit=None, reference=None,
+                 soft_reference=None, skip=(), name=None, diff=None):
+        self.repo = repo
+        # result of lib_patch.commit_diff() for commit, if known
+        self.diff = diff
+        self.reference = reference
+        self.soft_reference = soft_reference
+        self.skip = skip
+        self.name = name
+        self.edit = False
+
+        text = text.replace("\r", "")
+        header, body = lib_tag.split_patch(text)
+        self.body = body
+        self.header = lib_tag.Header(clean_conflicts(from_extract(header)))
+        self.commit = self.find_commit(commit)
+
+    def warn(self, message):
+        if self.name:
+            message = "%s: %s" % (self.name, message,)
+        print(native(message), file=sys.stderr)
+
+    def expand(self, value):
+        """
+        Returns the full id of the commit at the start of value, like
+        expand_git_ref().
+        """
+        rev = lib.firstword(value)
+        try:
+            return str(self.repo.revparse_single(rev).peel(pygit2.Commit).id)
+        except (KeyError, ValueError, pygit2.GitError):
+            raise lib.KSError("revision \"%s\" not found in \"%s\"." % (
+                rev, self.repo.path,))
+
+    def find_commit(self, opt_commit):
+        header = self.header
+
+        cherry = header.get("cherry picked from commit")
+        if cherry:
+            cherry = self.expand(cherry)
+            header.remove("cherry picked from commit")
+
+        git_commit = header.get("git-commit")
+        if git_commit:
+            git_commit = self.expand(git_commit)
+            header.remove("git-commit")
+
+        if opt_commit:
+            opt_commit = self.expand(opt_commit)
+
+        # command line > Git-commit > cherry
+        commit = Override(self.warn)
+        commit.set(cherry, "cherry picked from commit")
+        commit.set(git_commit, "Git-commit")
+        commit.set(opt_commit, "command line commit")
+
+        if not commit.value:
+            commit.set(self.search_commit(), "git log --grep commit")
+
+        if not commit.value:
+            self.warn("Warning: Upstream commit id unknown, you will have to "
+                      "edit the patch header manually.")
+            header.add("Git-commit", "(fill me in)")
+            self.edit = True
+            return None
+
+        commit_str = commit.value
+        if self.body:
+            diff = self.diff
+            if diff is None or commit.value != opt_commit:
+                diff = lib_patch.commit_diff(self.repo,
+                                             self.repo[commit.value])
+            diff = diff.patch or ""
+            if (diffstat_files(diff.split("\n")) !=
+                    diffstat_files(self.body)):
+                commit_str += " (partial)"
+        header.add("Git-commit", commit_str)
+        return commit.value
+
+    def search_commit(self):
+        """
+        Look for the commit in the history of LINUX_GIT using the subject of
+        the patch, ask the user if there is not a single match.
+        """
+        subject = remove_subject_annotation(self.header.get("subject") or "")
+        args = ("git", "log", "--reverse",
+                "--pretty=tformat:%h%x09%ai%x09%aN <%aE>%x09%s", "-F",
+                "--grep", subject,)
+        with lib_trace.command_phase(args):
+            output = subprocess.check_output(
+                args, preexec_fn=lib.restore_signals).decode("utf-8",
+                                                             "replace")
+        found = [line for line in output.splitlines() if subject in line]
+        if len(found) == 1:
+            return self.expand(found[0])
+        elif sys.stdin.isatty():
+            if not found:
+                print(native("Upstream commit id unknown for patch \"%s\", "
+                             "enter it now?" % (subject,)))
+            else:
+                print(native("Upstream commit id unknown for patch \"%s\", %d "
+                             "potential commits found in git log. Which one "
+                             "to use?" % (subject, len(found),)))
+                for line in found:
+                    print(native("   ".join(line.split("\t")[:3])))
+            sys.stdout.flush()
+            sys.stderr.write("(<refspec>/empty cancels): ")
+            answer = sys.stdin.readline().strip()
+            if answer:
+                return self.expand(answer)
+        return None
+
+    @lib_trace.traced("clean_header")
+    def finish(self, descriptions):
+        """
+        Returns the text of the cleaned patch.
+        """
+        header = self.header
+        commit = self.commit
+
+        git_describe = ""
+        describe_url = ""
+        if commit:
+            git_describe, describe_url = lib_patch.mainline_status(
+                self.repo, commit, descriptions[commit])
+
+        # Patch-mainline:
+        patch_mainline = header.get("patch-mainline") or ""
+        header.remove("patch-mainline")
+        # Sometimes the tag does not include -rcX, I prefer to have it
+        if patch_mainline == git_describe.rsplit("-rc", 1)[0]:
+            patch_mainline = git_describe
+        # git describe > Patch-mainline
+        ml_status = Override(self.warn)
+        ml_status.set(patch_mainline, "Patch-mainline")
+        ml_status.set(git_describe, "git describe result")
+        if not ml_status.value:
+            self.warn("Warning: Mainline status unknown, you will have to "
+                      "edit the patch header manually.")
+            header.add("Patch-mainline", "(fill me in)")
+            self.edit = True
+        else:
+            header.add("Patch-mainline", ml_status.value)
+
+        # Git-repo:
+        git_repo = header.get("git-repo")
+        header.remove("git-repo")
+        # git config > Git-repo
+        remote_url = Override(self.warn)
+        remote_url.set(git_repo, "Git-repo")
+        remote_url.set(describe_url, "git describe and remote configuration",
+                       allow_empty=True)
+        if remote_url.value:
+            header.add("Git-repo", remote_url.value)
+
+        # Patch-filtered:
+        # may be added by the exportpatch tool
+        header.remove("patch-filtered")
+
+        # References:
+        cherry = header.get("cherry picked for")
+        if cherry:
+            header.remove("cherry picked for")
+        references = header.get("references", last=True)
+        if references:
+            header.remove("references", last=True)
+        # command line > References > cherry > command line (soft)
+        ref = Override(self.warn)
+        ref.set(self.soft_reference)
+        ref.set(cherry, "cherry picked for")
+        ref.set(references, "References")
+        ref.set(self.reference, "command line reference")
+        if not ref.value:
+            self.warn("Warning: Reference information unknown, you will have "
+                      "to edit the patch header manually.")
+            header.add("References", "(fill me in)")
+            self.edit = True
+        else:
+            header.add("References", ref.value, last=True)
+
+        original = None
+        if commit:
+            # like `git format-patch -p $commit^..$commit`
+            original = lib_tag.Header(lib_patch.format_header(
+                self.repo, self.repo[commit], notes=False,
+                subject_prefix="[PATCH] "))
+            self.clean_origin(original)
+
+        # Clean attributions
+        # this may be added by exportpatch in its default configuration
+        header.lines = [line for line in header.lines if
+                        "Acked-by: Your Name <user@business.com>" not in line]
+        if original is not None:
+            missing = missing_attributions(header.attributions(),
+                                           original.attributions())
+            # like `echo -n "$missing" | wc -l`
+            count = max(len(missing) - 1, 0)
+            if count > 0:
+                self.warn("Warning: %d attribution lines missing from the "
+                          "patch file. Adding them." % (count,))
+                header.insert_attributions(missing)
+
+        # Add Acked-by:
+        signature = self.signature()
+        patterns = [signature]
+        for skip in self.skip:
+            patterns.extend(skip.split())
+        if not [name for name in header.attribution_names()
+                for pattern in patterns if pattern in name]:
+            header.add("Acked-by", signature)
+
+        text = header.text()
+        if self.edit:
+            text = self.edit_header(text)
+        return text + "".join(["%s\n" % (line,) for line in self.body])
+
+    def clean_origin(self, original):
+        """
+        Take From:, Date: and Subject: from the commit.
+        """
+        header = self.header
+
+        patch_from = header.get("from", last=True)
+        header.remove("from", last=True)
+        original_from = original.get("from", last=True)
+        # git format-patch > From
+        value = Override(self.warn)
+        value.set(patch_from, "patch file From:")
+        value.set(original_from, "git format-patch From:")
+        header.add("From", value.value, last=True)
+
+        patch_date = header.get("date")
+        header.remove("date")
+        original_date = original.get("date")
+        # git format-patch > date
+        value = Override(self.warn)
+        value.set(patch_date, "patch file Date:")
+        value.set(original_date, "git format-patch Date:")
+        header.add("Date", value.value)
+
+        patch_subject = remove_subject_annotation(header.get("subject") or "")
+        original_subject = remove_subject_annotation(
+            original.get("subject") or "")
+        # git format-patch > Subject
+        value = Override(self.warn)
+        value.set(patch_subject, "patch file Subject:")
+        value.set(original_subject, "git format-patch Subject:")
+        if original_subject != patch_subject:
+            header.remove("subject")
+            header.add("Subject", value.value)
+        # else ... keep the changes lower between the original patch file and
+        # the cleaned one
+
+    def signature(self):
+        values = []
+        for key in ("user.name", "user.email",):
+            try:
+                values.append(self.repo.config[key])
+            except KeyError:
+                values.append("")
+        name, email = values
+        if not name or not email:
+            self.warn("Warning: user signature incomplete (%s <%s>), you will "
+                      "have to edit the patch header manually. Check the "
+                      "LINUX_GIT environment variable and the git "
+                      "configuration." % (name or "(empty name)",
+                                          email or "(empty email)",))
+            self.edit = True
+        return "%s <%s>" % (name or "Name", email or "user@example.com",)
+
+    def edit_header(self, text):
+        if not sys.stdin.isatty():
+            self.warn("Warning: input is not from a terminal, cannot edit "
+                      "header now.")
+            return text
+
+        editor = (os.environ.get("EDITOR") or os.environ.get("VISUAL") or
+                  "vi")
+        fd, path = tempfile.mkstemp(prefix="clean_header.")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(text.encode("utf-8"))
+            subprocess.check_call(editor.split() + [path],
+                                  preexec_fn=lib.restore_signals)
+            with open(path, "rb") as f:
+                return decode(f.read())[0]
+        finally:
+            os.unlink(path)
+
+
+def open_linux_git():
+    """
+    Returns the repository at LINUX_GIT, like clean_header.sh expects it.
+    """
+    path = os.environ.get("LINUX_GIT", "")
+    try:
+        repo = pygit2.Repository(pygit2.discover_repository(path))
+    except (KeyError, TypeError, ValueError, pygit2.GitError):
+        repo = None
+    if not os.path.isdir(path) or repo is None:
+        print("Warning: kernel git tree not found at \"%s\" (check the "
+              "LINUX_GIT environment variable)" % (path,), file=sys.stderr)
+        sys.exit(1)
+    # for `git log` and `git name-rev`
+    os.environ["GIT_DIR"] = repo.path
+    return repo
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Filter patch files such that they are properly "
+        "formatted per SUSE rules. The files are modified in place; without "
+        "a file, the patch is read from stdin and written to stdout.")
+    parser.add_argument("-c", "--commit",
+                        help="Upstream commit id used to tag the patch file.")
+    parser.add_argument("-r", "--reference",
+                        help="bsc or fate number used to tag the patch file.")
+    parser.add_argument("-R", "--soft-reference",
+                        help="bsc or fate number used to tag the patch file "
+                        "if no other reference is found.")
+    parser.add_argument("-s", "--skip", action="append", default=[],
+                        metavar="DOMAIN",
+                        help="Skip adding Acked-by tag if there is already an "
+                        "attribution line with an email from this domain. "
+                        "(Can be used multiple times.)")
+    parser.add_argument("patches", nargs="*", metavar="patch file")
+    args = parser.parse_args()
+
+    if args.commit and len(args.patches) > 1:
+        print("Error: --commit can only be used with a single patch.",
+              file=sys.stderr)
+        sys.exit(1)
+
+    repo = open_linux_git()
+
+    if args.patches:
+        texts = []
+        for path in args.patches:
+            with open(path, "rb") as f:
+                texts.append(decode(f.read()))
+    else:
+        texts = [decode(getattr(sys.stdin, "buffer", sys.stdin).read())]
+    several = len(texts) > 1
+
+    result = 0
+    cleaners = []
+    for i, (text, encoding,) in enumerate(texts):
+        name = args.patches[i] if several else None
+        try:
+            cleaners.append(PatchCleaner(repo, text, args.commit,
+                                         args.reference, args.soft_reference,
+                                         args.skip, name))
+        except lib.KSException as err:
+            print("Error: %s%s" % ("%s: " % (name,) if name else "", err,),
+                  file=sys.stderr)
+            cleaners.append(None)
+            result = 1
+
+    descriptions = lib_patch.describe_commits(
+        [cleaner.commit for cleaner in cleaners if cleaner and cleaner.commit])
+
+    for i, cleaner in enumerate(cleaners):
+        if cleaner is None:
+            continue
+        try:
+            text = cleaner.finish(descriptions)
+        except lib.KSException as err:
+            print("Error: %s%s" % ("%s: " % (cleaner.name,) if cleaner.name
+                                   else "", err,), file=sys.stderr)
+            result = 1
+            continue
+        data = text.encode(texts[i][1], "replace")
+        if args.patches:
+            with open(args.patches[i], "wb") as f:
+                f.write(data)
+        else:
+            getattr(sys.stdout, "buffer", sys.stdout).write(data)
+
+    sys.exit(result)
@@ -7,6 +7,14 @@
 progname=$(basename "$0")
 libdir=$(dirname "$(readlink -f "$0")")
 
+# clean_header.py implements the same rules without running several
+# processes for each tag. Set CLEAN_HEADER_PY=1 to use it instead of the
+# implementation below. benchmarks/clean_header.py compares the output of
+# both.
+if [ -n "$CLEAN_HEADER_PY" ]; then
+	exec "$libdir"/clean_header.py "$@"
+fi
+
 export GIT_DIR=$LINUX_GIT/.git
 : ${EDITOR:=${VISUAL:=vi}}
 
@@ -0,0 +1,327 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Compare the patches of SUSE's kernel-source.git to the upstream commits named
+in their Git-commit tag. This is `qdiffcheck` for a whole series, without
+applying anything.
+
+The diff of each commit is computed with pygit2 and compared to the diff in
+the patch, file by file, ignoring the line numbers of the hunks and the
+lines outside of them. A hunk which only moved, as is common in backports,
+does not count as a difference. Each patch is classified as:
+    identical   the lines of the hunks are the same
+    context     the added and removed lines are the same but some context
+                lines differ or the hunks are split differently
+    modified    some files are missing, added or changed differently
+Patches whose commit is not found in the repository, including those which
+have a Git-repo tag, are reported as "unknown".
+
+The results are cached by patch content and commit id, so a later audit only
+compares the patches which changed.
+"""
+
+from __future__ import print_function
+
+import argparse
+import hashlib
+import multiprocessing
+import pygit2
+import re
+import sys
+
+import lib
+import lib_cache
+import lib_patch
+import lib_tag
+
+
+_hunk_re = re.compile(r"^@@ -\d+(?:,(\d+))? \+\d+(?:,(\d+))? @@")
+
+
+def text(data):
+    if isinstance(data, bytes):
+        return data.decode("utf-8", "replace")
+    return data
+
+
+def strip_component(path):
+    """
+    Remove the first component of a path from a patch, like `git apply` does
+    by default ("a/", "b/").
+    """
+    return path.split("/", 1)[-1]
+
+
+def diff_path(line):
+    """
+    Returns the path of a "--- " or "+++ " line.
+    """
+    return line[4:].split("\t", 1)[0].strip()
+
+
+def parse_diff(lines):
+    """
+    Returns a dict
+        path: (hunks, changes,)
+    hunks is the list of the lines of the hunks of the file, without the
+    "@@" lines. changes is the list of the added and removed lines only. A
+    binary change is represented by the line "binary" in both lists.
+    """
+    files = {}
+    current = None
+    old_path = None
+    # lines of the current hunk which are left, old and new side
+    old_left = new_left = 0
+    for line in lines:
+        if old_left > 0 or new_left > 0:
+            if line.startswith("\\"):
+                current[0].append(line)
+                continue
+            current[0].append(line)
+            if line.startswith("-"):
+                old_left -= 1
+                current[1].append(line)
+            elif line.startswith("+"):
+                new_left -= 1
+                current[1].append(line)
+            else:
+                old_left -= 1
+                new_left -= 1
+            continue
+
+        if line.startswith("diff --git "):
+            current = files.setdefault(strip_component(line.split()[-1]),
+                                       ([], [],))
+        elif line.startswith("--- "):
+            old_path = diff_path(line)
+        elif line.startswith("+++ ") and old_path is not None:
+            path = diff_path(line)
+            if path == "/dev/null":
+                path = old_path
+            current = files.setdefault(strip_component(path), ([], [],))
+            old_path = None
+        elif current is not None and line.startswith("@@ "):
+            match = _hunk_re.match(line)
+            if match:
+                old_left, new_left = [1 if count is None else int(count)
+                                      for count in match.groups()]
+        elif current is not None and (line.startswith("GIT binary patch") or
+                                      line.startswith("Binary files ")):
+            # the content of binary changes is not compared, only their
+            # presence
+            if "binary" not in current[1]:
+                current[0].append("binary")
+                current[1].append("binary")
+    return files
+
+
+def classify(upstream, patch):
+    """
+    upstream and patch are results of parse_diff().
+
+    Returns a tuple
+        (state, [missing path], [added path], [changed path],)
+    """
+    if upstream == patch:
+        return ("identical", [], [], [],)
+    missing = sorted(set(upstream) - set(patch))
+    added = sorted(set(patch) - set(upstream))
+    changed = sorted([path for path in set(upstream) & set(patch)
+                      if upstream[path][1] != patch[path][1]])
+    if missing or added or changed:
+        return ("modified", missing, added, changed,)
+    else:
+        return ("context", [], [], [],)
+
+
+def describe(result):
+    state, missing, added, changed = result
+    details = []
+    for name, paths in (("missing", missing,), ("added", added,),
+                        ("changed", changed,),):
+        if paths:
+            details.append("%s: %s" % (name, " ".join(paths),))
+    return "; ".join(details)
+
+
+class Auditor(object):
+    def __init__(self, repo):
+        self.repo = repo
+
+    def audit(self, patch, commit):
+        """
+        Returns the result of classify() for patch, ("unknown", [], [], [],)
+        if commit is not in the repository.
+        """
+        try:
+            commit = self.repo[commit].peel(pygit2.Commit)
+        except (KeyError, ValueError):
+            return ("unknown", [], [], [],)
+        with open(patch, "rb") as f:
+            content = text(f.read())
+        upstream = text(lib_patch.commit_diff(self.repo, commit).patch or "")
+        return classify(parse_diff(upstream.split("\n")),
+                        parse_diff(content.split("\n")))
+
+
+_auditor = None
+
+
+def _init(repo_path):
+    global _auditor
+    _auditor = Auditor(pygit2.Repository(repo_path))
+
+
+def _audit(args):
+    return _auditor.audit(*args)
+
+
+def patch_commits(repo, patches):
+    """
+    Returns a list with, for each patch, the full id of the commit in its
+    Git-commit tag, the value of the tag if it does not name a commit of
+    repo, or None if the patch has no Git-commit tag.
+    """
+    cache = lib_tag.tag_cache()
+    revs = []
+    for patch in patches:
+        tags = [tag for tag in cache.get_all(patch)["Git-commit"]
+                if tag.strip()]
+        revs.append(lib.firstword(tags[0]) if tags else None)
+    found = lib.lookup_commits(repo, [rev for rev in revs if rev])[0]
+    result = []
+    for rev in revs:
+        if rev is None or rev in found:
+            result.append(found.get(rev))
+            continue
+        try:
+            result.append(str(repo.revparse_single(rev).peel(
+                pygit2.Commit).id))
+        except (KeyError, ValueError, pygit2.GitError):
+            result.append(rev)
+    return result
+
+
+def content_hash(patch):
+    with open(patch, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the patches of the sorted section of "
+        "\"series.conf\" to the upstream commit in their Git-commit tag and "
+        "print those which differ.")
+    parser.add_argument("-a", "--all", action="store_true",
+                        help="Also print the identical patches.")
+    parser.add_argument("-j", "--jobs", type=int,
+                        default=multiprocessing.cpu_count(),
+                        help="Number of processes used to compare the "
+                        "patches. Default: number of cpus")
+    parser.add_argument("patches", nargs="*", metavar="patch",
+                        help="Patch to check, as listed in series.conf. "
+                        "Default: all the patches of the sorted section.")
+    args = parser.parse_args()
+
+    try:
+        with open("series.conf") as f:
+            before, inside, after = lib.split_series(f)
+    except IOError:
+        print("Error: \"series.conf\" file could not be read. Are you at the "
+              "base of a kernel-source.git tree?", file=sys.stderr)
+        sys.exit(1)
+    except lib.KSNotFound:
+        print("Error: sorted subseries not found.", file=sys.stderr)
+        sys.exit(1)
+
+    patches = [lib.firstword(line) for line in inside
+               if lib.filter_patches(line)]
+    if args.patches:
+        unknown = set(args.patches) - set(patches)
+        if unknown:
+            print("Error: not in the sorted section of series.conf: %s" % (
+                " ".join(sorted(unknown)),), file=sys.stderr)
+            sys.exit(1)
+        patches = args.patches
+
+    try:
+        repo = lib.open_repo()
+        commits = patch_commits(repo, patches)
+    except lib.KSException as err:
+        print("Error: %s" % (err,), file=sys.stderr)
+        sys.exit(1)
+    except IOError as err:
+        print("Error: %s" % (err,), file=sys.stderr)
+        sys.exit(1)
+
+    cache_path = lib_cache.cache_path("drift", repo.path)
+    cache_version = 1
+    # (content hash, commit): result of classify()
+    cache = lib_cache.load(cache_path, cache_version) or {}
+
+    # [(patch, key,)]
+    work = []
+    skipped = 0
+    # the results of the patches whose commit is not in the repository are
+    # not cached, it may be fetched later
+    unknown = {}
+    for patch, commit in zip(patches, commits):
+        if commit is None:
+            skipped += 1
+            continue
+        key = (content_hash(patch), commit,)
+        work.append((patch, key,))
+        if len(commit) != 40 or commit not in repo:
+            unknown[key] = ("unknown", [], [], [],)
+    todo = [(patch, key,) for patch, key in work
+            if key not in cache and key not in unknown]
+    arguments = [(patch, key[1],) for patch, key in todo]
+
+    if args.jobs > 1 and len(todo) > 1:
+        pool = multiprocessing.Pool(args.jobs, _init, (repo.path,))
+        try:
+            results = pool.map(_audit, arguments, 8)
+        except:
+            pool.terminate()
+            raise
+        else:
+            pool.close()
+        finally:
+            pool.join()
+    else:
+        auditor = Auditor(repo)
+        results = [auditor.audit(*item) for item in arguments]
+    new = dict([(key, result,)
+                for (patch, key,), result in zip(todo, results)])
+
+    size = len(cache)
+    if args.patches:
+        cache.update(new)
+    else:
+        # drop the results of the patches which are gone
+        current = set([key for patch, key in work])
+        cache = dict([(key, result,)
+                      for key, result in list(cache.items()) + list(new.items())
+                      if key in current and key not in unknown])
+    if new or len(cache) != size:
+        lib_cache.save(cache_path, cache_version, cache)
+    cache.update(unknown)
+
+    counts = dict([(state, 0,) for state in ("identical", "context",
+                                             "modified", "unknown",)])
+    for patch, key in work:
+        result = cache[key]
+        counts[result[0]] += 1
+        if result[0] == "identical" and not args.all:
+            continue
+        details = describe(result)
+        print("%-9s %s%s" % (result[0], patch,
+                             " (%s)" % (details,) if details else "",))
+    print("%d identical, %d context, %d modified, %d unknown, %d without "
+          "commit; %d compared, %d cached" % (
+              counts["identical"], counts["context"], counts["modified"],
+              counts["unknown"], skipped, len(todo),
+              len([key for patch, key in work if key not in unknown]) -
+              len(todo),),
+          file=sys.stderr)
@@ -0,0 +1,288 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Long-running server which keeps the LINUX_GIT repository, the upstream order
+of commits and the data parsed from series.conf and patch headers in memory.
+
+qgoto.py, qdupcheck.py, sequence-insert.py and series_sort.py send their work
+to the server when it is running and do it themselves otherwise. The server
+listens on a Unix socket under the cache directory (see lib_cache.py); it is
+specific to the LINUX_GIT (or GIT_DIR) value of its environment.
+
+Start it in the background, for example using the `qserver` function of
+quilt-mode.sh, and stop it with
+    ksapply_server.py --stop
+"""
+
+from __future__ import print_function
+
+import argparse
+import errno
+import os
+import os.path
+import pygit2
+import signal
+import socket
+import StringIO
+import sys
+import threading
+import time
+import traceback
+
+import lib
+import lib_index
+import lib_server
+import lib_stable
+import lib_tag
+import lib_upstream
+import qgoto
+
+
+def applied_top():
+    """
+    Returns the name of the top applied quilt patch, without the "patches/"
+    prefix, None if no patches are applied.
+    """
+    try:
+        with open(os.path.join(".pc", "applied-patches")) as f:
+            lines = [line.strip() for line in f if line.strip()]
+    except IOError:
+        return None
+    if lines:
+        return lines[-1]
+    else:
+        return None
+
+
+class Server(object):
+    def __init__(self, repo, interval):
+        self.repo = repo
+        self.interval = interval
+        self.order = lib_upstream.UpstreamOrder(repo)
+        self.entry_cache = lib.EntryCache()
+        # realpath of series.conf: lib_index.CommitIndex
+        self.indexes = {}
+        # lib_stable.StableIndex, opened on first use
+        self.stable = None
+        self.lock = threading.Lock()
+        self.running = True
+        self.requests = 0
+
+    def watch(self):
+        """
+        Periodically drop the data of patches that changed.
+        """
+        while self.running:
+            time.sleep(self.interval)
+            with self.lock:
+                self.entry_cache.validate()
+                for index in self.indexes.values():
+                    try:
+                        if index.update():
+                            index.save()
+                    except (IOError, OSError):
+                        pass
+                lib_tag.tag_cache().save()
+
+    def get_index(self, series):
+        series = os.path.realpath(series)
+        try:
+            index = self.indexes[series]
+        except KeyError:
+            index = lib_index.CommitIndex.open(series)
+            self.indexes[series] = index
+        else:
+            if index.update(check_patches=False):
+                index.save()
+        return index
+
+    def get_stable(self):
+        if self.stable is None:
+            self.stable = lib_stable.StableIndex.open(self.repo)
+        elif self.stable.update():
+            self.stable.save()
+        return self.stable
+
+    def insert(self, series, request, top):
+        if request["batch"]:
+            return lib.sequence_insert_many(series, request["revs"], top,
+                                            self.repo, self.order,
+                                            self.entry_cache,
+                                            request["verify"])
+        else:
+            return lib.sequence_insert(series, request["revs"][0], top,
+                                       self.repo, self.order,
+                                       self.entry_cache, request["verify"])
+
+    def op_qgoto(self, request, out, err, response):
+        if not lib.check_series(err):
+            return 1
+
+        top = applied_top()
+        with open("series") as f:
+            series = f.readlines()
+        os.chdir("patches")
+        self.order.refresh()
+        result = self.insert(series, request, top)
+        if request["batch"]:
+            out.write(lib.format_insert_plan(result))
+        else:
+            out.write(qgoto.format_command(result[1]))
+        return 0
+
+    def op_qdupcheck(self, request, out, err, response):
+        if not lib.check_series(err):
+            return 1
+
+        commits = lib.resolve_commits(self.repo, request["revs"], self.order)
+        top = applied_top()
+        output = lib_index.describe_duplicates(
+            self.get_index("series"), commits,
+            lambda: os.path.join("patches", top) if top else "",
+            self.get_stable)
+        if output:
+            out.write(output)
+            return 1
+        return 0
+
+    def op_sequence_insert(self, request, out, err, response):
+        with open("series.conf") as f:
+            series = f.readlines()
+        self.order.refresh()
+        result = self.insert(series, request, None)
+        if request["batch"]:
+            out.write(lib.format_insert_plan(result))
+        else:
+            print(result[0], file=out)
+        return 0
+
+    def op_series_sort(self, request, out, err, response):
+        self.order.refresh()
+        if request.get("check"):
+            result = lib.check_sorted(self.repo, request["lines"], self.order,
+                                      self.entry_cache)
+            if result[0]:
+                out.write(lib.describe_unsorted(result))
+                return 1
+            return 0
+        response["result"] = lib.sort_series(self.repo, request["lines"],
+                                             self.order, self.entry_cache)
+        return 0
+
+    def op_status(self, request, out, err, response):
+        print("pid: %d" % (os.getpid(),), file=out)
+        print("repository: %s" % (self.repo.path,), file=out)
+        print("requests: %d" % (self.requests,), file=out)
+        print("upstream commits: %d" % (len(self.order),), file=out)
+        print("patch entries: %d" % (len(self.entry_cache.entries),),
+              file=out)
+        for series in sorted(self.indexes):
+            print("series: %s (%d patches)" % (
+                series, len(self.indexes[series].patches),), file=out)
+        return 0
+
+    def op_stop(self, request, out, err, response):
+        self.running = False
+        return 0
+
+    def handle(self, request):
+        out = StringIO.StringIO()
+        err = StringIO.StringIO()
+        response = {}
+        try:
+            os.chdir(request["cwd"])
+            op = getattr(self, "op_%s" % (request["op"],))
+            with self.lock:
+                status = op(request, out, err, response)
+        except lib.KSException as e:
+            print("Error: %s" % (e,), file=err)
+            status = 1
+        except Exception:
+            print("Error: ksapply server failed to handle the request:\n%s" %
+                  (traceback.format_exc(),), file=err)
+            status = 1
+        self.requests += 1
+        response.update({"status": status, "stdout": out.getvalue(),
+                         "stderr": err.getvalue()})
+        return response
+
+    def serve(self, path):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o077)
+        try:
+            sock.bind(path)
+        finally:
+            os.umask(umask)
+        sock.listen(8)
+
+        watcher = threading.Thread(target=self.watch)
+        watcher.daemon = True
+        watcher.start()
+
+        try:
+            while self.running:
+                conn, address = sock.accept()
+                try:
+                    lib_server.send(conn, self.handle(lib_server.receive(conn)))
+                except (EOFError, socket.error):
+                    pass
+                finally:
+                    conn.close()
+        finally:
+            sock.close()
+            os.unlink(path)
+            lib_tag.tag_cache().save()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Server which keeps repository and series data in memory "
+        "for qgoto.py, qdupcheck.py, sequence-insert.py and series_sort.py.")
+    parser.add_argument("-i", "--interval", type=float, default=2,
+                        help="Interval in seconds between checks for modified "
+                        "patches. Default: 2")
+    parser.add_argument("--status", action="store_true",
+                        help="Print information about the running server.")
+    parser.add_argument("--stop", action="store_true",
+                        help="Stop the running server.")
+    args = parser.parse_args()
+
+    path = lib_server.socket_path()
+    if path is None:
+        print("Error: \"LINUX_GIT\" environment variable not set.",
+              file=sys.stderr)
+        sys.exit(1)
+
+    if args.status or args.stop:
+        op = "status" if args.status else "stop"
+        if lib_server.run(op) is None:
+            print("Error: no server is running.", file=sys.stderr)
+            sys.exit(1)
+
+    try:
+        if lib_server.call({"op": "status", "cwd": "/"}) is not None:
+            print("Error: a server is already running.", file=sys.stderr)
+            sys.exit(1)
+    except (EOFError, socket.error):
+        pass
+    try:
+        os.unlink(path)
+    except OSError as err:
+        if err.errno != errno.ENOENT:
+            raise
+
+    repo_path = lib.repo_path()
+    if "GIT_DIR" not in os.environ:
+        # this is for the `git log` calls in lib_upstream.py
+        os.environ["GIT_DIR"] = repo_path
+    repo = pygit2.Repository(repo_path)
+
+    server = Server(repo, args.interval)
+    server.order.refresh()
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve(path)
+    except KeyboardInterrupt:
+        pass
@@ -3,17 +3,29 @@
 
 from __future__ import print_function
 
+import array
+import binascii
 import collections
+import multiprocessing
 import os
 import pygit2
 import signal
 import sys
 
 import lib_tag
+import lib_trace
+import lib_upstream
 
 from git_helpers import git_sort
 
 
+try:
+    _intern = sys.intern
+except AttributeError:
+    # python 2
+    _intern = intern
+
+
 class KSException(BaseException):
     pass
 
@@ -30,10 +42,12 @@ def restore_signals(): # from http://hg.python.org/cpython/rev/768722b2ae0a/
             signal.signal(getattr(signal, sig), signal.SIG_DFL)
 
 
-def check_series():
+def check_series(err=None):
+    if err is None:
+        err = sys.stderr
     if open("series").readline().strip() != "# Kernel patches configuration file":
         print("Error: series file does not look like series.conf",
-              file=sys.stderr)
+              file=err)
         return False
     else:
         return True
@@ -47,6 +61,7 @@ class KSNotFound(KSException):
     pass
 
 
+@lib_trace.traced("split_series")
 def split_series(series):
     before = []
     inside = []
@@ -57,6 +72,8 @@ def split_series(series):
 
     current = before
     for line in series:
+        if lib_trace.enabled:
+            lib_trace.add_bytes(len(line))
         l = line.strip()
 
         if l == "":
@@ -150,98 +167,415 @@ def repo_path():
     return pygit2.discover_repository(search_path)
 
 
+def file_stamp(path):
+    st = os.stat(path)
+    return (st.st_ino, st.st_mtime, st.st_size,)
+
+
 # http://stackoverflow.com/questions/1158076/implement-touch-using-python
 def touch(fname, times=None):
     with open(fname, 'a'):
         os.utime(fname, times)
 
 
+@lib_trace.traced("find_commit_in_series")
 def find_commit_in_series(commit, series):
+    """
+    Returns the path of the first patch in series which has a Git-commit tag
+    for commit, None if there is none.
+    """
     for patch in [firstword(l) for l in series if filter_patches(l)]:
         path = os.path.join("patches", patch)
-        f = open(path)
-        if commit in [firstword(t) for t in lib_tag.tag_get(f, "Git-commit")]:
-            return f
+        if commit in [firstword(t) for t in
+                      lib_tag.patch_tag_get(path, "Git-commit")]:
+            return path
 
 
 # https://stackoverflow.com/a/952952
 flatten = lambda l: [item for sublist in l for item in sublist]
 
 
-def sequence_insert(series, rev, top):
+def open_repo(repo=None):
     """
-    top is the top applied patch, None if none are applied.
+    Returns repo or, if it is None, the repository at LINUX_GIT.
+    """
+    if repo is None:
+        git_dir = repo_path()
+        if "GIT_DIR" not in os.environ:
+            # this is for the `git log` calls in git_sort.py and
+            # lib_upstream.py
+            os.environ["GIT_DIR"] = git_dir
+        repo = pygit2.Repository(git_dir)
+    return repo
 
-    Caller must chdir to where the entries in series can be found.
 
-    Returns the name of the new top patch and how many must be applied/popped.
-    """
-    git_dir = repo_path()
-    if "GIT_DIR" not in os.environ:
-        # this is for the `git log` call in git_sort.py
-        os.environ["GIT_DIR"] = git_dir
-    repo = pygit2.Repository(git_dir)
+def not_indexed_error(msg):
+    return KSError(msg + " appears to be from a repository which is not "
+                   "indexed. Please edit \"remotes\" in git_sort.py and "
+                   "submit a patch.")
+
+
+def resolve_commit(repo, rev):
     try:
-        commit = str(repo.revparse_single(rev).id)
+        return str(repo.revparse_single(rev).id)
     except ValueError:
         raise KSError("\"%s\" is not a valid revision." % (rev,))
     except KeyError:
         raise KSError("Revision \"%s\" not found in \"%s\"." % (
-            rev, git_dir,))
+            rev, repo.path,))
+
+
+def _hex_prefix(rev):
+    """
+    Returns rev in lowercase if it looks like an abbreviated or full commit
+    id, None otherwise.
+    """
+    if 4 <= len(rev) <= 40:
+        rev = rev.lower()
+        if not rev.strip("0123456789abcdef"):
+            return rev
+    return None
+
+
+def lookup_commits(repo, revs, order=None):
+    """
+    Resolve the revisions of revs that look like commit ids against the
+    upstream index (see lib_upstream.py) in one pass. order is an optional
+    lib_upstream.UpstreamOrder; by default the index file is used as it is,
+    without updating it.
+
+    Returns a tuple
+        ({rev: full hex id}, [ambiguous rev],)
+    Revisions that are not found in the index are in neither.
+    """
+    if order is None:
+        order = lib_upstream.UpstreamOrder(repo)
+        order.load()
+    prefixes = {}
+    for rev in revs:
+        prefix = _hex_prefix(rev)
+        if prefix is not None:
+            prefixes[rev] = prefix
+    matches = order.resolve_prefixes(prefixes.values())
+
+    found = {}
+    ambiguous = []
+    for rev, prefix in prefixes.items():
+        commits = matches.get(prefix)
+        if not commits:
+            continue
+        elif len(commits) > 1:
+            ambiguous.append(rev)
+        else:
+            found[rev] = commits[0]
+    return (found, ambiguous,)
+
+
+def resolve_commits(repo, revs, order=None):
+    """
+    Like resolve_commit() for many revisions at once. Commit ids are looked
+    up in the upstream index (see lookup_commits()); other revisions and the
+    ids that are not found there go through revparse.
+
+    Returns the list of full hex ids, in the same order as revs. All the
+    revisions which are invalid or not found are reported in one KSError.
+    """
+    found, ambiguous = lookup_commits(repo, revs, order)
+    ambiguous = set(ambiguous)
+    invalid = []
+    missing = []
+    result = []
+    for rev in revs:
+        if rev in found:
+            result.append(found[rev])
+            continue
+        elif rev in ambiguous:
+            invalid.append(rev)
+            continue
+        try:
+            result.append(str(repo.revparse_single(rev).id))
+        except ValueError:
+            invalid.append(rev)
+        except KeyError:
+            missing.append(rev)
+
+    messages = []
+    if invalid:
+        messages.append("%s not valid or ambiguous: %s." % (
+            "Revision is" if len(invalid) == 1 else "Revisions are",
+            ", ".join(["\"%s\"" % (rev,) for rev in invalid]),))
+    if missing:
+        messages.append("%s not found in \"%s\": %s." % (
+            "Revision" if len(missing) == 1 else "Revisions",
+            repo.path, ", ".join(["\"%s\"" % (rev,) for rev in missing]),))
+    if messages:
+        raise KSError(" ".join(messages))
+    return result
+
+
+class _InsertContext(object):
+    """
+    State shared by sequence_insert() and sequence_insert_many()
+    """
+    def __init__(self, series, top, repo, entry_cache):
+        self.before, self.inside, self.after = [
+            [firstword(line) for line in lines if filter_patches(line)]
+            for lines in split_series(series)]
+        self.current_patches = flatten([self.before, self.inside,
+                                        self.after])
+
+        if top is None:
+            self.top_index = 0
+        else:
+            self.top_index = self.current_patches.index(top) + 1
+
+        self.repo = repo
+        self.entry_cache = entry_cache
+        self.entries = {}
+
+    def load_entry(self, patch):
+        try:
+            return self.entries[patch]
+        except KeyError:
+            pass
+        if self.entry_cache is None:
+            entry = InputEntry(patch)
+            entry.from_patch(self.repo, patch)
+        else:
+            entry = self.entry_cache.get(self.repo, patch, patch)
+        self.entries[patch] = entry
+        return entry
+
+    def name_before(self, commit_pos):
+        if commit_pos == 0:
+            # should be inserted first in series
+            return ""
+        else:
+            return self.current_patches[commit_pos - 1]
+
 
-    before, inside, after = [
-        [firstword(line) for line in lines if filter_patches(line)]
-        for lines in split_series(series)]
-    current_patches = flatten([before, inside, after])
+@lib_trace.traced("sequence_insert")
+def sequence_insert(series, rev, top, repo=None, order=None,
+                    entry_cache=None, verify=False):
+    """
+    top is the top applied patch, None if none are applied.
+
+    Caller must chdir to where the entries in series can be found.
+
+    repo, order (a lib_upstream.UpstreamOrder) and entry_cache (an
+    EntryCache) may be passed by long-running processes to reuse them between
+    calls.
+
+    The insertion point is found with a binary search over the sorted
+    section, which reads only log(N) patches. If verify is True, the whole
+    section is sorted instead and an error is raised if it is not already
+    sorted.
 
-    if top is None:
-        top_index = 0
+    Returns the name of the new top patch and how many must be applied/popped.
+    """
+    repo = open_repo(repo)
+    commit = resolve_commit(repo, rev)
+    context = _InsertContext(series, top, repo, entry_cache)
+
+    if verify:
+        commit_pos = _sequence_insert_sort(repo, order, commit, context)
     else:
-        top_index = current_patches.index(top) + 1
+        if order is None:
+            order = lib_upstream.upstream_order(repo)
+        keys = EntryKeys(order)
+        commit_pos = len(context.before) + keys.insert_position(
+            commit, context.inside, context.load_entry)
 
-    input_entries = []
-    for patch in inside:
-        entry = InputEntry(patch)
-        entry.from_patch(repo, patch)
-        input_entries.append(entry)
+    return (context.name_before(commit_pos), commit_pos - context.top_index,)
+
+
+@lib_trace.traced("sequence_insert_many")
+def sequence_insert_many(series, revs, top, repo=None, order=None,
+                         entry_cache=None, verify=False):
+    """
+    Like sequence_insert() for a list of commits which are imported one after
+    the other: the position of each commit accounts for the commits before it
+    in revs and its delta assumes that the previous commit was imported and
+    applied, so that it is the top patch.
+
+    If verify is True, the sorted section is checked once by sorting it
+    entirely.
+
+    Returns a list of
+        (commit, name, delta,)
+    name is the patch after which the commit is inserted. It is the full id of
+    a previous commit from revs if the commit should be inserted after that
+    one.
+    """
+    repo = open_repo(repo)
+    commits = resolve_commits(repo, revs, order)
+    context = _InsertContext(series, top, repo, entry_cache)
+    if not commits:
+        return []
+
+    if verify:
+        _sequence_insert_sort(repo, order, commits[0], context)
+    if order is None:
+        order = lib_upstream.upstream_order(repo)
+    keys = EntryKeys(order)
+
+    top_index = context.top_index
+    # [(position in context.inside, key, commit,)]
+    inserted = []
+    result = []
+    for commit in commits:
+        new_key = keys.commit_key(commit)
+        pos = keys.insert_position(commit, context.inside, context.load_entry)
+
+        # commits that were inserted earlier and which come before this one
+        previous = [(key, i, c,) for i, (p, key, c,) in enumerate(inserted)
+                    if p < pos or (p == pos and key <= new_key)]
+        commit_pos = len(context.before) + pos + len(previous)
+        same_gap = [entry for entry in previous if inserted[entry[1]][0] == pos]
+        if same_gap:
+            name = max(same_gap)[2]
+        else:
+            name = context.name_before(len(context.before) + pos)
+
+        result.append((commit, name, commit_pos - top_index,))
+        top_index = commit_pos + 1
+        inserted.append((pos, new_key, commit,))
+
+    return result
+
+
+def format_insert_plan(plan):
+    """
+    Format the result of sequence_insert_many() as tab separated
+        commit, delta, name
+    lines.
+    """
+    return "".join(["%s\t%d\t%s\n" % (commit, delta, name,)
+                    for commit, name, delta in plan])
+
+
+def _sequence_insert_sort(repo, order, commit, context):
+    """
+    Returns the position of commit in the series after sorting it along with
+    the entire sorted section.
+    """
+    input_entries = SeriesTable.from_entries(
+        [context.load_entry(patch) for patch in context.inside])
 
     marker = "# new commit"
-    entry = InputEntry(marker)
-    entry.commit = commit
-    input_entries.append(entry)
+    input_entries.append(marker, commit, None, False)
 
-    sorted_entries = series_sort(repo, input_entries)
+    sorted_entries = series_sort(repo, input_entries, order)
     for head_name, patches in sorted_entries:
         if head_name == "unknown/local patches":
             if patches[0] == marker:
                 msg = "New commit %s" % commit
             else:
-                f = open(patches[0])
-                commit_tags = lib_tag.tag_get(f, "Git-commit")
+                commit_tags = lib_tag.patch_tag_get(patches[0], "Git-commit")
                 rev = firstword(commit_tags[0])
                 msg = "Commit %s first found in patch \"%s\"" % (rev,
                     patches[0],)
-            raise KSError(msg + " appears to be from a repository which is "
-                          "not indexed. Please edit \"remotes\" in git_sort.py "
-                          "and submit a patch.")
+            raise not_indexed_error(msg)
     sorted_patches = flatten([
-        before,
+        context.before,
         [patch
          for head_name, patches in sorted_entries
          for patch in patches],
-        after])
+        context.after])
     commit_pos = sorted_patches.index("# new commit")
-    if commit_pos == 0:
-        # should be inserted first in series
-        name = ""
-    else:
-        name = sorted_patches[commit_pos - 1]
     del sorted_patches[commit_pos]
 
-    if sorted_patches != current_patches:
+    if sorted_patches != context.current_patches:
         raise KSError("Subseries is not sorted.")
 
-    return (name, commit_pos - top_index,)
+    return commit_pos
+
+
+class EntryKeys(object):
+    """
+    Sort keys which put InputEntry objects, or the entries of a SeriesTable,
+    in the same order as series_sort() and series_format() do, so that
+    positions can be found without sorting everything.
+
+    A key is a tuple
+        (group, subgroup, position,)
+    group is the index of the head in git_sort.remotes. Commits that are not
+    found in any head come after all the heads and out-of-tree patches come
+    last. Within a head, patches for commits that were found in the history
+    come first, followed by patches which are only identified by a Git-repo
+    tag.
+    """
+    def __init__(self, order):
+        self.order = order
+        self.ranks = dict([(git_sort.head_name(*remote), i,)
+                           for i, remote in enumerate(git_sort.remotes)])
+        self.unknown = len(git_sort.remotes)
+        self.url_map = get_url_map()
+
+    def commit_key(self, commit):
+        return self._key(self.order.key(commit))
+
+    def _key(self, key):
+        if key is None:
+            return (self.unknown, 0, 0,)
+        else:
+            return (self.ranks[self.order.head_name(key[0])], 0, key[1],)
+
+    def _subsys_key(self, subsys, value):
+        try:
+            name = self.url_map[subsys]
+        except KeyError:
+            patch = firstword(value)
+            commit_tags = lib_tag.patch_tag_get(patch, "Git-commit")
+            raise not_indexed_error(
+                "Commit %s first found in patch \"%s\"" % (
+                    firstword(commit_tags[0]), patch,))
+        return (self.ranks[name], 1, 0,)
+
+    def key(self, entry):
+        if entry.commit:
+            return self.commit_key(entry.commit)
+        elif entry.subsys:
+            return self._subsys_key(entry.subsys, entry.value)
+        else:
+            return (self.unknown + 1, 0, 0,)
+
+    def table_keys(self, table):
+        """
+        Returns the list of the keys of the entries of a SeriesTable.
+        """
+        result = []
+        for i in range(len(table)):
+            kind = table.kinds[i]
+            if kind == SeriesTable.KIND_COMMIT:
+                result.append(self._key(self.order.key_oid(table.oid(i))))
+            elif kind == SeriesTable.KIND_SUBSYS:
+                result.append(self._subsys_key(table.subsys[i],
+                                               table.values[i]))
+            else:
+                result.append((self.unknown + 1, 0, 0,))
+        return result
+
+    def insert_position(self, commit, patches, load_entry):
+        """
+        patches is the list of patches of a sorted section. load_entry is a
+        function which returns the InputEntry of a patch.
+
+        Returns the index in patches where commit should be inserted.
+        """
+        new_key = self.commit_key(commit)
+        if new_key[0] == self.unknown:
+            raise not_indexed_error("New commit %s" % (commit,))
+
+        lo = 0
+        hi = len(patches)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if new_key < self.key(load_entry(patches[mid])):
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
 
 
 class InputEntry(object):
@@ -252,24 +586,39 @@ class InputEntry(object):
 
         self.value = value
 
+    @lib_trace.traced("from_patch")
     def from_patch(self, repo, patch):
         if not os.path.exists(patch):
             raise KSError("Could not find patch \"%s\"" % (patch,))
 
-        f = open(patch)
-        commit_tags = lib_tag.tag_get(f, "Git-commit")
+        with lib_trace.phase("read_tags"):
+            tags = lib_tag.tag_cache().get_all(patch)
+        self.from_tags(repo, patch, tags)
+
+    def from_tags(self, repo, patch, tags, commits=None):
+        """
+        tags is the result of lib_tag.TagCache.get_all() for patch. commits
+        is an optional dict
+            rev: full hex id
+        of revisions which were already resolved, see lookup_commits().
+        """
+        commit_tags = tags["Git-commit"]
         if not commit_tags:
             self.oot = True
             return
 
         rev = firstword(commit_tags[0])
+        if commits is not None and rev in commits:
+            self.commit = commits[rev]
+            return
         try:
-            commit = repo.revparse_single(rev)
+            with lib_trace.phase("revparse"):
+                commit = repo.revparse_single(rev)
         except ValueError:
             raise KSError("Git-commit tag \"%s\" in patch \"%s\" is not a valid revision." %
                               (rev, patch,))
         except KeyError:
-            repo_tags = lib_tag.tag_get(f, "Git-repo")
+            repo_tags = tags["Git-repo"]
             if not repo_tags:
                 raise KSError(
                     "Commit \"%s\" not found and no Git-repo specified. "
@@ -284,40 +633,360 @@ class InputEntry(object):
             self.commit = str(commit.id)
 
 
-def series_sort(repo, entries):
+class SeriesTable(object):
+    """
+    The entries of a series, stored in columns instead of one InputEntry
+    object per patch:
+        values: series.conf lines, interned
+        commits: 20 bytes per entry, the binary commit id, zeros if none
+        kinds: KIND_COMMIT, KIND_SUBSYS (only a Git-repo tag) or KIND_OOT
+        subsys: {index: Git-repo url} for the KIND_SUBSYS entries
+        heads, positions: the upstream key of the commits, see resolve()
+    Iterating over a table yields InputEntry objects, which are built on
+    demand.
+    """
+    KIND_COMMIT = 0
+    KIND_SUBSYS = 1
+    KIND_OOT = 2
+    null_oid = b"\0" * 20
+
+    def __init__(self):
+        self.values = []
+        self.commits = bytearray()
+        self.kinds = array.array("b")
+        self.subsys = {}
+        self.heads = None
+        self.positions = None
+
+    @classmethod
+    def from_entries(cls, entries):
+        table = cls()
+        for entry in entries:
+            table.append(entry.value, entry.commit, entry.subsys, entry.oot)
+        return table
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        for i in range(len(self.values)):
+            yield self.entry(i)
+
+    def append(self, value, commit, subsys, oot):
+        """
+        commit is a full hex id or None.
+        """
+        if commit:
+            self.append_oid(value, binascii.unhexlify(commit))
+        else:
+            self.values.append(_intern(value))
+            self.commits.extend(self.null_oid)
+            if subsys:
+                self.subsys[len(self.kinds)] = subsys
+                self.kinds.append(self.KIND_SUBSYS)
+            else:
+                self.kinds.append(self.KIND_OOT)
+        self.heads = None
+
+    def append_oid(self, value, oid):
+        self.values.append(_intern(value))
+        self.commits.extend(oid)
+        self.kinds.append(self.KIND_COMMIT)
+        self.heads = None
+
+    def oid(self, i):
+        return bytes(self.commits[i * 20:(i + 1) * 20])
+
+    def commit(self, i):
+        """
+        Returns the full hex id of the commit of entry i, None if it has none.
+        """
+        if self.kinds[i] != self.KIND_COMMIT:
+            return None
+        return binascii.hexlify(self.oid(i)).decode("ascii")
+
+    def entry(self, i):
+        entry = InputEntry(self.values[i])
+        entry.commit = self.commit(i)
+        entry.subsys = self.subsys.get(i)
+        entry.oot = self.kinds[i] == self.KIND_OOT
+        return entry
+
+    @lib_trace.traced("upstream_keys")
+    def resolve(self, order):
+        """
+        Fill the heads and positions columns with the key of the commits in
+        order (a lib_upstream.UpstreamOrder). The head is -1 for the entries
+        whose commit is not found and for the entries without a commit.
+        """
+        n = len(self.values)
+        heads = array.array("i", [-1]) * n
+        positions = array.array("i", [0]) * n
+        for i in range(n):
+            if self.kinds[i] == self.KIND_COMMIT:
+                key = order.key_oid(self.oid(i))
+                if key is not None:
+                    heads[i], positions[i] = key
+        self.heads = heads
+        self.positions = positions
+
+
+class EntryCache(object):
+    """
+    Memo of the entries built from patches, for long-running processes.
+    Entries are reused as long as the stamp (inode, mtime, size) of the patch
+    file is the same as when it was read. validate() drops the entries of
+    the files which changed or are gone.
+    """
+    def __init__(self):
+        # abspath: (stamp, binary commit id, subsys, oot,)
+        self.entries = {}
+
+    @staticmethod
+    def _stamp(patch):
+        return file_stamp(patch) if os.path.exists(patch) else None
+
+    def _cached(self, key, stamp):
+        """
+        Returns the cached (binary commit id, subsys, oot,) of key, None if
+        it is missing or stale.
+        """
+        data = self.entries.get(key)
+        if data is None or data[0] != stamp:
+            return None
+        return data[1:]
+
+    def _lookup(self, repo, patch, value):
+        key = os.path.abspath(patch)
+        stamp = self._stamp(patch)
+        data = self._cached(key, stamp)
+        if data is not None:
+            return data
+        entry = InputEntry(value)
+        entry.from_patch(repo, patch)
+        data = (binascii.unhexlify(entry.commit) if entry.commit else None,
+                entry.subsys, entry.oot,)
+        self.entries[key] = (stamp,) + data
+        return data
+
+    def get(self, repo, patch, value):
+        oid, subsys, oot = self._lookup(repo, patch, value)
+        entry = InputEntry(value)
+        if oid is not None:
+            entry.commit = binascii.hexlify(oid).decode("ascii")
+        entry.subsys = subsys
+        entry.oot = oot
+        return entry
+
+    def load(self, repo, patches, order=None):
+        """
+        Like load_entries(), reading only the patches that are not in the
+        cache or that changed.
+        """
+        # [(key, stamp,)] of each patch
+        stamps = [(os.path.abspath(patch), self._stamp(patch),)
+                  for patch, value in patches]
+        missing = [(patch, value,)
+                   for (patch, value,), (key, stamp,) in zip(patches, stamps)
+                   if self._cached(key, stamp) is None]
+        for (patch, value,), entry in zip(missing,
+                                          _read_entries(repo, missing, order)):
+            self.entries[os.path.abspath(patch)] = (
+                self._stamp(patch),
+                binascii.unhexlify(entry.commit) if entry.commit else None,
+                entry.subsys, entry.oot,)
+
+        table = SeriesTable()
+        for (patch, value,), (key, stamp,) in zip(patches, stamps):
+            oid, subsys, oot = self.entries[key][1:]
+            if oid is not None:
+                table.append_oid(value, oid)
+            else:
+                table.append(value, None, subsys, oot)
+        return table
+
+    def validate(self):
+        """
+        Drop the entries of patches that changed.
+        """
+        for key, data in list(self.entries.items()):
+            try:
+                stamp = file_stamp(key)
+            except OSError:
+                stamp = None
+            if stamp != data[0]:
+                del self.entries[key]
+
+
+def _read_entries(repo, patches, order=None):
+    """
+    Generator of the InputEntry of each (patch, value,) of patches, in order.
+
+    The tags of all the patches are read first so that their Git-commit
+    revisions are resolved together with lookup_commits(). The others go
+    through revparse one at a time. Errors are raised for the same patch as
+    when calling InputEntry.from_patch() for each one.
+    """
+    cache = lib_tag.tag_cache()
+    all_tags = []
+    for patch, value in patches:
+        if not os.path.exists(patch):
+            break
+        with lib_trace.phase("read_tags"):
+            all_tags.append(cache.get_all(patch))
+    with lib_trace.phase("revparse"):
+        commits = lookup_commits(repo, [
+            firstword(tags["Git-commit"][0])
+            for tags in all_tags if tags["Git-commit"]], order)[0]
+
+    for i, (patch, value) in enumerate(patches):
+        entry = InputEntry(value)
+        if i < len(all_tags):
+            entry.from_tags(repo, patch, all_tags[i], commits)
+        else:
+            entry.from_patch(repo, patch)
+        yield entry
+
+
+_worker_repo = None
+_worker_order = None
+
+
+def _load_init(repo_path):
+    global _worker_repo, _worker_order
+    _worker_repo = pygit2.Repository(repo_path)
+    _worker_order = lib_upstream.UpstreamOrder(_worker_repo)
+    _worker_order.load()
+
+
+def _load_chunk(chunk):
+    """
+    Worker side of load_entries()
+
+    Returns a tuple
+        ([record], {tag cache entries},)
+    record is a tuple (value, commit, subsys, oot,) or, for the patch which
+    failed to load, the exception. Loading stops at the first error. The tag
+    cache entries are those of the patches whose headers were (re)read.
+    """
+    cache = lib_tag.tag_cache()
+    keys = [os.path.abspath(patch) for patch, value in chunk]
+    previous = [cache.entries.get(key) for key in keys]
+    records = []
+    try:
+        for entry in _read_entries(_worker_repo, chunk, _worker_order):
+            records.append((entry.value, entry.commit, entry.subsys,
+                            entry.oot,))
+    except KSException as err:
+        records.append(err)
+    tag_entries = {}
+    for key, entry in zip(keys, previous):
+        if key in cache.entries and cache.entries[key] is not entry:
+            tag_entries[key] = cache.entries[key]
+    return (records, tag_entries,)
+
+
+@lib_trace.traced("load_entries")
+def load_entries(repo, patches, jobs=1, order=None):
+    """
+    patches is a list of
+        (patch, value,)
+    value is the series.conf line of the patch.
+
+    order is an optional lib_upstream.UpstreamOrder used to resolve the
+    Git-commit tags, see lookup_commits().
+
+    Returns a SeriesTable of the entries, in the same order. If jobs is
+    greater than 1, the patches are read by a pool of that many worker
+    processes. Errors are the same as when reading the patches one after the
+    other: the first patch that fails to load is reported.
+    """
+    result = SeriesTable()
+    if jobs <= 1 or len(patches) < 2:
+        for entry in _read_entries(repo, patches, order):
+            result.append(entry.value, entry.commit, entry.subsys, entry.oot)
+        return result
+
+    cache = lib_tag.tag_cache()
+    # load it once, before the workers are forked
+    cache.load()
+    size = max(1, (len(patches) + jobs * 4 - 1) // (jobs * 4))
+    chunks = [patches[i:i + size] for i in range(0, len(patches), size)]
+    pool = multiprocessing.Pool(jobs, _load_init, (repo.path,))
+    try:
+        results = pool.map(_load_chunk, chunks)
+    except:
+        pool.terminate()
+        raise
+    else:
+        pool.close()
+    finally:
+        pool.join()
+
+    for records, tag_entries in results:
+        cache.update(tag_entries)
+        for record in records:
+            if isinstance(record, KSException):
+                raise record
+            result.append(*record)
+    return result
+
+
+@lib_trace.traced("series_sort")
+def series_sort(repo, entries, order=None):
     """
-    entries is a list of InputEntry objects
+    entries is a SeriesTable or a list of InputEntry objects
+
+    order is an optional lib_upstream.UpstreamOrder, for long-running
+    processes which keep one. By default, the persistent index is opened.
 
     Returns a list of
         (head name, [series.conf line with a patch name],)
 
     head name may be a "virtual head" like "out-of-tree patches".
     """
-    tagged = collections.defaultdict(list)
-    for input_entry in entries:
-        if input_entry.commit:
-            tagged[input_entry.commit].append(input_entry.value)
+    if not isinstance(entries, SeriesTable):
+        entries = SeriesTable.from_entries(entries)
+    if order is None:
+        order = lib_upstream.upstream_order(repo)
+    entries.resolve(order)
+
+    values = entries.values
+    kinds = entries.kinds
+    heads = entries.heads
+    found = []
+    # binary commit id: [series.conf line]
+    unknown = collections.OrderedDict()
+    oot = []
+    for i in range(len(entries)):
+        if kinds[i] == SeriesTable.KIND_COMMIT:
+            if heads[i] >= 0:
+                found.append(i)
+            else:
+                unknown.setdefault(entries.oid(i), []).append(values[i])
+        elif kinds[i] == SeriesTable.KIND_OOT:
+            oot.append(values[i])
+    # two stable sorts give the upstream order and keep the patches of a
+    # commit in their input order
+    found.sort(key=entries.positions.__getitem__)
+    found.sort(key=heads.__getitem__)
 
     subsys = collections.defaultdict(list)
-    for sorted_entry in git_sort.git_sort(repo, tagged):
-        subsys[sorted_entry.head_name].extend(sorted_entry.value)
+    head_names = [order.head_name(h) for h in range(len(order.heads))]
+    for i in found:
+        subsys[head_names[heads[i]]].append(values[i])
 
     url_map = get_url_map()
-    for e in entries:
-        if e.subsys:
-            try:
-                name = url_map[e.subsys]
-            except KeyError:
-                patch = firstword(e.value)
-                f = open(patch)
-                commit_tags = lib_tag.tag_get(f, "Git-commit")
-                rev = firstword(commit_tags[0])
-                raise KSError(
-                    "Commit %s first found in patch \"%s\" appears to be from "
-                    "a repository which is not indexed. Please edit "
-                    "\"remotes\" in git_sort.py and submit a patch." % (
-                        rev, patch,))
-            subsys[name].append(e.value)
+    for i, url in sorted(entries.subsys.items()):
+        try:
+            name = url_map[url]
+        except KeyError:
+            patch = firstword(values[i])
+            commit_tags = lib_tag.patch_tag_get(patch, "Git-commit")
+            rev = firstword(commit_tags[0])
+            raise not_indexed_error(
+                "Commit %s first found in patch \"%s\"" % (rev, patch,))
+        subsys[name].append(values[i])
 
     result = []
     for remote in git_sort.remotes:
@@ -326,17 +995,260 @@ def series_sort(repo, entries):
             result.append((head_name, subsys[head_name],))
             del subsys[head_name]
 
-    if tagged:
+    if unknown:
         result.append(("unknown/local patches", [
-            value for value_list in tagged.values() for value in value_list],))
+            value for value_list in unknown.values() for value in value_list],))
 
     result.extend([(r_tag, subsys[r_tag],) for r_tag in sorted(subsys)])
 
-    result.append(("out-of-tree patches", [e.value for e in entries if e.oot],))
+    result.append(("out-of-tree patches", oot,))
+
+    return result
+
+
+def parse_sorted(inside):
+    """
+    inside is a sorted section of series.conf, as written by series_format().
+
+    Returns a list of
+        (group name, [series.conf line with a patch name],)
+    like series_sort() does, None if the section contains lines that
+    series_format() does not write.
+    """
+    head_names = [git_sort.head_name(*remote) for remote in git_sort.remotes]
+    known = set(head_names + ["unknown/local patches", "out-of-tree patches"])
+
+    header = series_header(inside)
+    footer = series_footer(inside)
+    result = [(head_names[0], [],)]
+    for line in inside[len(header):len(inside) - len(footer)]:
+        l = line.strip()
+        if l == "":
+            continue
+        elif l.startswith("# "):
+            name = l[2:]
+            if name not in known or name in [n for n, lines in result]:
+                return None
+            result.append((name, [],))
+        elif filter_patches(line):
+            result[-1][1].append("\t%s\n" % (firstword(line),))
+        else:
+            return None
+    return result
+
+
+@lib_trace.traced("merge_sorted")
+def merge_sorted(repo, inside, removed, entries, order=None):
+    """
+    Insert entries (a list of InputEntry objects) into the sorted section
+    "inside" of series.conf, leaving out the patches in "removed".
+
+    The section is assumed to be sorted already. The position of each new
+    entry is found with a binary search within its group, so only a few of
+    the patches of the section are read, and the new entries are merged into
+    each group in a single pass.
+
+    Returns a list like series_sort() does, None if the section could not be
+    parsed (see parse_sorted()).
+    """
+    groups = parse_sorted(inside)
+    if groups is None:
+        return None
+    groups = collections.OrderedDict([
+        (name, [value for value in values
+                if firstword(value) not in removed],)
+        for name, values in groups])
+
+    if order is None:
+        order = lib_upstream.upstream_order(repo)
+    keys = EntryKeys(order)
+    loaded = {}
+
+    def load_entry(value):
+        try:
+            return loaded[value]
+        except KeyError:
+            pass
+        entry = InputEntry(value)
+        entry.from_patch(repo, firstword(value))
+        loaded[value] = entry
+        return entry
+
+    # group name: [(position, key, index, value,)]
+    additions = collections.defaultdict(list)
+    for i, entry in enumerate(entries):
+        if entry.commit:
+            key = keys.commit_key(entry.commit)
+            if key[0] == keys.unknown:
+                name = "unknown/local patches"
+            else:
+                name = order.head_name(order.key(entry.commit)[0])
+        elif entry.subsys:
+            key = keys.key(entry)
+            name = keys.url_map[entry.subsys]
+        else:
+            key = keys.key(entry)
+            name = "out-of-tree patches"
+
+        values = groups.get(name, [])
+        lo = 0
+        hi = len(values)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if key < keys.key(load_entry(values[mid])):
+                hi = mid
+            else:
+                lo = mid + 1
+        additions[name].append((lo, key, i, entry.value,))
+
+    for name, added in additions.items():
+        added.sort()
+        values = groups.get(name, [])
+        merged = []
+        start = 0
+        for pos, key, i, value in added:
+            merged.extend(values[start:pos])
+            merged.append(value)
+            start = pos
+        merged.extend(values[start:])
+        groups[name] = merged
 
+    result = []
+    for remote in git_sort.remotes:
+        head_name = git_sort.head_name(*remote)
+        if groups.get(head_name):
+            result.append((head_name, groups.pop(head_name),))
+    if groups.get("unknown/local patches"):
+        result.append(("unknown/local patches",
+                       groups.pop("unknown/local patches"),))
+    result.append(("out-of-tree patches",
+                   groups.pop("out-of-tree patches", []),))
     return result
 
 
+def sort_series(repo, lines, order=None, entry_cache=None, jobs=1):
+    """
+    Sort the sorted section of the series.conf lines, or all of them if they
+    do not include that section.
+
+    Caller must chdir to where the patches can be found. jobs is passed to
+    load_entries().
+
+    Returns the sorted lines.
+    """
+    try:
+        before, inside, after = split_series(lines)
+    except KSNotFound:
+        before = []
+        inside = lines
+        after = []
+
+    patches = [(patch, "\t%s\n" % (patch,),)
+               for patch in [firstword(line) for line in inside
+                             if filter_patches(line)]]
+    if order is None:
+        order = lib_upstream.upstream_order(repo)
+    if entry_cache is None:
+        input_entries = load_entries(repo, patches, jobs, order)
+    else:
+        input_entries = entry_cache.load(repo, patches, order)
+    sorted_entries = series_sort(repo, input_entries, order)
+
+    return flatten([
+        before,
+        series_header(inside),
+        series_format(sorted_entries),
+        series_footer(inside),
+        after])
+
+
+def check_sorted(repo, lines, order=None, entry_cache=None, jobs=1,
+                 limit=3):
+    """
+    Check that the patches of the sorted section of the series.conf lines, or
+    of all of them if they do not include that section, are in the order that
+    sort_series() would give. This is a single pass which compares the sort
+    keys of adjacent entries.
+
+    Returns a tuple
+        (number of entries out of order, [(patch, expected previous patch,
+                                           expected next patch,)],)
+    The list describes at most "limit" entries. The expected neighbours are
+    None at the ends of the section.
+    """
+    try:
+        before, inside, after = split_series(lines)
+    except KSNotFound:
+        inside = lines
+
+    patches = [(patch, "\t%s\n" % (patch,),)
+               for patch in [firstword(line) for line in inside
+                             if filter_patches(line)]]
+    if order is None:
+        order = lib_upstream.upstream_order(repo)
+    if entry_cache is None:
+        input_entries = load_entries(repo, patches, jobs, order)
+    else:
+        input_entries = entry_cache.load(repo, patches, order)
+    entry_keys = EntryKeys(order)
+    keys = entry_keys.table_keys(input_entries)
+
+    misplaced = []
+    n = len(keys)
+    for i in range(1, n):
+        if keys[i] < keys[i - 1]:
+            # Which one of the two entries moved? If the entry before the
+            # pair fits before the second one and the first one does not
+            # fit before the entry after the pair, blame the first one.
+            if ((i < 2 or keys[i - 2] <= keys[i]) and
+                (i + 1 >= n or keys[i - 1] > keys[i + 1])):
+                misplaced.append(i - 1)
+            else:
+                misplaced.append(i)
+    if not misplaced:
+        return (0, [],)
+
+    sorted_indexes = sorted(range(n), key=lambda i: keys[i])
+    ranks = [0] * n
+    for rank, i in enumerate(sorted_indexes):
+        ranks[i] = rank
+    result = []
+    for i in misplaced[:limit]:
+        rank = ranks[i]
+        if rank > 0:
+            previous = patches[sorted_indexes[rank - 1]][0]
+        else:
+            previous = None
+        if rank + 1 < n:
+            following = patches[sorted_indexes[rank + 1]][0]
+        else:
+            following = None
+        result.append((patches[i][0], previous, following,))
+    return (len(misplaced), result,)
+
+
+def describe_unsorted(result):
+    """
+    Format the result of check_sorted().
+    """
+    count, problems = result
+    lines = ["%d entries of the sorted section are out of order.\n" % (
+        count,)]
+    for patch, previous, following in problems:
+        lines.append("%s\n" % (patch,))
+        if previous is None:
+            lines.append("\tshould be first\n")
+        else:
+            lines.append("\tshould come after  %s\n" % (previous,))
+        if following is None:
+            lines.append("\tshould be last\n")
+        else:
+            lines.append("\tshould come before %s\n" % (following,))
+    if count > len(problems):
+        lines.append("...\n")
+    return "".join(lines)
+
+
 def get_url_map():
     result = {}
     for canon_url, branch_name in git_sort.remotes:
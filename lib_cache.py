@@ -0,0 +1,107 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Storage for the persistent data (caches and indexes) used to speed up the
+tools in this repository.
+
+Files are kept under $KSAPPLY_CACHE if set, otherwise under
+$XDG_CACHE_HOME/ksapply or ~/.cache/ksapply. Setting $KSAPPLY_NO_CACHE
+disables reading and writing of the cached data.
+"""
+
+import errno
+import hashlib
+import os
+import os.path
+import pickle
+import tempfile
+
+
+def enabled():
+    return not os.environ.get("KSAPPLY_NO_CACHE")
+
+
+def cache_dir():
+    if "KSAPPLY_CACHE" in os.environ:
+        path = os.environ["KSAPPLY_CACHE"]
+    else:
+        path = os.path.join(
+            os.environ.get("XDG_CACHE_HOME",
+                           os.path.join(os.path.expanduser("~"), ".cache")),
+            "ksapply")
+    try:
+        os.makedirs(path)
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            raise
+    return path
+
+
+def scope_id(scope):
+    """
+    Return a short identifier for a path (a repository, a series.conf, ...)
+    that some data relates to.
+    """
+    scope = os.path.realpath(scope)
+    if not isinstance(scope, bytes):
+        scope = scope.encode("utf-8")
+    return hashlib.sha1(scope).hexdigest()[:16]
+
+
+def cache_path(name, scope=None):
+    """
+    Return the path of a cache file. Data that relates to a specific
+    repository or tree should pass its path as "scope" so that different
+    trees do not share the same file.
+    """
+    if scope is not None:
+        name = "%s-%s" % (name, scope_id(scope),)
+    return os.path.join(cache_dir(), name)
+
+
+def load(path, version):
+    """
+    Return the data saved at path or None if it is missing, unreadable or was
+    saved with a different version.
+    """
+    if not enabled():
+        return None
+
+    try:
+        with open(path, "rb") as f:
+            saved_version, data = pickle.load(f)
+    except (IOError, OSError, EOFError, ValueError, TypeError, KeyError,
+            AttributeError, ImportError, pickle.UnpicklingError):
+        return None
+
+    if saved_version != version:
+        return None
+    return data
+
+
+def replace(path, write, mode="wb", perm=None):
+    """
+    Atomically replace the file at path with the content produced by
+    write(f). perm is the permission bits of the new file, it is only
+    readable by the user by default.
+    """
+    dirname = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".%s." % (os.path.basename(path),),
+                                    dir=dirname)
+    try:
+        if perm is not None:
+            os.fchmod(fd, perm)
+        with os.fdopen(fd, mode) as f:
+            write(f)
+        os.rename(tmp_path, path)
+    except:
+        os.unlink(tmp_path)
+        raise
+
+
+def save(path, version, data):
+    if not enabled():
+        return
+
+    replace(path, lambda f: pickle.dump((version, data,), f, 2))
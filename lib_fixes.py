@@ -0,0 +1,138 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Index of the commits which mention other commits in their log message, for
+example in a "Fixes:" tag, in "commit X upstream", in "This reverts commit X"
+or in free text.
+"""
+
+import collections
+import pygit2
+import re
+
+import lib_cache
+import lib_upstream
+
+
+class ReferenceIndex(object):
+    """
+    Map from abbreviated commit ids (abbrev_len characters) found in log
+    messages to the ids of the commits whose log message contains them.
+
+    All runs of lowercase hex digits which are at least abbrev_len long are
+    indexed by their first abbrev_len characters. This is what `git log
+    --grep=<abbreviated id>` finds except for ids which are mentioned in the
+    middle of a longer run of hex digits.
+
+    The index covers the commits reachable from HEAD and from the remote
+    tracking branches. It is saved between runs and, when new commits are
+    fetched, only these are walked.
+    """
+    version = 1
+    abbrev_len = 7
+    hex_re = re.compile("[0-9a-f]{%d,}" % (abbrev_len,))
+
+    def __init__(self, repo):
+        self.repo = repo
+        self.path = lib_cache.cache_path("references", repo.path)
+        # [commit id] from which the indexed history is reachable
+        self.tips = []
+        # abbreviated id: [commit id of a non-merge commit which mentions it]
+        self.references = {}
+
+    def load(self):
+        data = lib_cache.load(self.path, self.version)
+        if data is not None:
+            self.tips, self.references = data
+
+    def save(self):
+        lib_cache.save(self.path, self.version, (self.tips, self.references,))
+
+    def current_tips(self):
+        tips = set()
+        try:
+            tips.add(str(self.repo.head.target))
+        except pygit2.GitError:
+            pass
+        for name in self.repo.listall_references():
+            if name.startswith("refs/remotes/"):
+                try:
+                    target = self.repo.lookup_reference(name).resolve().target
+                except (KeyError, ValueError):
+                    continue
+                tips.add(str(target))
+        return sorted(tips)
+
+    def update(self):
+        """
+        Index the commits that are reachable from the current tips but not
+        from the indexed ones.
+
+        Returns True if the index changed.
+        """
+        tips = self.current_tips()
+        if tips == self.tips:
+            return False
+
+        walker = self.repo.walk(None, pygit2.GIT_SORT_NONE)
+        for tip in tips:
+            walker.push(tip)
+        for tip in self.tips:
+            try:
+                walker.hide(tip)
+            except (KeyError, ValueError, pygit2.GitError):
+                # the old tip is gone, walk everything again
+                return self.rebuild()
+
+        references = collections.defaultdict(list, self.references)
+        for commit in walker:
+            if len(commit.parents) > 1:
+                continue
+            commit_id = str(commit.id)
+            for value in set([match[:self.abbrev_len] for match in
+                              self.hex_re.findall(commit.message)]):
+                references[value].append(commit_id)
+        self.references = dict(references)
+        self.tips = tips
+        return True
+
+    def rebuild(self):
+        self.tips = []
+        self.references = {}
+        return self.update()
+
+    @classmethod
+    def open(cls, repo):
+        """
+        Return an up to date index for repo.
+        """
+        index = cls(repo)
+        index.load()
+        if index.update():
+            index.save()
+        return index
+
+    def find(self, commit, short, head):
+        """
+        commit is a pygit2 Commit, short is its abbreviated id (at least
+        abbrev_len characters) and head is the id of the commit whose history
+        is searched.
+
+        Returns the commits which mention short in their log message and
+        which are in the range commit..head, in the order of `git log`.
+        """
+        result = []
+        commit_id = str(commit.id)
+        for candidate_id in self.references.get(short[:self.abbrev_len], ()):
+            if (candidate_id == commit_id or
+                    not lib_upstream.is_ancestor(self.repo, candidate_id,
+                                                 head) or
+                    lib_upstream.is_ancestor(self.repo, candidate_id,
+                                             commit_id)):
+                continue
+            candidate = self.repo[candidate_id]
+            if short in candidate.message:
+                result.append(candidate)
+        result.sort(key=lambda c: c.commit_time, reverse=True)
+        return result
@@ -0,0 +1,365 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Index from the upstream commit ids found in the Git-commit tags of the patches
+of a series to these patches.
+"""
+
+import collections
+import multiprocessing
+import os
+import os.path
+import pygit2
+
+import lib
+import lib_cache
+import lib_patch
+import lib_stable
+import lib_tag
+
+
+class CommitIndex(object):
+    """
+    The index is saved between runs. It is updated incrementally: series.conf
+    is read again only if it changed and only the headers of the patches that
+    changed are read again (through lib_tag.TagCache).
+
+    Commit ids may be full or abbreviated, both in patch tags and in queries.
+    A query matches a tag if one is a prefix of the other.
+    """
+    version = 1
+    # length of the keys of the abbreviated ids table
+    abbrev_len = 7
+
+    def __init__(self, series_path):
+        self.series_path = os.path.realpath(series_path)
+        self.base = os.path.dirname(self.series_path)
+        self.path = lib_cache.cache_path("commits", self.series_path)
+
+        self.series_stamp = None
+        # [patch name] in series order
+        self.patches = []
+        # patch name: (stamp, [commits], [references],)
+        self.entries = {}
+        # commit: [patch name]
+        self.commits = {}
+        # commit[:abbrev_len]: [commit]
+        self.abbrev = {}
+
+    def load(self):
+        data = lib_cache.load(self.path, self.version)
+        if data is not None:
+            (self.series_stamp, self.patches, self.entries, self.commits,
+             self.abbrev,) = data
+
+    def save(self):
+        lib_cache.save(self.path, self.version, (
+            self.series_stamp, self.patches, self.entries, self.commits,
+            self.abbrev,))
+
+    def update(self, check_patches=True):
+        """
+        Bring the index up to date with series.conf and the patch files.
+
+        If check_patches is False, the patches that are already indexed are
+        assumed to be unchanged. This is for long-running processes which
+        check them separately.
+
+        Returns True if anything changed.
+        """
+        changed = False
+
+        stamp = lib.file_stamp(self.series_path)
+        if stamp != self.series_stamp:
+            with open(self.series_path) as f:
+                patches = [lib.firstword(line) for line in f
+                           if lib.filter_patches(line)]
+            self.series_stamp = stamp
+            if patches != self.patches:
+                self.patches = patches
+                changed = True
+
+        cache = lib_tag.tag_cache()
+        entries = {}
+        for name in self.patches:
+            if name in entries:
+                continue
+            if not check_patches and name in self.entries:
+                entries[name] = self.entries[name]
+                continue
+            path = os.path.join(self.base, name)
+            try:
+                stamp = lib.file_stamp(path)
+            except OSError:
+                # patches that are listed in series.conf but missing from the
+                # tree are not indexed
+                continue
+            entry = self.entries.get(name)
+            if entry is None or entry[0] != stamp:
+                tags = cache.get_all(path)
+                entry = (stamp,
+                         [lib.firstword(tag).lower()
+                          for tag in tags["Git-commit"] if tag.strip()],
+                         tags["References"],)
+                changed = True
+            entries[name] = entry
+        if len(entries) != len(self.entries):
+            changed = True
+        self.entries = entries
+
+        if changed:
+            self.commits = collections.defaultdict(list)
+            for name in self.patches:
+                try:
+                    entry = self.entries[name]
+                except KeyError:
+                    continue
+                for commit in entry[1]:
+                    if name not in self.commits[commit]:
+                        self.commits[commit].append(name)
+            self.commits = dict(self.commits)
+
+            self.abbrev = collections.defaultdict(list)
+            for commit in self.commits:
+                self.abbrev[commit[:self.abbrev_len]].append(commit)
+            self.abbrev = dict(self.abbrev)
+
+        return changed
+
+    @classmethod
+    def open(cls, series_path):
+        """
+        Return an up to date index for series_path.
+        """
+        index = cls(series_path)
+        index.load()
+        if index.update():
+            index.save()
+        return index
+
+    def find(self, commit):
+        """
+        Returns the names of the patches which carry commit, in series order.
+        """
+        commit = commit.lower()
+        if len(commit) >= self.abbrev_len:
+            candidates = self.abbrev.get(commit[:self.abbrev_len], ())
+        else:
+            candidates = self.commits.keys()
+
+        names = set()
+        for tag in candidates:
+            if tag.startswith(commit) or commit.startswith(tag):
+                names.update(self.commits[tag])
+        if len(names) > 1:
+            order = dict([(name, i,) for i, name in enumerate(self.patches)])
+            return sorted(names, key=lambda name: order[name])
+        else:
+            return list(names)
+
+    def find_many(self, commits):
+        """
+        Returns a dict
+            commit: [patch names]
+        for all the commits which are found.
+        """
+        result = {}
+        for commit in commits:
+            names = self.find(commit)
+            if names:
+                result[commit] = names
+        return result
+
+    def references(self, name):
+        return self.entries[name][2]
+
+
+def describe_duplicates(index, commits, get_top, get_stable=None):
+    """
+    commits is a list of full upstream commit ids. get_top is a function which
+    returns the name of the top applied patch with the "patches/" prefix.
+    get_stable is an optional function which returns a
+    lib_stable.StableIndex, it is used to report the stable releases of the
+    commits which are found in patches.kernel.org patches.
+
+    Returns the text that qdupcheck prints about the commits that are already
+    present in the series, an empty string if there are none.
+    """
+    found = index.find_many(commits)
+    result = []
+    top = None
+    for commit in commits:
+        if commit not in found:
+            continue
+        name = found[commit][0]
+        result.append("Commit %s already present in patch\n\t%s\n" % (
+            commit[:12], name,))
+        references = " ".join(index.references(name))
+        if references:
+            result.append("for\n\t%s\n" % (references,))
+        if get_stable is not None and name.startswith("patches.kernel.org/"):
+            result.append(lib_stable.describe_backports(get_stable(), commit,
+                                                        name))
+
+        if top is None:
+            top = get_top()
+        if top == os.path.join("patches", name):
+            result.append("This is the top patch.\n")
+    return "".join(result)
+
+
+def resolve_tags(repo, index):
+    """
+    Returns a dict
+        patch name: [commit]
+    with the Git-commit tags of the patches of index expanded to full ids.
+    Tags that cannot be resolved are left as they are.
+    """
+    tags = set([tag for name in index.patches if name in index.entries
+                for tag in index.entries[name][1]])
+    found, ambiguous = lib.lookup_commits(repo, tags)
+    for tag in tags - set(found) - set(ambiguous):
+        try:
+            found[tag] = str(repo.revparse_single(tag).id)
+        except (KeyError, ValueError):
+            pass
+
+    result = {}
+    for name in index.patches:
+        if name in index.entries and name not in result:
+            result[name] = [found.get(tag, tag)
+                            for tag in index.entries[name][1]]
+    return result
+
+
+_patch_id_repo = None
+
+
+def _patch_id_init(repo_path):
+    global _patch_id_repo
+    _patch_id_repo = pygit2.Repository(repo_path)
+
+
+def _patch_ids(repo, commits):
+    """
+    Returns a list
+        [(commit, patch-id or None,)]
+    """
+    result = []
+    for commit in commits:
+        try:
+            obj = repo[commit].peel(pygit2.Commit)
+        except (KeyError, ValueError):
+            result.append((commit, None,))
+            continue
+        result.append((commit, lib_patch.patch_id(repo, obj),))
+    return result
+
+
+def _patch_id_chunk(commits):
+    return _patch_ids(_patch_id_repo, commits)
+
+
+class PatchIds(object):
+    """
+    Patch-ids (see lib_patch.patch_id()) of upstream commits, saved between
+    runs. Commits do not change, so the entries never become stale.
+    """
+    version = 2
+
+    def __init__(self, repo):
+        self.repo = repo
+        self.path = lib_cache.cache_path("patchids", repo.path)
+        # commit: patch-id, None if the commit is not in the repository or
+        # if it is empty
+        self.ids = {}
+
+    def load(self):
+        data = lib_cache.load(self.path, self.version)
+        if data is not None:
+            self.ids = data
+
+    def save(self):
+        lib_cache.save(self.path, self.version, self.ids)
+
+    def update(self, commits, jobs=1):
+        """
+        Compute the patch-ids of the commits which are not known yet, with a
+        pool of jobs processes.
+
+        Returns True if anything changed.
+        """
+        todo = sorted(set([commit for commit in commits
+                           if len(commit) == 40 and commit not in self.ids]))
+        if not todo:
+            return False
+        if jobs <= 1 or len(todo) < 2:
+            results = [_patch_ids(self.repo, todo)]
+        else:
+            size = max(1, (len(todo) + jobs * 4 - 1) // (jobs * 4))
+            chunks = [todo[i:i + size] for i in range(0, len(todo), size)]
+            pool = multiprocessing.Pool(jobs, _patch_id_init,
+                                        (self.repo.path,))
+            try:
+                results = pool.map(_patch_id_chunk, chunks)
+            except:
+                pool.terminate()
+                raise
+            else:
+                pool.close()
+            finally:
+                pool.join()
+        for result in results:
+            self.ids.update(result)
+        return True
+
+    @classmethod
+    def open(cls, repo, commits, jobs=1):
+        """
+        Return an index which includes the patch-ids of commits.
+        """
+        patch_ids = cls(repo)
+        patch_ids.load()
+        if patch_ids.update(commits, jobs):
+            patch_ids.save()
+        return patch_ids
+
+
+def describe_series_duplicates(index, patch_commits, patch_ids):
+    """
+    patch_commits is the result of resolve_tags() and patch_ids a PatchIds
+    which covers its commits.
+
+    Returns the text that `qdupcheck --all` prints about the commits which
+    are carried by more than one patch and about the patches whose commits
+    have the same changes, an empty string if there are none.
+    """
+    # commit: [patch name]
+    by_commit = collections.OrderedDict()
+    for name in index.patches:
+        for commit in patch_commits.get(name, ()):
+            names = by_commit.setdefault(commit, [])
+            if name not in names:
+                names.append(name)
+
+    result = []
+    for commit, names in by_commit.items():
+        if len(names) > 1:
+            result.append("Commit %s is present in %d patches\n" % (
+                commit[:12], len(names),))
+            result.extend(["\t%s\n" % (name,) for name in names])
+
+    # patch-id: [commit]
+    by_patch_id = collections.OrderedDict()
+    for commit in by_commit:
+        patch_id = patch_ids.ids.get(commit)
+        if patch_id is not None:
+            by_patch_id.setdefault(patch_id, []).append(commit)
+    for commits in by_patch_id.values():
+        if len(commits) > 1:
+            result.append("Commits %s have the same changes, in patches\n" %
+                          (", ".join([commit[:12] for commit in commits]),))
+            result.extend(["\t%s\n" % (name,) for commit in commits
+                           for name in by_commit[commit]])
+    return "".join(result)
@@ -0,0 +1,432 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Generation of patches from pygit2 commits in the format of
+    git format-patch --notes --subject-prefix= --no-numbered
+without running git.
+"""
+
+import hashlib
+import os
+import pygit2
+import re
+import subprocess
+import time
+
+import lib
+import lib_trace
+
+
+_weekdays = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun",)
+_months = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep",
+           "Oct", "Nov", "Dec",)
+# characters that git quotes in the name of an email address
+_rfc822_specials = set("()<>[]:;@\\,.\"")
+# width used by git to wrap the Subject: line and the diffstat
+_mail_width = 78
+_stat_width = 72
+# like the %f format of git
+_title_re = re.compile("[^a-zA-Z0-9._]+")
+
+
+def _text(value):
+    if isinstance(value, bytes):
+        return value.decode("utf-8", "replace")
+    return value
+
+
+def _non_ascii(text):
+    return [c for c in text if ord(c) > 127]
+
+
+def format_date(signature):
+    """
+    Returns the time of a pygit2 Signature in RFC 2822 format, in its own
+    timezone.
+    """
+    offset = signature.offset
+    t = time.gmtime(signature.time + offset * 60)
+    if offset < 0:
+        sign = "-"
+        offset = -offset
+    else:
+        sign = "+"
+    return "%s, %d %s %d %02d:%02d:%02d %s%02d%02d" % (
+        _weekdays[t.tm_wday], t.tm_mday, _months[t.tm_mon - 1], t.tm_year,
+        t.tm_hour, t.tm_min, t.tm_sec, sign, offset // 60, offset % 60,)
+
+
+def needs_rfc2047(text):
+    return bool(_non_ascii(text)) or "\n" in text or "=?" in text
+
+
+def rfc2047(text, line_len, address=False):
+    """
+    Encode text like git's add_rfc2047(). line_len is the length of what
+    precedes the encoded text on its line.
+    """
+    max_len = 76
+    result = ["=?UTF-8?q?"]
+    line_len += len(result[0])
+    for c in text:
+        if (ord(c) > 127 or not 32 < ord(c) < 127 or c in "=?_" or
+                (address and not (c.isalnum() or c in "!*+-/"))):
+            encoded = "".join(["=%02X" % (b,) for b in
+                               bytearray(c.encode("utf-8"))])
+        else:
+            encoded = c
+        if line_len + len(encoded) + 2 > max_len:
+            result.append("?=\n =?UTF-8?q?")
+            line_len = len("=?UTF-8?q?") + 1
+        result.append(encoded)
+        line_len += len(encoded)
+    result.append("?=")
+    return "".join(result)
+
+
+def format_from(signature):
+    name = _text(signature.name)
+    prefix = "From: "
+    if needs_rfc2047(name):
+        name = rfc2047(name, len(prefix), True)
+    elif [c for c in name if c in _rfc822_specials]:
+        name = '"%s"' % (name.replace("\\", "\\\\").replace('"', '\\"'),)
+    return "%s%s <%s>" % (prefix, name, _text(signature.email),)
+
+
+def format_subject(subject):
+    """
+    Returns the lines of the Subject: header, wrapped or encoded like git
+    does.
+    """
+    prefix = "Subject: "
+    if needs_rfc2047(subject):
+        return (prefix + rfc2047(subject, len(prefix))).split("\n")
+
+    lines = []
+    line = prefix
+    for word in subject.split(" "):
+        if line == prefix:
+            line += word
+        elif len(line) + 1 + len(word) <= _mail_width:
+            line += " " + word
+        else:
+            lines.append(line)
+            line = " " + word
+    lines.append(line)
+    return lines
+
+
+def split_message(message):
+    """
+    Returns (subject, [body lines],) for a commit message. The subject is
+    the first paragraph joined on a single line, like git's "%s" format.
+    """
+    lines = _text(message).rstrip().split("\n")
+    i = 0
+    while i < len(lines) and not lines[i].strip():
+        i += 1
+    title = []
+    while i < len(lines) and lines[i].strip():
+        title.append(lines[i].strip())
+        i += 1
+    while i < len(lines) and not lines[i].strip():
+        i += 1
+    return (" ".join(title), [line.rstrip() for line in lines[i:]],)
+
+
+def subject(commit):
+    """
+    Returns the subject of a commit like git's "%s" format.
+    """
+    return split_message(commit.message)[0]
+
+
+def sanitized_subject(subject):
+    """
+    Returns the file name that `git format-patch` derives from a subject,
+    without the number prefix and the suffix.
+    """
+    name = _title_re.sub("-", re.sub(r"\.+", ".", subject)).strip("-")
+    return name.rstrip(".-")[:52]
+
+
+def commit_diff(repo, commit):
+    """
+    Returns the pygit2 Diff between commit and its first parent, with renames
+    detected and binary content included.
+    """
+    flags = pygit2.GIT_DIFF_SHOW_BINARY
+    if commit.parents:
+        diff = repo.diff(commit.parents[0], commit, flags=flags)
+    else:
+        diff = commit.tree.diff_to_tree(flags=flags, swap=True)
+    diff.find_similar(pygit2.GIT_DIFF_FIND_RENAMES)
+    return diff
+
+
+def patch_id(repo, commit):
+    """
+    Returns, as a hex string, an id of the changes of commit which does not
+    depend on line numbers, whitespace or the order of the files, like
+    `git patch-id --stable`. Returns None if commit changes nothing, like
+    git which prints no id for it.
+    """
+    diff = commit_diff(repo, commit)
+    if len(diff) == 0:
+        return None
+    try:
+        return str(diff.patchid)
+    except AttributeError:
+        # older pygit2
+        pass
+    total = 0
+    for patch in diff:
+        h = hashlib.sha1()
+        delta = patch.delta
+        h.update(("%s%s" % (delta.old_file.path,
+                            delta.new_file.path,)).encode("utf-8"))
+        for hunk in patch.hunks:
+            for line in hunk.lines:
+                if line.origin in " +-":
+                    h.update(("%s%s" % (line.origin, "".join(
+                        _text(line.content).split()),)).encode("utf-8"))
+        total += int(h.hexdigest(), 16)
+    return "%040x" % (total % (1 << 160),)
+
+
+def commit_note(repo, commit):
+    try:
+        return _text(repo.lookup_note(str(commit.id)).message)
+    except KeyError:
+        return None
+
+
+def rename_name(old, new):
+    """
+    Returns the name of a rename in the diffstat, with the common leading
+    and trailing directories factored out, like git's pprint_rename():
+        drivers/{f1.c => g1.c}
+    """
+    # length of the common prefix, up to a slash
+    prefix = 0
+    i = 0
+    while i < len(old) and i < len(new) and old[i] == new[i]:
+        if old[i] == "/":
+            prefix = i + 1
+        i += 1
+    # length of the common suffix, from a slash. The search may go back one
+    # character into the prefix to see its slash.
+    suffix = 0
+    limit = prefix - 1 if prefix else 0
+    i = len(old)
+    j = len(new)
+    while (i >= limit and j >= limit and
+           (old[i] if i < len(old) else "") ==
+           (new[j] if j < len(new) else "")):
+        if i < len(old) and old[i] == "/":
+            suffix = len(old) - i
+        i -= 1
+        j -= 1
+    old_mid = old[prefix:max(prefix, len(old) - suffix)]
+    new_mid = new[prefix:max(prefix, len(new) - suffix)]
+    if prefix or suffix:
+        return "%s{%s => %s}%s" % (old[:prefix], old_mid, new_mid,
+                                   old[len(old) - suffix:],)
+    return "%s => %s" % (old_mid, new_mid,)
+
+
+def format_summary(diff):
+    """
+    Returns the lines which follow the diffstat in the output of git: files
+    created, deleted or renamed and mode changes. The summary of libgit2 has
+    no rename lines.
+    """
+    lines = []
+    for delta in diff.deltas:
+        old = delta.old_file
+        new = delta.new_file
+        if delta.status == pygit2.GIT_DELTA_ADDED:
+            lines.append(" create mode %06o %s" % (new.mode, _text(new.path),))
+        elif delta.status == pygit2.GIT_DELTA_DELETED:
+            lines.append(" delete mode %06o %s" % (old.mode, _text(old.path),))
+        elif delta.status == pygit2.GIT_DELTA_RENAMED:
+            lines.append(" rename %s (%d%%)" % (
+                rename_name(_text(old.path), _text(new.path)),
+                delta.similarity,))
+            if old.mode != new.mode:
+                lines.append(" mode change %06o => %06o" % (old.mode,
+                                                            new.mode,))
+        elif old.mode != new.mode:
+            lines.append(" mode change %06o => %06o %s" % (
+                old.mode, new.mode, _text(new.path),))
+    return lines
+
+
+def format_header(repo, commit, diff=None, notes=True, subject_prefix=""):
+    """
+    Returns the lines of the header of the patch for commit, up to the
+    diffstat of diff included, without the "From <commit id>" line. Without
+    diff, the header is like the one of `git format-patch -p`.
+
+    The lines of the diffstat are formatted by libgit2, which abbreviates
+    some renames differently from git ("a/{b/c => c}" instead of
+    "a/{b => }/c"). format_patch() does not use it for diffs with renames.
+    """
+    subject, message = split_message(commit.message)
+    header = [format_from(commit.author),
+              "Date: %s" % (format_date(commit.author),)]
+    header.extend(format_subject(subject_prefix + subject))
+    if _non_ascii(_text(commit.message)):
+        header.extend(("MIME-Version: 1.0",
+                       "Content-Type: text/plain; charset=UTF-8",
+                       "Content-Transfer-Encoding: 8bit",))
+    header.append("")
+    header.extend(message)
+
+    if diff is not None:
+        header.append("---")
+        note = notes and commit_note(repo, commit)
+        if note:
+            header.extend(("", "Notes:",))
+            header.extend(["    %s" % (line,)
+                           for line in note.rstrip("\n").split("\n")])
+            header.append("")
+        stats = diff.stats.format(pygit2.GIT_DIFF_STATS_FULL, _stat_width)
+        header.extend(_text(stats).rstrip("\n").split("\n"))
+        header.extend(format_summary(diff))
+    header.append("")
+    return header
+
+
+def has_renames(diff):
+    return any(delta.status == pygit2.GIT_DELTA_RENAMED
+               for delta in diff.deltas)
+
+
+def git_format_patch(repo, commit):
+    """
+    Returns the text of the patch for commit generated by `git format-patch`,
+    without the "From <commit id>" line and the signature.
+    """
+    env = dict(os.environ)
+    env["GIT_DIR"] = repo.path
+    args = ("git", "format-patch", "--stdout", "--notes", "--max-count=1",
+            "--subject-prefix=", "--no-numbered", str(commit.id),)
+    with lib_trace.command_phase(args):
+        try:
+            text = _text(subprocess.check_output(
+                args, env=env, preexec_fn=lib.restore_signals))
+        except subprocess.CalledProcessError:
+            raise lib.KSError("`git format-patch` failed for commit %s." % (
+                str(commit.id)[:12],))
+    text = text.split("\n", 1)[1]
+    i = text.rfind("\n-- \n")
+    if i != -1:
+        text = text[:i + 1]
+    return text
+
+
+@lib_trace.traced("format_patch")
+def format_patch(repo, commit, diff=None):
+    """
+    Returns the text of the patch for commit, without the "From <commit id>"
+    line and the signature. diff is the result of commit_diff() if the
+    caller already has it.
+
+    The diffstat of renames is not always the same as the one of git, the
+    patches of commits with renames are generated by `git format-patch`.
+    """
+    if diff is None:
+        diff = commit_diff(repo, commit)
+    if has_renames(diff):
+        return git_format_patch(repo, commit)
+    return "%s\n%s" % ("\n".join(format_header(repo, commit, diff)),
+                        _text(diff.patch or ""),)
+
+
+def strip_describe(name):
+    return re.split("[~^]", name, 1)[0]
+
+
+def describe_contains(revs, all_refs=False):
+    """
+    Like `git describe --contains --match "v*"` or, with all_refs, `git
+    describe --contains --all`, for several revisions in a single call.
+
+    Returns a list with the description of each revision, None if it is not
+    contained in any of the references.
+    """
+    if not revs:
+        return []
+    args = ["git", "name-rev", "--peel-tag", "--name-only"]
+    if not all_refs:
+        args.extend(("--tags", "--refs=refs/tags/v*",))
+    args.extend(revs)
+    with lib_trace.command_phase(args):
+        output = subprocess.check_output(args,
+                                         preexec_fn=lib.restore_signals)
+    result = []
+    for line in output.decode("utf-8").splitlines():
+        line = line.strip()
+        if line == "undefined":
+            result.append(None)
+        else:
+            result.append(line)
+    return result
+
+
+def _config_get(repo, name):
+    try:
+        return _text(repo.config[name])
+    except KeyError:
+        return None
+
+
+def describe_commits(commits):
+    """
+    Returns a dict
+        commit: (`git describe --contains --match "v*"` result,
+                 `git describe --contains --all` result,)
+    The second description is only looked up for commits that have no first
+    one. Missing descriptions are None.
+    """
+    tags = describe_contains(commits)
+    queued = [commit for commit, tag in zip(commits, tags) if tag is None]
+    refs = dict(zip(queued, describe_contains(queued, True)))
+    return dict([(commit, (tag, refs.get(commit),),)
+                 for commit, tag in zip(commits, tags)])
+
+
+def mainline_status(repo, commit, description):
+    """
+    Describe the upstream status of a commit like clean_header.sh, from its
+    entry in the result of describe_commits().
+
+    Returns
+        (Patch-mainline value, Git-repo value or None,)
+    """
+    tag, ref = description
+    if tag is not None:
+        return (strip_describe(tag), None,)
+
+    if ref is None:
+        raise lib.KSError("Commit %s is not contained in any reference of "
+                          "\"%s\"." % (commit[:12], repo.path,))
+    if ref.startswith("remotes/"):
+        remote = ref.split("/")[1]
+    else:
+        branch = strip_describe(ref)
+        if branch == "stash":
+            raise lib.KSError("cannot use stash to describe patch. Stopping "
+                              "to avoid possibly erroneous results.")
+        remote = _config_get(repo, "branch.%s.remote" % (branch,))
+        if remote is None:
+            raise lib.KSError("branch \"%s\" which contains commit %s has "
+                              "no remote." % (branch, commit[:12],))
+    url = _config_get(repo, "remote.%s.url" % (remote,))
+    if url is None:
+        raise lib.KSError("remote \"%s\" which contains commit %s has no "
+                          "url." % (remote, commit[:12],))
+    return ("Queued in subsystem maintainer repository", url,)
@@ -0,0 +1,83 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Staging area for the patches that qprefetch.py prepares ahead of qcp.py.
+
+The patches are staged under .pc/prefetch in the quilt tree, one file per
+upstream commit id. A staged patch is only used if it was generated from the
+same repository with the same references, destination and header cleaner
+(see qcp.header_cleaner()) that qcp is called with.
+"""
+
+import errno
+import os
+import os.path
+import pickle
+
+import lib_cache
+
+
+class StagingArea(object):
+    version = 2
+
+    def __init__(self, path=os.path.join(".pc", "prefetch")):
+        self.path = path
+
+    def _entry_path(self, commit):
+        return os.path.join(self.path, commit)
+
+    def staged(self):
+        """
+        Returns the commit ids that have a staged patch.
+        """
+        try:
+            return [name for name in os.listdir(self.path)
+                    if not name.startswith(".")]
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+            return []
+
+    def stage(self, commit, repo_path, references, destination, cleaner,
+              text):
+        try:
+            os.makedirs(self.path)
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                raise
+        data = (repo_path, references, destination, cleaner, text,)
+        lib_cache.replace(self._entry_path(commit), lambda f: pickle.dump(
+            (self.version, data,), f, 2))
+
+    def get(self, commit, repo_path, references, destination, cleaner):
+        """
+        Returns the text of the patch staged for commit or None if there is
+        none or if it was staged with different parameters.
+        """
+        try:
+            with open(self._entry_path(commit), "rb") as f:
+                version, data = pickle.load(f)
+        except (IOError, OSError, EOFError, ValueError, TypeError,
+                pickle.UnpicklingError):
+            return None
+        if version != self.version or data[:4] != (repo_path, references,
+                                                   destination, cleaner,):
+            return None
+        return data[4]
+
+    def remove(self, commit):
+        try:
+            os.unlink(self._entry_path(commit))
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+
+    def discard(self, keep=()):
+        """
+        Remove the staged patches of all the commits that are not in keep.
+        """
+        keep = set(keep)
+        for commit in self.staged():
+            if commit not in keep:
+                self.remove(commit)
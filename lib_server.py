@@ -0,0 +1,117 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Protocol and client side of ksapply_server.py.
+
+This module must stay cheap to import: thin clients import it before
+anything else and only load pygit2 and the rest of the library when no server
+is running.
+"""
+
+import errno
+import os
+import os.path
+import pickle
+import socket
+import struct
+import sys
+
+import lib_cache
+
+
+length = struct.Struct("!I")
+
+
+def socket_path():
+    """
+    Returns the path of the socket of the server for the current LINUX_GIT,
+    None if it cannot be determined.
+    """
+    if "KSAPPLY_SOCKET" in os.environ:
+        return os.environ["KSAPPLY_SOCKET"]
+    for var in ("GIT_DIR", "LINUX_GIT",):
+        if var in os.environ:
+            return "%s.sock" % (lib_cache.cache_path("server", os.environ[var]),)
+    return None
+
+
+def send(sock, obj):
+    data = pickle.dumps(obj, 2)
+    sock.sendall(length.pack(len(data)) + data)
+
+
+def _receive_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise EOFError("Connection closed by peer.")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def receive(sock):
+    size, = length.unpack(_receive_exactly(sock, length.size))
+    return pickle.loads(_receive_exactly(sock, size))
+
+
+def call(request):
+    """
+    Send request (a dict) to the server.
+
+    Returns the response of the server (a dict) or None if no server is
+    running.
+    """
+    if os.environ.get("KSAPPLY_NO_SERVER"):
+        return None
+    path = socket_path()
+    if path is None:
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            sock.connect(path)
+        except socket.error as err:
+            if err.errno in (errno.ENOENT, errno.ECONNREFUSED,):
+                return None
+            raise
+        send(sock, request)
+        return receive(sock)
+    finally:
+        sock.close()
+
+
+def batch_revs(revs):
+    """
+    Returns revs, or the first word of each line of stdin if revs is empty.
+    """
+    if revs:
+        return revs
+    return [line.split(None, 1)[0] for line in sys.stdin if line.strip()]
+
+
+def run(op, **kwargs):
+    """
+    For thin clients: if a server is running, let it handle the operation,
+    print its output and exit with its status. If no server is running,
+    return None so that the caller can do the work in-process.
+
+    Responses carry "status", "stdout" and "stderr". Operations that produce
+    data for the client also carry "result"; when it is present and status is
+    0, the response is returned instead of exiting.
+    """
+    request = dict(kwargs)
+    request["op"] = op
+    request["cwd"] = os.getcwd()
+    response = call(request)
+    if response is None:
+        return None
+
+    sys.stdout.write(response["stdout"])
+    sys.stderr.write(response["stderr"])
+    if response["status"] or "result" not in response:
+        sys.exit(response["status"])
+    return response
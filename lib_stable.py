@@ -0,0 +1,238 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Index from upstream commit ids to the commits of the stable releases which
+backport them.
+"""
+
+import collections
+import pygit2
+import re
+
+import lib_cache
+
+
+# "commit <id> upstream." and "[ Upstream commit <id> ]" are the forms used
+# by the stable maintainers
+_upstream_res = (
+    re.compile(r"^commit ([0-9a-f]{40}) upstream", re.MULTILINE),
+    re.compile(r"^\[? *[Uu]pstream commit ([0-9a-f]{40})", re.MULTILINE),
+)
+
+
+def release_version(name):
+    """
+    Returns the version of a release tag name as a tuple of ints, None if
+    name is not a release tag.
+    """
+    if not name.startswith("v"):
+        return None
+    try:
+        return tuple([int(part) for part in name[1:].split(".")])
+    except ValueError:
+        return None
+
+
+def is_stable(version):
+    """
+    Returns True if version is the version of a stable release, like
+    (4, 12, 3) or (2, 6, 32, 1).
+    """
+    if version[:2] == (2, 6):
+        return len(version) == 4
+    return len(version) == 3
+
+
+def base_version(version):
+    """
+    Returns the version of the mainline release that a stable release is
+    based on.
+    """
+    if version[:2] == (2, 6):
+        return version[:3]
+    return version[:2]
+
+
+def tag_name(version):
+    return "v%s" % (".".join([str(part) for part in version]),)
+
+
+def base_tag(version):
+    return tag_name(base_version(version))
+
+
+def upstream_ids(message):
+    result = []
+    for upstream_re in _upstream_res:
+        for commit in upstream_re.findall(message):
+            if commit not in result:
+                result.append(commit)
+    return result
+
+
+def parse_range(patch):
+    """
+    Returns the versions covered by a patches.kernel.org patch name, like
+    ((4, 12, 1,), (4, 12, 3,),) for "patch-4.12.3" or
+    ((4, 12, 3,), (4, 12, 3,),) for "patch-4.12.2-3", None if the name is not
+    recognized. 2.6 versions have four parts, like "patch-2.6.32.3".
+    """
+    match = re.search(r"patch-(\d+(?:\.\d+)+)(?:-(\d+))?", patch)
+    if match is None:
+        return None
+    version = tuple([int(part) for part in match.group(1).split(".")])
+    if not is_stable(version):
+        return None
+    base = base_version(version)
+    last = match.group(2)
+    if last is None:
+        return (base + (1,), version,)
+    else:
+        return (base + (int(last),), base + (int(last),),)
+
+
+class StableIndex(object):
+    """
+    Map from upstream commit ids to the stable commits which carry them,
+    found through the "commit <id> upstream" lines of their log message, and
+    the first stable release which contains each of them.
+
+    The index covers the commits of the stable release tags (vX.Y.Z) that
+    are not in a mainline tag. It is saved between runs and, when new tags
+    are fetched, only the commits that they add are walked.
+    """
+    version = 1
+
+    def __init__(self, repo):
+        self.repo = repo
+        self.path = lib_cache.cache_path("stable", repo.path)
+        # tag name: commit id of the indexed stable release tags
+        self.tags = {}
+        # upstream commit id: [(stable commit id, tag name,)]
+        self.backports = {}
+
+    def load(self):
+        data = lib_cache.load(self.path, self.version)
+        if data is not None:
+            self.tags, self.backports = data
+
+    def save(self):
+        lib_cache.save(self.path, self.version, (self.tags, self.backports,))
+
+    def current_tags(self):
+        """
+        Returns a tuple of two dicts
+            (stable tags, mainline tags,)
+        which map tag names to commit ids.
+        """
+        stable = {}
+        mainline = {}
+        prefix = "refs/tags/"
+        for name in self.repo.listall_references():
+            if not name.startswith(prefix):
+                continue
+            tag = name[len(prefix):]
+            version = release_version(tag.split("-rc", 1)[0])
+            if version is None:
+                continue
+            try:
+                target = str(self.repo.lookup_reference(name).peel(
+                    pygit2.Commit).id)
+            except (KeyError, ValueError, pygit2.GitError):
+                continue
+            if "-rc" not in tag and is_stable(version):
+                stable[tag] = target
+            else:
+                mainline[tag] = target
+        return (stable, mainline,)
+
+    def update(self):
+        """
+        Index the commits of the stable tags which are not indexed yet.
+
+        Returns True if the index changed.
+        """
+        stable, mainline = self.current_tags()
+        # without the base release, the whole history would be walked
+        stable = dict([(tag, target,) for tag, target in stable.items()
+                       if base_tag(release_version(tag)) in mainline])
+        if stable == self.tags:
+            return False
+        for tag, target in self.tags.items():
+            if stable.get(tag) != target:
+                # a tag was moved or deleted, walk everything again
+                self.tags = {}
+                self.backports = {}
+                break
+
+        backports = collections.defaultdict(list, self.backports)
+        tags = dict(self.tags)
+        # base version: [indexed version]
+        series = collections.defaultdict(list)
+        for tag in tags:
+            version = release_version(tag)
+            series[base_version(version)].append(version)
+        # in version order so that each commit is attributed to the first
+        # release which contains it
+        for tag in sorted(set(stable) - set(tags), key=release_version):
+            version = release_version(tag)
+            base = base_version(version)
+            walker = self.repo.walk(stable[tag], pygit2.GIT_SORT_NONE)
+            walker.hide(mainline[base_tag(version)])
+            previous = [v for v in series[base] if v < version]
+            if previous:
+                walker.hide(tags[tag_name(max(previous))])
+            for commit in walker:
+                commit_id = str(commit.id)
+                for upstream in upstream_ids(commit.message):
+                    backports[upstream].append((commit_id, tag,))
+            tags[tag] = stable[tag]
+            series[base].append(version)
+        self.backports = dict(backports)
+        self.tags = tags
+        return True
+
+    def rebuild(self):
+        self.tags = {}
+        self.backports = {}
+        return self.update()
+
+    @classmethod
+    def open(cls, repo):
+        """
+        Return an up to date index for repo.
+        """
+        index = cls(repo)
+        index.load()
+        if index.update():
+            index.save()
+        return index
+
+    def find(self, commit, versions=None):
+        """
+        Returns a list of
+            (stable commit id, tag name,)
+        for the stable backports of commit (a full upstream commit id), in
+        release order. versions is an optional (first, last,) pair of
+        versions to restrict the result to, as returned by parse_range().
+        """
+        result = self.backports.get(commit, [])
+        if versions is not None:
+            first, last = versions
+            result = [(stable_id, tag,) for stable_id, tag in result
+                      if first <= release_version(tag) <= last]
+        return sorted(result, key=lambda entry: release_version(entry[1]))
+
+
+def describe_backports(index, commit, patch):
+    """
+    Returns the text that qdupcheck prints about the stable releases which
+    contain commit when it is found in patch, a patches.kernel.org patch.
+    """
+    backports = index.find(commit, parse_range(patch))
+    if not backports:
+        return "No stable backport of this commit was found in the tags of " \
+            "the stable releases.\n"
+    return "".join(["Released in stable %s as commit %s\n" % (
+        tag, stable_id[:12],) for stable_id, tag in backports])
@@ -1,9 +1,14 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
-"""
-todo: cache the git-commit tag from patches based on inode and mtime
-"""
+import atexit
+import os
+import os.path
+import re
+
+import lib_cache
+import lib_trace
+
 
 def tag_get(patch, tag):
     start = "%s: " % (tag,)
@@ -23,3 +28,484 @@ def tag_get(patch, tag):
         pass
 
     return result
+
+
+def tags_get(patch, tags):
+    """
+    Like tag_get() but for multiple tags in a single pass over the header.
+
+    Returns a dict
+        tag: [values]
+    """
+    starts = [("%s: " % (tag,), tag,) for tag in tags]
+    result = dict([(tag, [],) for tag in tags])
+    for line in patch:
+        for start, tag in starts:
+            if line.startswith(start):
+                result[tag].append(line[len(start):-1])
+                break
+        else:
+            if line.startswith(("---", "***", "Index:", "diff -",)):
+                break
+
+    return result
+
+
+class TagCache(object):
+    """
+    Cache of the tags found in patch headers.
+
+    Entries are keyed on the absolute path of the patch and are invalidated
+    when the inode, mtime or size of the file change. A patch file whose
+    entry is valid is not opened.
+    """
+    tags = ("Git-commit", "Git-repo", "References",)
+    version = 1
+
+    def __init__(self, path=None):
+        if path is None:
+            path = lib_cache.cache_path("tags")
+        self.path = path
+        # abspath: (st_ino, st_mtime, st_size, {tag: [values]},)
+        self.entries = None
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+
+    def load(self):
+        if self.entries is None:
+            self.entries = lib_cache.load(self.path, self.version) or {}
+
+    def save(self):
+        if self.dirty:
+            lib_cache.save(self.path, self.version, self.entries)
+            self.dirty = False
+
+    def get_all(self, patch):
+        """
+        Returns a dict
+            tag: [values]
+        for all the cached tags of the patch file at path "patch".
+        """
+        self.load()
+        key = os.path.abspath(patch)
+        st = os.stat(key)
+        stamp = (st.st_ino, st.st_mtime, st.st_size,)
+        try:
+            entry = self.entries[key]
+        except KeyError:
+            pass
+        else:
+            if entry[:3] == stamp:
+                self.hits += 1
+                return entry[3]
+
+        self.misses += 1
+        if lib_trace.enabled:
+            lib_trace.add_bytes(st.st_size)
+        with open(key) as f:
+            tags = tags_get(f, self.tags)
+        self.entries[key] = stamp + (tags,)
+        self.dirty = True
+        return tags
+
+    def get(self, patch, tag):
+        if tag not in self.tags:
+            with open(patch) as f:
+                return tag_get(f, tag)
+        return list(self.get_all(patch)[tag])
+
+    def update(self, entries):
+        """
+        Merge entries obtained from another TagCache instance, for example in
+        a worker process.
+        """
+        self.load()
+        if entries:
+            self.entries.update(entries)
+            self.dirty = True
+
+    def prune(self):
+        """
+        Remove entries for patches that no longer exist.
+        """
+        self.load()
+        for key in [key for key in self.entries if not os.path.exists(key)]:
+            del self.entries[key]
+            self.dirty = True
+
+    def clear(self):
+        self.entries = {}
+        self.dirty = True
+
+
+class BlobTagCache(object):
+    """
+    Cache of the tags found in patch headers read from git objects, keyed on
+    the id of the blob. Blobs do not change, so entries are never
+    invalidated and they are shared by all the branches that contain the
+    same patch.
+    """
+    tags = TagCache.tags
+    version = 1
+
+    def __init__(self, path=None):
+        if path is None:
+            path = lib_cache.cache_path("blob-tags")
+        self.path = path
+        # blob id: {tag: [values]}
+        self.entries = None
+        # entries added since load()
+        self.new = {}
+
+    def load(self):
+        if self.entries is None:
+            self.entries = lib_cache.load(self.path, self.version) or {}
+
+    def save(self):
+        if self.new:
+            lib_cache.save(self.path, self.version, self.entries)
+            self.new = {}
+
+    def get_all(self, repo, oid):
+        """
+        Returns a dict
+            tag: [values]
+        for the patch in the blob with id oid.
+        """
+        self.load()
+        key = str(oid)
+        try:
+            return self.entries[key]
+        except KeyError:
+            pass
+        data = repo[oid].data
+        if lib_trace.enabled:
+            lib_trace.add_bytes(len(data))
+        tags = tags_get(data.decode("utf-8", "replace").splitlines(True),
+                        self.tags)
+        self.entries[key] = tags
+        self.new[key] = tags
+        return tags
+
+    def update(self, entries):
+        """
+        Merge the new entries of another BlobTagCache instance.
+        """
+        self.load()
+        self.entries.update(entries)
+        self.new.update(entries)
+
+
+_tag_cache = None
+
+
+def tag_cache():
+    """
+    Return the TagCache shared by the current process. It is saved when the
+    process exits.
+    """
+    global _tag_cache
+
+    if _tag_cache is None:
+        _tag_cache = TagCache()
+        atexit.register(_tag_cache.save)
+    return _tag_cache
+
+
+_blob_tag_cache = None
+
+
+def blob_tag_cache():
+    """
+    Return the BlobTagCache shared by the current process.
+    """
+    global _blob_tag_cache
+
+    if _blob_tag_cache is None:
+        _blob_tag_cache = BlobTagCache()
+    return _blob_tag_cache
+
+
+def _error(message):
+    # imported here because lib imports this module
+    import lib
+    return lib.KSError(message)
+
+
+def patch_tag_get(patch, tag):
+    """
+    Like tag_get() but takes the path of a patch file and goes through the
+    shared TagCache.
+    """
+    return tag_cache().get(patch, tag)
+
+
+
+# from quilt's patchfns, see patch_header.awk
+_body_start_re = re.compile(r"(---|\*\*\*|Index:)[ \t][^ \t]|diff -")
+_field_re = re.compile(r"[ \t]*([^ \t]*)[ \t]*(.*)$", re.S)
+# order of the tags at the top of a header
+_tag_order = {
+    "Patch-mainline:": 1,
+    "Git-repo:": 2,
+    "Git-commit:": 3,
+    "References:": 4,
+}
+
+
+def split_patch(text):
+    """
+    Returns (header lines, body lines,) split like patch_header.awk and
+    patch_body.awk do.
+    """
+    lines = text.split("\n")
+    if lines[-1] == "":
+        del lines[-1]
+    for i, line in enumerate(lines):
+        if _body_start_re.match(line):
+            return (lines[:i], lines[i:],)
+    return (lines, [],)
+
+
+def _fields(line):
+    """
+    Returns (first field, rest of the line,) like awk's $1 and what follows
+    it.
+    """
+    return _field_re.match(line).groups()
+
+
+def _key_match(line, key):
+    # like `tolower($1) ~ /key:/` in lib_tag.sh
+    return "%s:" % (key,) in _fields(line)[0].lower()
+
+
+def is_attribution(line):
+    field = _fields(line)[0].lower()
+    return field.endswith("-by:") and len(field) > len("-by:")
+
+
+class Header(object):
+    """
+    Lines of a patch header, parsed once and edited with the same results as
+    the functions of lib_tag.sh, quirks included.
+
+    Keys are case insensitive. The special keys "cherry picked from commit"
+    and "cherry picked for" refer to lines like "(cherry picked for bsc#1)".
+    """
+    def __init__(self, lines=()):
+        self.lines = list(lines)
+
+    @classmethod
+    def from_text(cls, text):
+        lines = text.split("\n")
+        if lines[-1] == "":
+            del lines[-1]
+        return cls(lines)
+
+    def text(self):
+        return "".join(["%s\n" % (line,) for line in self.lines])
+
+    @staticmethod
+    def _is_cherry(key):
+        return key in ("cherry picked from commit", "cherry picked for",)
+
+    def _cherry_match(self, line, key):
+        return re.match(r"\(%s (.*)\)$" % (re.escape(key),), line)
+
+    def _match(self, line, key):
+        if self._is_cherry(key):
+            return self._cherry_match(line, key)
+        return _key_match(line, key)
+
+    def count(self, key):
+        """
+        Number of lines with key, like countkeys().
+        """
+        key = key.lower()
+        if self._is_cherry(key):
+            return len([line for line in self.lines
+                        if self._cherry_match(line, key)])
+        start = "%s: " % (key,)
+        return len([line for line in self.lines
+                    if line.lower().startswith(start)])
+
+    def _check_unique(self, key, last):
+        nb = self.count(key)
+        if nb > 1 and not last:
+            raise _error("key \"%s\" present more than once." % (key,))
+        return nb
+
+    def get(self, key, last=False):
+        """
+        Returns the value of a tag, None if it is not present. Without last,
+        it is an error for the tag to be present more than once.
+        """
+        nb = self._check_unique(key, last)
+        key = key.lower()
+        subject = None
+        for line in self.lines:
+            if subject is not None:
+                if line.startswith((" ", "\t",)):
+                    subject += " " + line[1:]
+                    continue
+                return subject
+            if not self._match(line, key):
+                continue
+            nb -= 1
+            if nb > 0:
+                continue
+            if self._is_cherry(key):
+                return self._cherry_match(line, key).group(1)
+            value = _fields(line)[1]
+            if key == "subject":
+                subject = value
+            else:
+                return value
+        return subject
+
+    def remove(self, key, last=False):
+        """
+        Remove a tag, the last occurrence with last.
+        """
+        nb = self._check_unique(key, last)
+        key = key.lower()
+        result = []
+        in_subject = False
+        for line in self.lines:
+            if self._match(line, key):
+                nb -= 1
+                if nb == 0:
+                    in_subject = key == "subject"
+                    continue
+            if in_subject and line.startswith(" "):
+                continue
+            in_subject = False
+            result.append(line)
+        self.lines = result
+
+    def add(self, key, value, last=False):
+        """
+        Add a tag at the position that corresponds to its key. Without last,
+        it is an error for the tag to be present already.
+        """
+        lkey = key.lower()
+        tag = "%s: %s" % (key, value,)
+        nb = self.count(lkey)
+        if lkey in ("acked-by", "signed-off-by",):
+            self.append_attribution(tag)
+            return
+        elif self._is_cherry(lkey):
+            if nb > 0:
+                raise _error("key \"%s\" already present." % (key,))
+            self.append_attribution("(%s %s)" % (key, value,))
+            return
+        elif lkey not in ("from", "date", "subject",) and (
+                "%s:" % (key,) not in _tag_order):
+            raise _error("I don't know where to add a tag of type "
+                              "\"%s\"." % (key,))
+
+        if nb > 0 and (not last or lkey in ("date", "subject",)):
+            raise _error("key \"%s\" already present." % (key,))
+
+        result = []
+        if lkey == "from":
+            inserted = False
+            for i, line in enumerate(self.lines):
+                if i == 0 and re.match("From [0-9a-f]+", line):
+                    pass
+                elif nb == 0 and not inserted:
+                    result.append(tag)
+                    inserted = True
+                elif _key_match(line, lkey):
+                    nb -= 1
+                result.append(line)
+            if nb == 0 and not inserted:
+                result.append(tag)
+        elif lkey in ("date", "subject",):
+            prevkey = {"date": "from", "subject": "date"}[lkey]
+            nb = self.count(prevkey)
+            for line in self.lines:
+                result.append(line)
+                if _key_match(line, prevkey):
+                    nb -= 1
+                    if nb == 0:
+                        result.append(tag)
+        else:
+            rank = _tag_order["%s:" % (key,)]
+            added = False
+            for line in self.lines:
+                if not added and (
+                        _tag_order.get(_fields(line)[0], rank) > rank or
+                        not line):
+                    result.append(tag)
+                    added = True
+                result.append(line)
+        self.lines = result
+
+    def attributions(self):
+        return [line for line in self.lines if is_attribution(line)]
+
+    def attribution_names(self):
+        return [_fields(line)[1] for line in self.attributions()]
+
+    def append_attribution(self, attribution):
+        """
+        Add an attribution line after the last one of the log message, like
+        _append_attribution().
+        """
+        result = []
+        empty = 0
+        added = False
+        seen = False
+
+        def add(before_diffstat):
+            if not seen:
+                result.append("")
+            result.append(attribution)
+            if not before_diffstat:
+                result.append("")
+
+        for line in self.lines:
+            if not line:
+                empty += 1
+                continue
+            if is_attribution(line) or re.match(
+                    r"\((cherry picked from commit [0-9a-fA-F]{6,}|"
+                    r"cherry picked for .*)\)$", line):
+                seen = True
+            if not added and line == "---":
+                add(True)
+                added = True
+                empty = 0
+            if not added and _body_start_re.match(line):
+                add(False)
+                added = True
+                empty = 0
+            result.extend([""] * empty)
+            empty = 0
+            result.append(line)
+
+        if not added:
+            add(True)
+        else:
+            result.extend([""] * empty)
+        self.lines = result
+
+    def insert_attributions(self, attributions):
+        """
+        Add several attribution lines, like insert_attributions().
+        """
+        if self.attributions():
+            result = []
+            for line in self.lines:
+                if is_attribution(line):
+                    result.extend(attributions)
+                result.append(line)
+            self.lines = result
+        else:
+            for attribution in attributions:
+                # like `read`
+                self.append_attribution(
+                    re.sub(r"\\(.)", r"\1", attribution.strip(" \t")))
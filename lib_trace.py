@@ -0,0 +1,168 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Opt-in timing of the phases of the tools.
+
+When $KSAPPLY_TRACE is set to the path of a file, each process which uses
+this module appends one JSON line to that file when it exits. The line
+contains, for each phase that ran, the number of calls, the wall and cpu
+time and the size of the files read. Phases may be nested; the time of a
+phase includes the time of the phases that ran inside it. Setting the
+variable for a whole qdoit session collects the data of all the commands;
+use trace_report.py to aggregate it.
+
+When $KSAPPLY_PROFILE is set to a directory, the process is also profiled
+with cProfile and the statistics are written to
+<directory>/<command>.<pid>.prof when it exits.
+
+This module must stay cheap to import and, when tracing is disabled, the
+phases cost a single test.
+"""
+
+import atexit
+import functools
+import json
+import os
+import os.path
+import sys
+import time
+
+
+trace_path = os.environ.get("KSAPPLY_TRACE")
+profile_dir = os.environ.get("KSAPPLY_PROFILE")
+enabled = bool(trace_path)
+
+# name: [calls, wall, cpu, bytes]
+_phases = {}
+# names of the phases that are running, innermost last
+_stack = []
+_start = (time.time(), sum(os.times()[:2]),)
+
+
+def _cpu():
+    t = os.times()
+    return t[0] + t[1]
+
+
+class _Phase(object):
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        # only the outermost call of a recursive phase is timed
+        self.outer = self.name not in _stack
+        _stack.append(self.name)
+        self.start = (time.time(), _cpu(),)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _stack.pop()
+        stats = _phases.setdefault(self.name, [0, 0.0, 0.0, 0])
+        stats[0] += 1
+        if self.outer:
+            stats[1] += time.time() - self.start[0]
+            stats[2] += _cpu() - self.start[1]
+        return False
+
+
+class _NullPhase(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_null_phase = _NullPhase()
+
+
+def phase(name):
+    """
+    Returns a context manager which accounts the time spent in it to phase
+    name.
+    """
+    if enabled:
+        return _Phase(name)
+    return _null_phase
+
+
+def traced(name):
+    """
+    Decorator which accounts the time spent in a function to phase name.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            with _Phase(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def command_phase(args):
+    """
+    Returns a phase for running the command args, like "run git name-rev".
+    """
+    if not enabled:
+        return _null_phase
+    words = [os.path.basename(args[0])]
+    if len(args) > 1 and not args[1].startswith("-"):
+        words.append(args[1])
+    return _Phase("run %s" % (" ".join(words),))
+
+
+def add_bytes(size):
+    """
+    Account size bytes read to the phases that are running.
+    """
+    for name in set(_stack):
+        _phases.setdefault(name, [0, 0.0, 0.0, 0])[3] += size
+
+
+def record():
+    """
+    Returns the data of the current process as a dict.
+    """
+    return {
+        "command": os.path.basename(sys.argv[0]),
+        "argv": sys.argv[1:],
+        "pid": os.getpid(),
+        "cwd": os.getcwd(),
+        "start": _start[0],
+        "wall": time.time() - _start[0],
+        "cpu": _cpu() - _start[1],
+        "phases": dict([(name, {"calls": stats[0], "wall": stats[1],
+                                "cpu": stats[2], "bytes": stats[3]},)
+                        for name, stats in _phases.items()]),
+    }
+
+
+def _write_trace():
+    line = json.dumps(record(), sort_keys=True) + "\n"
+    # a single write in append mode so that the lines of concurrent processes
+    # do not mix
+    fd = os.open(trace_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line.encode("utf-8"))
+    finally:
+        os.close(fd)
+
+
+if enabled:
+    atexit.register(_write_trace)
+
+if profile_dir:
+    import cProfile
+
+    _profile = cProfile.Profile()
+    _profile.enable()
+
+    def _write_profile():
+        _profile.disable()
+        _profile.dump_stats(os.path.join(profile_dir, "%s.%d.prof" % (
+            os.path.basename(sys.argv[0]), os.getpid(),)))
+
+    atexit.register(_write_profile)
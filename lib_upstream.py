@@ -0,0 +1,449 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Upstream order of the commits reachable from the remote heads listed in
+git_sort.remotes.
+
+The order is kept in an index file under the cache directory (see
+lib_cache.py) which is memory-mapped by the tools that use it. When a remote
+head advances linearly, only the commits that are new since the last indexed
+tip are walked and added to the index. Otherwise the index is built again,
+so that it is always the same as after a full walk.
+"""
+
+import binascii
+import collections
+import mmap
+import struct
+import subprocess
+
+from git_helpers import git_sort
+
+import lib
+import lib_cache
+import lib_trace
+
+
+SortedEntry = collections.namedtuple("SortedEntry", ("head_name", "value",))
+
+
+def get_heads(repo):
+    """
+    Returns a list of
+        (head name, rev,)
+    in the order of git_sort.remotes, for the heads that are present in repo.
+    """
+    return [(str(name), str(rev),)
+            for name, rev in git_sort.get_heads(repo).items()]
+
+
+def walk_head(rev, exclude, since=None):
+    """
+    Generate the ids of the commits reachable from rev, in the order that
+    git_sort.git_sort() uses (reverse topological order), leaving out commits
+    reachable from the revs in exclude and from since.
+    """
+    args = ["git", "log", "--topo-order", "--reverse", "--pretty=tformat:%H",
+            rev]
+    args.extend(["^%s" % (r,) for r in exclude])
+    if since is not None:
+        args.append("^%s" % (since,))
+    p = subprocess.Popen(args, stdout=subprocess.PIPE,
+                         preexec_fn=lib.restore_signals)
+    for line in p.stdout:
+        yield line.strip()
+    if p.wait() != 0:
+        raise subprocess.CalledProcessError(p.returncode, " ".join(args))
+
+
+def has_merges(rev, exclude, since):
+    """
+    Returns True if some of the commits that walk_head() would give are
+    merges.
+    """
+    args = ["git", "rev-list", "--merges", "--max-count=1", rev,
+            "^%s" % (since,)]
+    args.extend(["^%s" % (r,) for r in exclude])
+    return bool(subprocess.check_output(args,
+                                        preexec_fn=lib.restore_signals).strip())
+
+
+def count_commits(rev, since):
+    """
+    Returns the number of commits reachable from rev but not from since.
+    """
+    return int(subprocess.check_output(
+        ("git", "rev-list", "--count", rev, "^%s" % (since,),),
+        preexec_fn=lib.restore_signals))
+
+
+def is_ancestor(repo, rev, descendant):
+    """
+    Returns True if rev is descendant or one of its ancestors, False
+    otherwise or if one of the commits cannot be found.
+    """
+    try:
+        base = repo.merge_base(rev, descendant)
+    except (KeyError, ValueError):
+        return False
+    return base is not None and str(base) == rev
+
+
+class UpstreamOrder(object):
+    """
+    Position of the commits of the remote heads in the order used by
+    git_sort.git_sort(): heads in the order of git_sort.remotes, then
+    commits in reverse topological order. A commit belongs to the first head
+    that includes it.
+
+    The index file contains:
+        header
+        for each head: head header, head name
+        fanout table: 65537 record counts, on the first two bytes of the ids
+        records: fixed size, sorted by commit id
+    Lookups are a binary search within the range given by the fanout table.
+
+    Commits that are added by an incremental update get positions after the
+    existing commits of their head. That is the order of a full walk only if
+    they form a chain on top of the indexed tip, so update() is limited to
+    that case.
+    """
+    magic = b"KSUO"
+    version = 1
+    header = struct.Struct("<4sIII")
+    # rev, number of commits (next position), length of name
+    head_header = struct.Struct("<40sII")
+    fanout_entry = struct.Struct("<I")
+    fanout_size = 65537
+    # commit id, head index, position
+    record = struct.Struct("<20sII")
+
+    def __init__(self, repo):
+        self.repo = repo
+        self.path = lib_cache.cache_path("upstream", repo.path)
+        # [(head name, rev,)]
+        self.heads = []
+        # number of commits assigned to each head so far
+        self.counts = []
+        # bytes or mmap with the content of the index file
+        self.data = None
+        self.fanout_offset = 0
+        self.table_offset = 0
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def load(self):
+        """
+        Map the index file. The index is left empty if the file is missing or
+        invalid.
+        """
+        if not lib_cache.enabled():
+            return
+        try:
+            with open(self.path, "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, OSError, ValueError):
+            return
+
+        try:
+            magic, version, head_nb, length = self.header.unpack_from(data, 0)
+            if magic != self.magic or version != self.version:
+                return
+            offset = self.header.size
+            heads = []
+            counts = []
+            for i in range(head_nb):
+                rev, count, name_len = self.head_header.unpack_from(data,
+                                                                    offset)
+                offset += self.head_header.size
+                name = data[offset:offset + name_len]
+                offset += name_len
+                heads.append((str(name.decode("utf-8")),
+                              str(rev.decode("ascii")),))
+                counts.append(count)
+        except (struct.error, UnicodeError):
+            return
+        table_offset = (offset + self.fanout_entry.size * self.fanout_size)
+        if len(data) != table_offset + length * self.record.size:
+            return
+
+        self.heads = heads
+        self.counts = counts
+        self.data = data
+        self.fanout_offset = offset
+        self.table_offset = table_offset
+        self.length = length
+
+    def save(self):
+        if lib_cache.enabled():
+            lib_cache.replace(self.path, lambda f: f.write(self.data))
+
+    def set_table(self, heads, counts, table):
+        """
+        table is a buffer of records sorted by commit id
+        """
+        size = self.record.size
+        prefixes = collections.Counter(table[i:i + 2]
+                                       for i in range(0, len(table), size))
+        fanout = [0] * self.fanout_size
+        for prefix, nb in prefixes.items():
+            first = bytearray(prefix)
+            fanout[(first[0] << 8 | first[1]) + 1] = nb
+        for i in range(1, self.fanout_size):
+            fanout[i] += fanout[i - 1]
+
+        chunks = [self.header.pack(self.magic, self.version, len(heads),
+                                   len(table) // size)]
+        for (name, rev,), count in zip(heads, counts):
+            name = name.encode("utf-8")
+            chunks.append(self.head_header.pack(rev.encode("ascii"), count,
+                                                len(name)))
+            chunks.append(name)
+        fanout_offset = sum([len(chunk) for chunk in chunks])
+        chunks.append(struct.pack("<%dI" % (self.fanout_size,), *fanout))
+        chunks.append(table)
+
+        self.heads = list(heads)
+        self.counts = list(counts)
+        self.data = b"".join(chunks)
+        self.fanout_offset = fanout_offset
+        self.table_offset = fanout_offset + (self.fanout_entry.size *
+                                             self.fanout_size)
+        self.length = len(table) // size
+
+    @lib_trace.traced("upstream_walk")
+    def build(self, heads):
+        """
+        Index all the commits of heads by walking their history.
+        """
+        records = []
+        counts = []
+        exclude = []
+        for head_index, (name, rev,) in enumerate(heads):
+            pos = 0
+            for commit in walk_head(rev, exclude):
+                records.append(self.record.pack(binascii.unhexlify(commit),
+                                                head_index, pos))
+                pos += 1
+            counts.append(pos)
+            exclude.append(rev)
+        records.sort()
+        self.set_table(heads, counts, b"".join(records))
+
+    @lib_trace.traced("upstream_walk")
+    def update(self, heads):
+        """
+        Add the commits that are new since the indexed tips of heads.
+
+        Returns False if that is not possible because the index is empty, the
+        list of heads changed or a head was rewound, or if the result could
+        differ from build(): when the new commits of a head include a merge
+        or commits which are already indexed in another head.
+        """
+        if self.data is None or ([name for name, rev in heads] !=
+                                 [name for name, rev in self.heads]):
+            return False
+
+        # commit id: (head index, position,)
+        new = {}
+        counts = list(self.counts)
+        for head_index, ((name, rev,), (old_name, old_rev,)) in enumerate(
+                zip(heads, self.heads)):
+            if rev == old_rev:
+                continue
+            if not is_ancestor(self.repo, old_rev, rev):
+                return False
+            exclude = [r for n, r in heads[:head_index]]
+            if has_merges(rev, exclude, old_rev):
+                return False
+            for commit in list(walk_head(rev, exclude, old_rev)):
+                oid = binascii.unhexlify(commit)
+                if self.find(oid) is not None or oid in new:
+                    return False
+                new[oid] = (head_index, counts[head_index],)
+                counts[head_index] += 1
+
+        size = self.record.size
+        table = self.data[self.table_offset:]
+        chunks = []
+        start = 0
+        for oid in sorted(new):
+            i = self.bisect(oid)
+            chunks.append(table[start * size:i * size])
+            chunks.append(self.record.pack(oid, *new[oid]))
+            start = i
+        chunks.append(table[start * size:])
+        self.set_table(heads, counts, b"".join(chunks))
+        return True
+
+    @lib_trace.traced("upstream_index")
+    def refresh(self):
+        """
+        Bring the index up to date with the remote heads: load it from the
+        index file, update it if a head advanced or rebuild it if needed and
+        save it.
+
+        Returns True if the index changed.
+        """
+        heads = get_heads(self.repo)
+        if self.data is None:
+            self.load()
+        if heads == self.heads and self.data is not None:
+            return False
+        if not self.update(heads):
+            self.build(heads)
+        self.save()
+        return True
+
+    def status(self):
+        """
+        Compare the index with the current remote heads.
+
+        Returns a list of
+            (head name, indexed rev, current rev, commits behind,)
+        The revs are None for heads which are not indexed or which are no
+        longer present. commits behind is None if the head was rewound or is
+        not indexed.
+        """
+        if self.data is None:
+            self.load()
+        indexed = dict(self.heads)
+        current = get_heads(self.repo)
+        result = []
+        for name, rev in current:
+            old_rev = indexed.get(name)
+            if old_rev is None:
+                behind = None
+            elif old_rev == rev:
+                behind = 0
+            elif is_ancestor(self.repo, old_rev, rev):
+                behind = count_commits(rev, old_rev)
+            else:
+                behind = None
+            result.append((name, old_rev, rev, behind,))
+        current_names = set([name for name, rev in current])
+        result.extend([(name, rev, None, None,) for name, rev in self.heads
+                       if name not in current_names])
+        return result
+
+    def oid(self, i):
+        offset = self.table_offset + i * self.record.size
+        return self.data[offset:offset + 20]
+
+    def bisect(self, oid, start=0):
+        """
+        Returns the index of the first record whose commit id is not lower
+        than the binary commit id oid. The search begins at record start.
+        """
+        first = bytearray(oid[:2])
+        b = first[0] << 8 | first[1]
+        lo, = self.fanout_entry.unpack_from(
+            self.data, self.fanout_offset + b * self.fanout_entry.size)
+        lo = max(lo, start)
+        hi, = self.fanout_entry.unpack_from(
+            self.data, self.fanout_offset + (b + 1) * self.fanout_entry.size)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.oid(mid) < oid:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def find(self, oid):
+        """
+        Returns the index of the record for the binary commit id oid, None if
+        it is not present.
+        """
+        if self.data is None:
+            return None
+        i = self.bisect(oid)
+        if i < self.length and self.oid(i) == oid:
+            return i
+        return None
+
+    @lib_trace.traced("upstream_resolve")
+    def resolve_prefixes(self, prefixes):
+        """
+        prefixes is an iterable of lowercase hex commit id prefixes, at least
+        4 characters long.
+
+        Returns a dict
+            prefix: [full hex id]
+        for the prefixes that match some commits of the index. At most two
+        ids are listed; more than one means that the prefix is ambiguous.
+
+        The prefixes are looked up in sorted order and each search begins
+        where the previous one ended, so the table is traversed once.
+        """
+        result = {}
+        if self.data is None:
+            return result
+        start = 0
+        for prefix in sorted(set(prefixes)):
+            low = binascii.unhexlify((prefix + "0" * 40)[:40])
+            start = self.bisect(low, start)
+            matches = []
+            i = start
+            while i < self.length and len(matches) < 2:
+                commit = binascii.hexlify(self.oid(i)).decode("ascii")
+                if not commit.startswith(prefix):
+                    break
+                matches.append(commit)
+                i += 1
+            if matches:
+                result[prefix] = matches
+        return result
+
+    def key(self, commit):
+        """
+        Returns (head index, position,) for the commit with the full hex id
+        commit, None if it is not reachable from any of the heads.
+        """
+        return self.key_oid(binascii.unhexlify(commit))
+
+    def key_oid(self, oid):
+        """
+        Like key() for the binary commit id oid.
+        """
+        i = self.find(oid)
+        if i is None:
+            return None
+        return self.record.unpack_from(
+            self.data, self.table_offset + i * self.record.size)[1:]
+
+    def head_name(self, head_index):
+        return self.heads[head_index][0]
+
+    @lib_trace.traced("upstream_sort")
+    def sort(self, mapping):
+        """
+        Like git_sort.git_sort() but using the index instead of walking the
+        history.
+
+        mapping is a dict
+            commit: value
+        The commits that are found are removed from mapping.
+
+        Returns a list of SortedEntry in upstream order.
+        """
+        found = []
+        for commit in list(mapping):
+            key = self.key(commit)
+            if key is not None:
+                found.append((key, commit,))
+        found.sort()
+        return [SortedEntry(self.head_name(key[0]), mapping.pop(commit))
+                for key, commit in found]
+
+
+def upstream_order(repo):
+    """
+    Returns an up to date UpstreamOrder for repo.
+    """
+    order = UpstreamOrder(repo)
+    order.refresh()
+    return order
@@ -16,10 +16,17 @@ Add a section like this to git config:
 Then call
 git mergetool --tool=git-sort series.conf
 
+The sorted section of local is assumed to be sorted: only the patches added
+in remote are read and inserted in it. Use "-f" to sort the entire section
+instead. The patches are read by a single process unless a number of
+processes is specified with "-j <n>". Options go before the file arguments in
+the command above.
+
 """
 
 from __future__ import print_function
 
+import argparse
 from orderedset import OrderedSet
 import os.path
 import pygit2
@@ -41,11 +48,27 @@ def splice(series, inside, output_path):
 
 
 if __name__ == "__main__":
-    local_path, base_path, remote_path, merged_path = sys.argv[1:5]
+    parser = argparse.ArgumentParser(
+        description="Merge series.conf files, keeping the sorted section "
+        "sorted.")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of processes used to read the patches. "
+                        "Default: 1")
+    parser.add_argument("-f", "--full", action="store_true",
+                        help="Sort all the entries of the sorted section "
+                        "instead of inserting the new entries of remote in "
+                        "the order of local.")
+    parser.add_argument("local")
+    parser.add_argument("base")
+    parser.add_argument("remote")
+    parser.add_argument("merged")
+    args = parser.parse_args()
+    local_path, base_path, remote_path, merged_path = (
+        args.local, args.base, args.remote, args.merged,)
 
     repo_path = lib.repo_path()
     if "GIT_DIR" not in os.environ:
-        # this is for the `git log` call in git_sort.py
+        # this is for the `git log` calls in lib_upstream.py
         os.environ["GIT_DIR"] = repo_path
     repo = pygit2.Repository(repo_path)
 
@@ -75,13 +98,23 @@ if __name__ == "__main__":
         print("Warning: %d commits removed in remote but not present in local, "
               "ignoring." % (dup_rem_nb,))
 
-    input_entries = []
-    for patch in local[3] - removed | added:
-        entry = lib.InputEntry("\t%s\n" % (patch,))
-        entry.from_patch(repo, patch)
-        input_entries.append(entry)
     try:
-        sorted_entries = lib.series_sort(repo, input_entries)
+        sorted_entries = None
+        if not args.full:
+            # local is already sorted, only place the new patches
+            input_entries = lib.load_entries(
+                repo, [(patch, "\t%s\n" % (patch,),)
+                       for patch in added - local[3]], args.jobs)
+            sorted_entries = lib.merge_sorted(repo, local[1], removed,
+                                              input_entries)
+            if sorted_entries is None:
+                print("Warning: unexpected lines in the sorted section of "
+                      "local, sorting all of it.")
+        if sorted_entries is None:
+            input_entries = lib.load_entries(
+                repo, [(patch, "\t%s\n" % (patch,),)
+                       for patch in local[3] - removed | added], args.jobs)
+            sorted_entries = lib.series_sort(repo, input_entries)
     except lib.KSException as err:
         print("Error: %s" % (err,), file=sys.stderr)
         sys.exit(1)
@@ -13,37 +13,130 @@ import subprocess
 import sys
 import tempfile
 
+import clean_header
 import lib
+import lib_index
+import lib_patch
+import lib_prefetch
 import lib_tag
+import lib_trace
 
 
-def format_import(references, tmpdir, dstdir, rev, poi=[]):
-    assert len(poi) == 0 # todo
-    args = ("git", "format-patch", "--output-directory", tmpdir, "--notes",
-            "--max-count=1", "--subject-prefix=", "--no-numbered", rev,)
-    src = subprocess.check_output(args).strip()
-    # remove number prefix
-    name = os.path.basename(src)[5:]
-    dst = os.path.join(dstdir, name)
-    if os.path.exists(os.path.join("patches", dst)):
-        name = "%s-%s.patch" % (name[:-6], rev[:8],)
+libdir = os.path.dirname(os.path.abspath(__file__))
+
+
+def header_cleaner():
+    """
+    Returns the name of the program that cleans the patch headers. Like
+    clean_header.sh, clean_header.py is only used when CLEAN_HEADER_PY is
+    set.
+    """
+    if os.environ.get("CLEAN_HEADER_PY"):
+        return "clean_header.py"
+    return "clean_header.sh"
+
+
+def generate_script(repo, commit, references):
+    """
+    Returns the text of the patch of commit generated by `git format-patch`
+    and cleaned by clean_header.sh.
+    """
+    tmpdir = tempfile.mkdtemp(prefix="qcp.")
+    env = dict(os.environ)
+    env["GIT_DIR"] = repo.path
+    try:
+        args = ("git", "format-patch", "--output-directory", tmpdir,
+                "--notes", "--max-count=1", "--subject-prefix=",
+                "--no-numbered", str(commit.id),)
+        with lib_trace.command_phase(args):
+            src = subprocess.check_output(
+                args, env=env, preexec_fn=lib.restore_signals).strip()
+        args = (os.path.join(libdir, "clean_header.sh"),
+                "--commit=%s" % (commit.id,),
+                "--reference=%s" % (references,), src,)
+        with lib_trace.command_phase(args):
+            subprocess.check_call(args, preexec_fn=lib.restore_signals)
+        with open(src, "rb") as f:
+            return clean_header.decode(f.read())[0]
+    except subprocess.CalledProcessError as err:
+        raise lib.KSError("`%s` failed for commit %s." % (
+            os.path.basename(err.cmd[0]), str(commit.id)[:12],))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def generate(repo, targets):
+    """
+    Returns the text of the cleaned patch of each target.
+
+    targets is a list of
+        (pygit2 Commit, references, destination directory,)
+    """
+    if header_cleaner() == "clean_header.sh":
+        return [generate_script(repo, commit, references)
+                for commit, references, dstdir in targets]
+
+    cleaners = []
+    for commit, references, dstdir in targets:
+        diff = lib_patch.commit_diff(repo, commit)
+        cleaners.append(clean_header.PatchCleaner(
+            repo, lib_patch.format_patch(repo, commit, diff), str(commit.id),
+            references, diff=diff))
+    descriptions = lib_patch.describe_commits(
+        [cleaner.commit for cleaner in cleaners])
+    return [cleaner.finish(descriptions) for cleaner in cleaners]
+
+
+def format_import(repo, targets, tmpdir):
+    """
+    Generate the patches of several commits and import them into quilt after
+    the top patch, in order. Patches staged by qprefetch.py are used instead
+    of generating them again.
+
+    targets is a list of
+        (pygit2 Commit, references, destination directory,)
+    """
+    staging = lib_prefetch.StagingArea()
+    texts = [staging.get(str(commit.id), repo.path, references, dstdir,
+                         header_cleaner())
+             for commit, references, dstdir in targets]
+    missing = [i for i, text in enumerate(texts) if text is None]
+    for i, text in zip(missing, generate(repo, [targets[i] for i in missing])):
+        texts[i] = text
+
+    patches = []
+    used = set()
+    for (commit, references, dstdir,), text in zip(targets, texts):
+        rev = str(commit.id)
+        subject = lib_patch.split_message(commit.message)[0]
+        name = "%s.patch" % (lib_patch.sanitized_subject(subject),)
         dst = os.path.join(dstdir, name)
+        if os.path.exists(os.path.join("patches", dst)) or dst in used:
+            name = "%s-%s.patch" % (name[:-6], rev[:8],)
+            dst = os.path.join(dstdir, name)
+        used.add(dst)
 
-    libdir = os.path.dirname(sys.argv[0])
-    subprocess.check_call((os.path.join(libdir, "clean_header.sh"),
-                           "--commit=%s" % rev, "--reference=%s" % references,
-                           src,), preexec_fn=lib.restore_signals)
-    subprocess.check_call(("quilt", "import", "-P", dst, src,),
-                          preexec_fn=lib.restore_signals)
-    # This will remind the user to run refresh_patch.sh
-    lib.touch(".pc/%s~refresh" % (dst,))
+        src = os.path.join(tmpdir, "%04d-%s" % (len(patches) + 1, name,))
+        with open(src, "wb") as f:
+            f.write(text.encode("utf-8"))
+        patches.append((rev, src, dst,))
+
+    # quilt imports after the top patch, go backwards to keep the order
+    for rev, src, dst in reversed(patches):
+        args = ("quilt", "import", "-P", dst, src,)
+        with lib_trace.command_phase(args):
+            subprocess.check_call(args, preexec_fn=lib.restore_signals)
+        staging.remove(rev)
+        # This will remind the user to run refresh_patch.sh
+        lib.touch(".pc/%s~refresh" % (dst,))
 
     return 0
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
-        description="Generate a patch from a git commit and import it into quilt.")
+        description="Generate patches from git commits and import them into "
+        "quilt.")
     parser.add_argument("-r", "--references",
                         help="bsc# or FATE# number used to tag the patch file.")
     parser.add_argument("-d", "--destination",
@@ -53,9 +146,10 @@ if __name__ == "__main__":
                         "containing the commit specified in the first "
                         "\"Fixes\" tag in the commit log of the commit to "
                         "import.")
-    parser.add_argument("rev", help="Upstream commit id to import.")
-    parser.add_argument("poi", help="Limit patch to specified paths.",
-                        nargs=argparse.REMAINDER)
+    parser.add_argument("rev", nargs="+",
+                        help="Upstream commit id to import. When several are "
+                        "given, they are imported in this order after the "
+                        "top patch.")
     args = parser.parse_args()
 
     if not (args.references and args.destination or args.followup):
@@ -75,40 +169,47 @@ if __name__ == "__main__":
         os.environ["GIT_DIR"] = repo_path
     repo = pygit2.Repository(repo_path)
     try:
-        commit = repo.revparse_single(args.rev)
-    except ValueError:
-        print("Error: \"%s\" is not a valid revision." % (args.rev,),
-              file=sys.stderr)
-        sys.exit(1)
-    except KeyError:
-        print("Error: revision \"%s\" not found in \"%s\"." %
-              (args.rev, repo_path), file=sys.stderr)
+        commits = [repo[commit].peel(pygit2.Commit)
+                   for commit in lib.resolve_commits(repo, args.rev)]
+    except lib.KSException as err:
+        print("Error: %s" % (err,), file=sys.stderr)
         sys.exit(1)
 
+    targets = []
     if args.followup:
-        try:
-            fixes = lib.firstword(lib_tag.tag_get(
-                StringIO.StringIO(commit.message), "Fixes")[0])
-        except IndexError:
-            print("Error: no \"Fixes\" tag found in commit \"%s\"." %
-                  (str(commit.id)[:12]), file=sys.stderr)
-            sys.exit(1)
-        fixes = str(repo.revparse_single(fixes).id)
-        f = lib.find_commit_in_series(fixes, open("series"))
-        # remove "patches/" prefix
-        patch = f.name[8:]
-        destination = os.path.dirname(patch)
-        references = " ".join(lib_tag.tag_get(f, "References"))
-        print("Info: using references \"%s\" from patch \"%s\" which contains "
-              "commit %s." % (references, patch, fixes[:12]), file=sys.stderr)
+        index = lib_index.CommitIndex.open("series")
+        for commit in commits:
+            try:
+                fixes = lib.firstword(lib_tag.tag_get(
+                    StringIO.StringIO(commit.message), "Fixes")[0])
+            except IndexError:
+                print("Error: no \"Fixes\" tag found in commit \"%s\"." %
+                      (str(commit.id)[:12]), file=sys.stderr)
+                sys.exit(1)
+            fixes = str(repo.revparse_single(fixes).id)
+            try:
+                patch = index.find(fixes)[0]
+            except IndexError:
+                print("Error: commit \"%s\" referenced in the \"Fixes\" tag "
+                      "was not found in the series." % (fixes[:12],),
+                      file=sys.stderr)
+                sys.exit(1)
+            destination = os.path.dirname(patch)
+            references = " ".join(index.references(patch))
+            print("Info: using references \"%s\" from patch \"%s\" which "
+                  "contains commit %s." % (references, patch, fixes[:12]),
+                  file=sys.stderr)
+            targets.append((commit, references, destination,))
     else:
-        destination = args.destination
-        references = args.references
+        targets = [(commit, args.references, args.destination,)
+                   for commit in commits]
 
     tmpdir = tempfile.mkdtemp(prefix="qcp.")
     try:
-        result = format_import(references, tmpdir, destination, str(commit.id),
-                               args.poi)
+        result = format_import(repo, targets, tmpdir)
+    except lib.KSException as err:
+        print("Error: %s" % (err,), file=sys.stderr)
+        result = 1
     finally:
         shutil.rmtree(tmpdir)
     sys.exit(result)
@@ -4,22 +4,41 @@
 from __future__ import print_function
 
 import argparse
+import multiprocessing
 import os
-import os.path
-import pygit2
-import subprocess
 import sys
 
-import lib
-import lib_tag
+import lib_server
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Check if a commit id is already backported by a patch in "
         "series.conf.")
-    parser.add_argument("rev", help="Upstream commit id.")
+    parser.add_argument("-a", "--all", action="store_true",
+                        help="Instead, check the whole series for commits "
+                        "that are present in more than one patch and for "
+                        "patches whose upstream commits have the same "
+                        "changes (patch-id).")
+    parser.add_argument("-j", "--jobs", type=int,
+                        default=multiprocessing.cpu_count(),
+                        help="Number of processes used to compute the "
+                        "patch-ids with --all. Default: number of cpus")
+    parser.add_argument("rev", nargs="*", help="Upstream commit id.")
     args = parser.parse_args()
+    if args.all == bool(args.rev):
+        parser.error("specify either commits or --all")
+
+    if not args.all:
+        lib_server.run("qdupcheck", revs=args.rev)
+
+    # imported only when there is no server to avoid loading pygit2
+    import pygit2
+    import subprocess
+
+    import lib
+    import lib_index
+    import lib_stable
 
     if not lib.check_series():
         sys.exit(1)
@@ -34,19 +53,31 @@ if __name__ == "__main__":
         sys.exit(1)
     repo_path = pygit2.discover_repository(search_path)
     repo = pygit2.Repository(repo_path)
-    commit = str(repo.revparse_single(args.rev).id)
-
-    f = lib.find_commit_in_series(commit, open("series"))
-    if f is not None:
-        # remove "patches/" prefix
-        print("Commit %s already present in patch\n\t%s" % (
-            commit[:12], f.name[8:],))
-        references = " ".join(lib_tag.tag_get(f, "References"))
-        if references:
-            print("for\n\t%s" % (references,))
-
-        top = subprocess.check_output(
-            ("quilt", "top",), preexec_fn=lib.restore_signals).strip()
-        if top == f.name:
-            print("This is the top patch.")
+
+    if args.all:
+        index = lib_index.CommitIndex.open("series")
+        patch_commits = lib_index.resolve_tags(repo, index)
+        patch_ids = lib_index.PatchIds.open(
+            repo, [commit for commits in patch_commits.values()
+                   for commit in commits], args.jobs)
+        output = lib_index.describe_series_duplicates(index, patch_commits,
+                                                      patch_ids)
+        if output:
+            sys.stdout.write(output)
+            sys.exit(1)
+        sys.exit(0)
+
+    try:
+        commits = lib.resolve_commits(repo, args.rev)
+    except lib.KSException as err:
+        print("Error: %s" % (err,), file=sys.stderr)
+        sys.exit(1)
+
+    index = lib_index.CommitIndex.open("series")
+    output = lib_index.describe_duplicates(
+        index, commits, lambda: subprocess.check_output(
+            ("quilt", "top",), preexec_fn=lib.restore_signals).strip(),
+        lambda: lib_stable.StableIndex.open(repo))
+    if output:
+        sys.stdout.write(output)
         sys.exit(1)
@@ -0,0 +1,396 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Compute the make targets that qfmake builds for the top quilt patch.
+"""
+
+from __future__ import print_function
+
+import argparse
+import errno
+import hashlib
+import os
+import os.path
+import subprocess
+import sys
+
+import lib
+import lib_cache
+
+
+try:
+    _intern = sys.intern
+except AttributeError:
+    # python 2
+    _intern = intern
+
+
+class PathTrie(object):
+    """
+    Trie of paths split on "/". A node which holds a value covers all the
+    paths under it.
+    """
+    def __init__(self):
+        # component: PathTrie
+        self.children = {}
+        self.value = None
+
+    @staticmethod
+    def _components(path):
+        return [c for c in path.split("/") if c and c != "."]
+
+    def covers(self, path):
+        """
+        Returns True if path or one of its parents holds a value.
+        """
+        node = self
+        for component in self._components(path):
+            if node.value is not None:
+                return True
+            try:
+                node = node.children[component]
+            except KeyError:
+                return False
+        return node.value is not None
+
+    def add(self, path, value):
+        """
+        Set value for path and drop the values under it. Returns False if path
+        is already covered.
+        """
+        node = self
+        for component in self._components(path):
+            if node.value is not None:
+                return False
+            node = node.children.setdefault(component, PathTrie())
+        if node.value is not None:
+            return False
+        node.value = value
+        node.children = {}
+        return True
+
+    def values(self):
+        result = []
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if node.value is not None:
+                result.append(node.value)
+            stack.extend(node.children.values())
+        return result
+
+
+def cmd_path(target):
+    """
+    Returns the path of the .cmd file that kbuild writes for an object.
+    """
+    dirname, basename = os.path.split(target)
+    return os.path.join(dirname, ".%s.cmd" % (basename,))
+
+
+def parse_cmd(content):
+    """
+    Returns
+        (command, source, [dependencies], [optional dependencies],)
+    from the content of a .cmd file. Optional dependencies are the files
+    listed in $(wildcard ...), they may not exist. The command is on the
+    "cmd_" line, "savedcmd_" since Linux 6.2.
+    """
+    command = None
+    source = None
+    deps = []
+    wildcards = []
+    inside = False
+    for line in content.splitlines():
+        if inside:
+            line = line.strip()
+            if not line:
+                inside = False
+                continue
+            if line.endswith("\\"):
+                line = line[:-1].strip()
+            if line.startswith("$(wildcard ") and line.endswith(")"):
+                wildcards.append(line[11:-1].strip())
+            elif line:
+                deps.append(line)
+        elif line.startswith(("cmd_", "savedcmd_",)):
+            command = line.split(":=", 1)[-1].strip()
+        elif line.startswith("source_"):
+            source = line.split(":=", 1)[-1].strip()
+        elif line.startswith("deps_"):
+            inside = True
+    return (command, source, deps, wildcards,)
+
+
+def cmd_dependencies(content, top):
+    """
+    Returns the dependencies listed in the content of a .cmd file, as
+    normalized paths relative to top.
+    """
+    result = []
+    for dep in parse_cmd(content)[2]:
+        if os.path.isabs(dep):
+            dep = os.path.relpath(dep, top)
+        result.append(_intern(os.path.normpath(dep)))
+    return tuple(result)
+
+
+def header_users(headers, top=".", cache=None):
+    """
+    Returns the objects which depend on one of headers (paths relative to
+    top), according to the .*.o.cmd files left in the tree by a previous
+    build. The tree is read once, whatever the number of headers.
+
+    cache is a BuildCache for top. The .cmd files which did not change since
+    it was last updated are not read again.
+    """
+    headers = set([os.path.normpath(header) for header in headers])
+    names = set([os.path.basename(header) for header in headers])
+    top = os.path.abspath(top)
+    known = cache.deps if cache is not None else {}
+    # .cmd file: entry of BuildCache.deps
+    deps = {}
+    result = []
+    for dirpath, dirnames, filenames in os.walk(top):
+        if dirpath == top:
+            dirnames[:] = [d for d in dirnames
+                           if d not in (".git", ".pc", "patches",)]
+        for filename in filenames:
+            if not (filename.startswith(".") and filename.endswith(".o.cmd")) \
+                    or filename.endswith(".mod.o.cmd"):
+                continue
+            path = os.path.join(dirpath, filename)
+            key = os.path.relpath(path, top)
+            st = os.stat(path)
+            stamp = (st.st_ino, st.st_mtime, st.st_size,)
+            entry = known.get(key)
+            if entry is not None and entry[:3] == stamp:
+                paths = entry[3]
+            else:
+                with open(path) as f:
+                    content = f.read()
+                # quick check before parsing the dependencies
+                if cache is None and not [name for name in names
+                                          if name in content]:
+                    continue
+                paths = cmd_dependencies(content, top)
+            deps[key] = stamp + (paths,)
+            if not headers.isdisjoint(paths):
+                result.append(os.path.relpath(
+                    os.path.join(dirpath, filename[1:-4]), top))
+    if cache is not None and deps != known:
+        cache.deps = deps
+        cache.dirty = True
+    result.sort()
+    return result
+
+
+class BuildCache(object):
+    """
+    Hashes of the inputs of the objects which were built successfully in a
+    tree.
+
+    The hash of an object covers the make variables given on the command
+    line, .config, the command and the content of the source and of all the
+    dependencies listed in the .cmd file of the object. An object whose hash
+    is in the cache was already compiled without error from identical
+    inputs, even if quilt pop/push changed the timestamps of its files since
+    then.
+
+    The dependencies of the .cmd files are also kept, so that header_users()
+    only reads the files which changed. Like in lib_tag.TagCache, an entry is
+    valid as long as the inode, mtime and size of its file are the same.
+
+    The cache is saved under the cache directory (see lib_cache.py), one file
+    per tree. It is read and written atomically so that successive qdoit
+    runs in the same tree share it.
+    """
+    version = 2
+    # number of states remembered for each object
+    depth = 8
+
+    def __init__(self, top=".", variables=()):
+        self.top = os.path.realpath(top)
+        self.path = lib_cache.cache_path("builds", self.top)
+        self.variables = sorted(variables)
+        # object: [hash]
+        self.objects = {}
+        # .cmd file: (st_ino, st_mtime, st_size, (dependencies,),)
+        self.deps = {}
+        self.dirty = False
+        # path: hash of the content, None if the file does not exist
+        self.files = {}
+
+    def load(self):
+        data = lib_cache.load(self.path, self.version)
+        if data is not None:
+            self.objects, self.deps = data
+
+    def save(self):
+        lib_cache.save(self.path, self.version, (self.objects, self.deps,))
+        self.dirty = False
+
+    def _file_hash(self, path):
+        if not os.path.isabs(path):
+            path = os.path.join(self.top, path)
+        try:
+            return self.files[path]
+        except KeyError:
+            pass
+        try:
+            with open(path, "rb") as f:
+                value = hashlib.sha1(f.read()).hexdigest()
+        except IOError as err:
+            if err.errno not in (errno.ENOENT, errno.EISDIR,):
+                raise
+            value = None
+        self.files[path] = value
+        return value
+
+    def object_hash(self, target):
+        """
+        Returns the hash of the inputs of target, None if it cannot be
+        computed (not an object or never built).
+        """
+        if not target.endswith(".o") or self._file_hash(target) is None:
+            return None
+        try:
+            with open(os.path.join(self.top, cmd_path(target))) as f:
+                command, source, deps, wildcards = parse_cmd(f.read())
+        except IOError as err:
+            if err.errno != errno.ENOENT:
+                raise
+            return None
+        if command is None or source is None:
+            return None
+
+        digest = hashlib.sha1()
+        for value in self.variables + [self._file_hash(".config"), command]:
+            digest.update(("%s\n" % (value,)).encode("utf-8"))
+        for path in [source] + deps + wildcards:
+            file_hash = self._file_hash(path)
+            if file_hash is None and path not in wildcards:
+                return None
+            digest.update(("%s %s\n" % (path, file_hash,)).encode("utf-8"))
+        return digest.hexdigest()
+
+    def hit(self, target):
+        value = self.object_hash(target)
+        return value is not None and value in self.objects.get(target, ())
+
+    def record(self, targets):
+        """
+        Remember the current state of targets after a successful build.
+        """
+        for target in targets:
+            value = self.object_hash(target)
+            if value is None:
+                continue
+            hashes = [h for h in self.objects.get(target, ()) if h != value]
+            self.objects[target] = (hashes + [value])[-self.depth:]
+
+
+def split_extra(extra):
+    """
+    Returns (options, targets,) from the arguments given to qfmake.
+    Arguments which look like make options or variable assignments are
+    options.
+    """
+    options = []
+    targets = []
+    for arg in extra:
+        if arg.startswith("-") or "=" in arg:
+            options.append(arg)
+        else:
+            targets.append(arg)
+    return (options, targets,)
+
+
+def plan(extra, files, excludes, top=".", cache=None, skip_built=True):
+    """
+    Returns the list of targets to build for extra (targets and options
+    given to qfmake) and files (changed by the top patch).
+
+    Targets which are under another target or under an excluded path are
+    removed, as well as, with skip_built, those which are found in cache (a
+    BuildCache). The options are kept as is, in front. The list is empty if
+    there is nothing to build.
+    """
+    excluded = PathTrie()
+    for exclude in excludes:
+        excluded.add(exclude, exclude)
+
+    options, candidates = split_extra(extra)
+    headers = []
+    for name in files:
+        if name.endswith(".c"):
+            candidates.append(name[:-2] + ".o")
+        elif name.endswith(".h"):
+            headers.append(name)
+    if headers:
+        candidates.extend(header_users(headers, top, cache))
+
+    targets = PathTrie()
+    order = {}
+    for target in candidates:
+        if excluded.covers(target):
+            continue
+        if targets.add(target, target):
+            order.setdefault(target, len(order))
+    targets = sorted(targets.values(), key=lambda t: order[t])
+
+    if cache is not None and skip_built:
+        missed = [target for target in targets if not cache.hit(target)]
+        if targets:
+            print("qfmake: %d of %d targets already built from identical "
+                  "sources, %d to build." % (len(targets) - len(missed),
+                                             len(targets), len(missed),),
+                  file=sys.stderr)
+        targets = missed
+
+    if targets:
+        return options + targets
+    else:
+        return []
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Print the make targets which correspond to the files "
+        "modified by the top patch, one per line. Objects which were already "
+        "built without error from identical sources are left out.")
+    parser.add_argument("-x", "--exclude", action="append", default=[],
+                        help="Exclude target or targets under directory. May "
+                        "be repeated.")
+    parser.add_argument("--record", action="store_true",
+                        help="Instead of printing targets, record that the "
+                        "targets given as arguments were built "
+                        "successfully.")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Do not leave out the objects which were already "
+                        "built.")
+    parser.add_argument("extra", nargs="*",
+                        help="Additional targets and make arguments.")
+    args = parser.parse_args()
+
+    options, targets = split_extra(args.extra)
+    cache = BuildCache(variables=[arg for arg in options if "=" in arg])
+    cache.load()
+    if args.record:
+        cache.record(targets)
+        cache.save()
+        sys.exit(0)
+
+    try:
+        files = subprocess.check_output(
+            ("quilt", "files",), preexec_fn=lib.restore_signals)
+    except subprocess.CalledProcessError:
+        sys.exit(1)
+
+    targets = plan(args.extra, files.decode("utf-8").splitlines(),
+                   args.exclude, cache=cache, skip_built=not args.no_cache)
+    if cache.dirty:
+        cache.save()
+    for target in targets:
+        print(target)
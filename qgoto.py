@@ -5,19 +5,51 @@ from __future__ import print_function
 
 import argparse
 import os
-import subprocess
 import sys
 
-import lib
+import lib_server
+
+
+def format_command(delta):
+    if delta > 0:
+        return "push %d\n" % (delta,)
+    elif delta < 0:
+        return "pop %d\n" % (-1 * delta,)
+    else:
+        return ""
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Print the quilt push or pop command required to reach the "
         "position where the specified commit should be imported.")
-    parser.add_argument("rev", help="Upstream commit id.")
+    parser.add_argument("-b", "--batch", action="store_true",
+                        help="Place multiple commits, given as arguments or "
+                        "read from stdin, as if each one was imported and "
+                        "applied after the previous one. Print one line per "
+                        "commit with the full commit id, the number of "
+                        "patches to push (positive) or pop (negative) and the "
+                        "patch after which the commit is inserted, separated "
+                        "by tabs.")
+    parser.add_argument("--verify", action="store_true",
+                        help="Sort the whole sorted section instead of doing "
+                        "a binary search and check that it is sorted.")
+    parser.add_argument("rev", nargs="*", help="Upstream commit id.")
     args = parser.parse_args()
 
+    if args.batch:
+        args.rev = lib_server.batch_revs(args.rev)
+    elif len(args.rev) != 1:
+        parser.error("exactly one commit must be specified without --batch")
+
+    lib_server.run("qgoto", revs=args.rev, batch=args.batch,
+                   verify=args.verify)
+
+    # imported only when there is no server to avoid loading pygit2
+    import subprocess
+
+    import lib
+
     if not lib.check_series():
         sys.exit(1)
 
@@ -29,12 +61,17 @@ if __name__ == "__main__":
     os.chdir("patches")
 
     try:
-        (name, delta,) = lib.sequence_insert(series, args.rev, top)
+        if args.batch:
+            plan = lib.sequence_insert_many(series, args.rev, top,
+                                            verify=args.verify)
+        else:
+            (name, delta,) = lib.sequence_insert(series, args.rev[0], top,
+                                                 verify=args.verify)
     except lib.KSException as err:
         print("Error: %s" % (err,), file=sys.stderr)
         sys.exit(1)
 
-    if delta > 0:
-        print("push %d" % (delta,))
-    elif delta < 0:
-        print("pop %d" % (-1 * delta,))
+    if args.batch:
+        sys.stdout.write(lib.format_insert_plan(plan))
+    else:
+        sys.stdout.write(format_command(delta))
@@ -0,0 +1,99 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Prepare the patches of the next commits of a queue so that qcp.py can import
+them without generating them. qdoit runs this in the background while the
+current commit builds.
+"""
+
+from __future__ import print_function
+
+import argparse
+import sys
+
+import lib_server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Generate and clean the patches of the next commits of a "
+        "queue and stage them under .pc/prefetch for qcp.py. Staged patches "
+        "of commits which are no longer in the queue are discarded.")
+    parser.add_argument("-r", "--references",
+                        help="bsc# or FATE# number used to tag the patch file.")
+    parser.add_argument("-d", "--destination",
+                        help="Destination \"patches.xxx\" directory.")
+    parser.add_argument("-n", "--number", type=int, default=4,
+                        help="Number of commits, from the start of the queue, "
+                        "to prepare. Default: %(default)s")
+    parser.add_argument("--discard", action="store_true",
+                        help="Only discard the staged patches of commits "
+                        "which are no longer in the queue.")
+    parser.add_argument("rev", nargs="*",
+                        help="Upstream commit ids of the queue, in order. "
+                        "Read from stdin if none are given.")
+    args = parser.parse_args()
+
+    if not args.discard and not (args.references and args.destination):
+        parser.error("--references and --destination are required")
+
+    args.rev = lib_server.batch_revs(args.rev)
+
+    import os
+    import pygit2
+
+    import lib
+    import lib_index
+    import lib_prefetch
+    import qcp
+
+    if not lib.check_series():
+        sys.exit(1)
+
+    repo_path = lib.repo_path()
+    if "GIT_DIR" not in os.environ:
+        os.environ["GIT_DIR"] = repo_path
+    repo = pygit2.Repository(repo_path)
+    queue = []
+    for rev in args.rev:
+        try:
+            queue.append(repo.revparse_single(rev).peel(pygit2.Commit))
+        except (KeyError, ValueError):
+            # qcp will report it when this entry is reached
+            break
+
+    staging = lib_prefetch.StagingArea()
+    staging.discard([str(commit.id) for commit in queue])
+    if args.discard:
+        sys.exit(0)
+
+    queue = [commit for commit in queue[:args.number]
+             if staging.get(str(commit.id), repo.path, args.references,
+                            args.destination, qcp.header_cleaner()) is None]
+    # qdoit stops at the first commit which is already in the series, there
+    # is no need to prepare anything after it. The check is repeated before
+    # import because the series changes in between.
+    index = lib_index.CommitIndex.open("series")
+    for i, commit in enumerate(queue):
+        if index.find(str(commit.id)):
+            queue = queue[:i]
+            break
+
+    targets = [(commit, args.references, args.destination,)
+               for commit in queue]
+    try:
+        texts = qcp.generate(repo, targets)
+    except lib.KSException:
+        # stage the patches up to the first one that fails, qcp will report
+        # the error when that entry is reached
+        texts = []
+        for target in targets:
+            try:
+                texts.extend(qcp.generate(repo, [target]))
+            except lib.KSException:
+                break
+
+    for (commit, references, destination,), text in zip(targets, texts):
+        staging.stage(str(commit.id), repo.path, references, destination,
+                      qcp.header_cleaner(), text)
@@ -21,18 +21,24 @@ _switcheroo
 qfmake () {
 	local i
 	local doit=1
+	local dry_run no_cache
 	while true ; do
 		case "$1" in
 			-h|--help)
 				echo "Usage: ${FUNCNAME[1]} [options] [extra arguments passed to make]"
 				echo ""
 				echo "Build targets that have been modified by top patch (using a simple heuristic)."
+				echo "Objects which include a modified header are found using the .*.o.cmd"
+				echo "files of a previous build. Objects which were already built without"
+				echo "error from identical sources are skipped."
 				echo ""
 				echo "Options:"
 				echo "    -x, --exclude <target|dir>     Exclude target or targets under directory from automatic building."
 				echo "    -X, --no-exclude <target|dir>  Remove previously set exclusion."
 				echo "    -r, --reset                    Reset exclusion list."
 				echo "    -s, --show                     Show exclusion list."
+				echo "    -P, --plan                     Print the arguments that would be passed to make instead of building."
+				echo "    -a, --all                      Also build the objects which were already built from identical sources."
 				echo "    -h, --help                     Print this help"
 				return
 				;;
@@ -63,6 +69,12 @@ qfmake () {
 				fi
 				return
 				;;
+			-P|--plan)
+				dry_run=1
+				;;
+			-a|--all)
+				no_cache=--no-cache
+				;;
 			*)
 				break
 				;;
@@ -74,42 +86,26 @@ qfmake () {
 		return
 	fi
 
-	local targets new_target
-	for new_target in "$@" $(quilt files | sed -n -e 's/.c$/.o/p'); do
-		local exclude
-		local add=1
-		for exclude in "${qfm_excludes[@]}"; do
-			# new_target is under exclude
-			if echo "$new_target" | grep -q '^'"$exclude"; then
-				add=
-				break
-			fi
-		done
-		if [ -z "$add" ]; then
-			continue
-		fi
-
-		# filter targets to remove elements that are included under
-		# other elements
-		for i in $(seq 0 $((${#targets[@]} - 1))); do
-			local target=${targets[i]}
-			# new_target is under target
-			if echo "$new_target" | grep -q '^'"$target"; then
-				add=
-				break
-			# target is under new_target
-			elif echo "$target" | grep -q '^'"$new_target"; then
-				# remove targets[i]
-				targets=("${targets[@]:0:$i}" "${targets[@]:$((i + 1))}")
-			fi
-		done
-		if [ "$add" ]; then
-			targets+=("$new_target")
-		fi
+	local plan
+	local exclude_args=()
+	for i in "${qfm_excludes[@]}"; do
+		exclude_args+=(-x "$i")
 	done
+	if ! plan=$("$_libdir"/qfmake.py $no_cache "${exclude_args[@]}" -- "$@"); then
+		echo "Error: qfmake.py exited with an error" > /dev/stderr
+		return 1
+	fi
+	if [ -z "$plan" ]; then
+		return
+	fi
 
-	if [ ${#targets[@]} -gt 0 ]; then
-		make "${targets[@]}"
+	local targets
+	mapfile -t targets <<< "$plan"
+	if [ "$dry_run" ]; then
+		printf "%s\n" "${targets[@]}"
+	else
+		make "${targets[@]}" || return
+		"$_libdir"/qfmake.py --record -- "${targets[@]}"
 	fi
 }
 
@@ -131,6 +127,17 @@ qdupcheck () {
 }
 
 
+# Start ksapply_server.py in the background. With arguments (ex: --status,
+# --stop), run it in the foreground instead.
+qserver () {
+	if [ $# -gt 0 ]; then
+		"$_libdir"/ksapply_server.py "$@"
+	else
+		("$_libdir"/ksapply_server.py > /dev/null &)
+	fi
+}
+
+
 qdiffcheck () {
 	local rev=$(tag_get git-commit < $(q top) | GIT_DIR="$LINUX_GIT"/.git expand_git_ref)
 	interdiff <(GIT_DIR="$LINUX_GIT"/.git $_libdir/git_helpers/git-f1 $rev) $(q top)
@@ -271,6 +278,7 @@ qedit () {
 	if [ -z "${series[0]}" ]; then
 		unset series[0]
 	fi
+	_qprefetch_discard
 
 	rm "$tmpfile"
 	if [ "${_tmpfile+set}" = "set" ]; then
@@ -301,6 +309,7 @@ qskip () {
 	if [ ${#series[@]} -gt 0 ]; then
 		echo "Skipped:    $(echo "${series[0]}" | _strip_begin)"
 		series=("${series[@]:1}")
+		_qprefetch_discard
 		if [ ${#series[@]} -gt 0 ]; then
 			echo "Next:       $(echo "${series[0]}" | _strip_begin)"
 		else
@@ -312,62 +321,64 @@ qskip () {
 }
 
 
-_stablecheck () {
-	local entry=$1
-	local patch=$2
-
-	local rev=$(echo "$patch" | awk '{
-		match($0, "patch-([[:digit:]]+\\.[[:digit:]]+)\\.([[:digit:]]+)(-([[:digit:]]+))?", a)
-		if (a[3]) {
-			print "v" a[1] "." a[2] "..v" a[1] "." a[4]
-		} else {
-			print "v" a[1] "..v" a[1] "." a[2]
-		}
-	}')
-	local output=$(GIT_DIR="$LINUX_GIT"/.git git log "$rev" --pretty=tformat:%H --grep "$entry")
-	local nb=$(echo "$output" | wc -l)
-	if [ "$output" -a $nb -eq 1 ]; then
-		echo -en "This commit was backported to a stable branch as\n\t"
-		GIT_DIR="$LINUX_GIT"/.git $_libdir/git_helpers/git-overview -m "$output"
-		echo
-	elif [ $nb -gt 1 ]; then
-		echo "Warning: $nb potential stable commits found:" > /dev/stderr
-		GIT_DIR="$LINUX_GIT"/.git git log "$rev" --oneline --grep "$entry" > /dev/stderr
-	else
-		echo "Warning: no potential stable commit found." > /dev/stderr
+_qprefetch_wait () {
+	if [ "$1" ]; then
+		wait $1
+	fi
+}
+
+
+# Discard the patches staged by qprefetch.py for entries which were removed
+# from the queue
+_qprefetch_discard () {
+	if [ -d .pc/prefetch ]; then
+		qcat | awk '{print $1}' | "$_libdir"/qprefetch.py --discard
 	fi
 }
 
 
 qdoit () {
-	local entry=$(qnext | awk '{print $1}')
-	while [ "$entry" ]; do
-		local command
-		if ! command=$("$_libdir"/qgoto.py "$entry"); then
-			echo "Error: qgoto.py exited with an error" > /dev/stderr
+	# The position of every entry is computed once, assuming that each
+	# entry is imported and applied after the previous one.
+	local plan
+	if [ ${#series[@]} -gt 0 ] &&
+		! plan=$(qcat | awk '{print $1}' | "$_libdir"/qgoto.py --batch); then
+		echo "Error: qgoto.py exited with an error" > /dev/stderr
+		return 1
+	fi
+
+	local steps step
+	mapfile -t steps <<< "$plan"
+	for step in "${steps[@]}"; do
+		local entry=$(qnext | awk '{print $1}')
+		local delta=$(echo "$step" | awk '{print $2}')
+		if [ -z "$entry" -o -z "$delta" ]; then
+			break
+		fi
+		# The plan lists full commit ids, the queue may use abbreviated
+		# ones.
+		local commit=$(echo "$step" | awk '{print $1}')
+		if [ "${commit#${entry,,}}" = "$commit" ]; then
+			echo "Error: the next entry ($entry) is not the one whose position was computed (${commit:0:12}). The queue changed, please run qdoit again." > /dev/stderr
 			return 1
 		fi
-		while [ "$command" ]; do
-			if ! quilt $command; then
-				echo "\`quilt $command\` did not complete sucessfully. Please examine the situation." > /dev/stderr
-				return 1
-			fi
 
-			if ! command=$("$_libdir"/qgoto.py "$entry"); then
-				echo "Error: qgoto.py exited with an error" > /dev/stderr
-				return 1
-			fi
-		done
+		local command=
+		if [ "$delta" -gt 0 ]; then
+			command="push $delta"
+		elif [ "$delta" -lt 0 ]; then
+			command="pop $((-1 * delta))"
+		fi
+		if [ "$command" ] && ! quilt $command; then
+			echo "\`quilt $command\` did not complete sucessfully. Please examine the situation." > /dev/stderr
+			return 1
+		fi
 
 		local output
 		if ! output=$(qdupcheck $entry); then
 			echo
 			echo "$output"
 			echo
-			local patch=$(echo "$output" | awk '/patches.kernel.org\/patch-/ {print $1}')
-			if [ "$patch" ]; then
-				_stablecheck "$entry" "$patch"
-			fi
 			echo "The next commit is already present in the series. Please examine the situation." > /dev/stderr
 			return 1
 		fi
@@ -378,18 +389,31 @@ qdoit () {
 		fi
 		series=("${series[@]:1}")
 
+		# Prepare the next entries for qcp while this one is applied
+		# and built
+		local prefetch=
+		if [ "${QDOIT_PREFETCH:-4}" -gt 0 -a ${#series[@]} -gt 0 ] &&
+			[ "$_references" -a "$_destination" ]; then
+			qcat | awk '{print $1}' | "$_libdir"/qprefetch.py \
+				-n "${QDOIT_PREFETCH:-4}" -r "$_references" \
+				-d "$_destination" > /dev/null 2>&1 &
+			prefetch=$!
+		fi
+
 		if ! quilt push; then
+			_qprefetch_wait $prefetch
 			echo "The last commit did not apply successfully. Please examine the situation." > /dev/stderr
 			return 1
 		fi
 
 		./refresh_patch.sh
 
-		if ! qfmake "$@"; then
+		local status=0
+		qfmake "$@" || status=$?
+		_qprefetch_wait $prefetch
+		if [ $status -ne 0 ]; then
 			echo "The last applied commit results in a build failure. Please examine the situation." > /dev/stderr
 			return 1
 		fi
-
-		entry=$(qnext | awk '{print $1}')
 	done
 }
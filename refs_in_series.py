@@ -0,0 +1,199 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Check if commits are already part of a patch in SUSE's kernel-source.git.
+Useful to check if a list of commits have already been backported.
+
+Read git references from stdin and check if a patch (present in
+"series.conf") applies the part of the related commit that is below the
+"paths of interest". A patch is considered to do so if it changes as many
+files matching the paths of interest as the commit does.
+
+Each input line is printed back, prefixed with "* " if such a patch was
+found, "  " otherwise.
+"""
+
+from __future__ import print_function
+
+import argparse
+import fnmatch
+import multiprocessing
+import os
+import os.path
+import pygit2
+import sys
+
+import lib
+import lib_index
+import lib_patch
+
+
+def strip_component(path):
+    """
+    Remove the first component of a path from a patch, like `git apply` does
+    by default ("a/", "b/").
+    """
+    return path.split("/", 1)[-1]
+
+
+def patch_paths(patch):
+    """
+    Returns the set of paths which are changed by a patch file.
+    """
+    with open(patch) as f:
+        lines = f.readlines()
+
+    paths = set()
+    for i in range(len(lines)):
+        if (i + 2 < len(lines) and lines[i].startswith("--- ") and
+                lines[i + 1].startswith("+++ ") and
+                lines[i + 2].startswith("@@")):
+            old = lines[i][4:].split("\t", 1)[0].strip()
+            new = lines[i + 1][4:].split("\t", 1)[0].strip()
+            if new == "/dev/null":
+                paths.add(strip_component(old))
+            else:
+                paths.add(strip_component(new))
+        elif (lines[i].startswith("rename to ") and i > 0 and
+              lines[i - 1].startswith("rename from ")):
+            # a rename without changes has no "---" and "+++" lines
+            paths.add(lines[i][len("rename to "):].strip())
+        elif lines[i].startswith("Binary files "):
+            # Binary files a/x and b/y differ
+            words = lines[i].split()
+            if len(words) == 6:
+                if words[4] == "/dev/null":
+                    paths.add(strip_component(words[2]))
+                else:
+                    paths.add(strip_component(words[4]))
+        elif lines[i].startswith("GIT binary patch"):
+            for j in range(i - 1, -1, -1):
+                if lines[j].startswith("diff --git "):
+                    paths.add(strip_component(lines[j].split()[-1]))
+                    break
+    return paths
+
+
+def commit_paths(repo, commit):
+    """
+    Returns the set of paths which are changed by a commit, compared to its
+    first parent. A renamed file counts once, under its new path, like in
+    patch_paths().
+    """
+    paths = set()
+    for delta in lib_patch.commit_diff(repo, commit).deltas:
+        if delta.status == pygit2.GIT_DELTA_DELETED:
+            paths.add(delta.old_file.path)
+        else:
+            paths.add(delta.new_file.path)
+    return paths
+
+
+def count_matching(paths, patterns):
+    if not patterns:
+        return len(paths)
+    return len([path for path in paths
+                if [pattern for pattern in patterns
+                    if fnmatch.fnmatchcase(path, pattern)]])
+
+
+class Checker(object):
+    def __init__(self, repo, index, patterns):
+        self.repo = repo
+        self.index = index
+        self.patterns = patterns
+        # patch name: number of matching paths
+        self.patch_counts = {}
+
+    def patch_count(self, name):
+        try:
+            return self.patch_counts[name]
+        except KeyError:
+            pass
+        count = count_matching(patch_paths(
+            os.path.join(self.index.base, name)), self.patterns)
+        self.patch_counts[name] = count
+        return count
+
+    def check(self, line):
+        """
+        Returns a tuple
+            (found, warning,)
+        """
+        ref = lib.firstword(line)
+        try:
+            commit = self.repo.revparse_single(ref).peel(pygit2.Commit)
+        except (KeyError, ValueError, pygit2.GitError):
+            return (False, "Warning: could not find commit \"%s\"" % (ref,),)
+        count = count_matching(commit_paths(self.repo, commit),
+                               self.patterns)
+        for name in self.index.find(ref):
+            if self.patch_count(name) == count:
+                return (True, None,)
+        return (False, None,)
+
+
+_checker = None
+
+
+def _init(repo_path, index, patterns):
+    global _checker
+    _checker = Checker(pygit2.Repository(repo_path), index, patterns)
+
+
+def _check(line):
+    return _checker.check(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Read git references from stdin and check if a patch "
+        "(present in \"series.conf\") applies the part of the related commit "
+        "that is below the \"paths of interest\".")
+    parser.add_argument("-j", "--jobs", type=int,
+                        default=multiprocessing.cpu_count(),
+                        help="Number of processes used to check the commits. "
+                        "Default: number of cpus")
+    parser.add_argument("patterns", nargs="*", metavar="path of interest",
+                        help="Path pattern, as for `git apply --include`. "
+                        "Default: all paths.")
+    args = parser.parse_args()
+
+    if not os.access("series.conf", os.R_OK):
+        print("Error: \"series.conf\" file could not be read. Are you at the "
+              "base of a kernel-source.git tree?", file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        repo = lib.open_repo()
+    except lib.KSException as err:
+        print("Error: %s" % (err,), file=sys.stderr)
+        sys.exit(1)
+
+    index = lib_index.CommitIndex.open("series.conf")
+    lines = [line.rstrip("\n") for line in sys.stdin if line.strip()]
+
+    if args.jobs > 1 and len(lines) > 1:
+        pool = multiprocessing.Pool(args.jobs, _init,
+                                    (repo.path, index, args.patterns,))
+        results = pool.imap(_check, lines, 8)
+    else:
+        pool = None
+        checker = Checker(repo, index, args.patterns)
+        results = (checker.check(line) for line in lines)
+
+    try:
+        for i, (found, warning,) in enumerate(results):
+            line = lines[i]
+            if warning:
+                sys.stdout.flush()
+                print(warning, file=sys.stderr)
+            if found:
+                print("* %s" % (line,))
+            else:
+                print("  %s" % (line,))
+            sys.stdout.flush()
+    finally:
+        if pool is not None:
+            pool.terminate()
@@ -15,21 +15,50 @@ import argparse
 import os
 import sys
 
-import lib
+import lib_server
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Print the name of the patch over which the specified "
         "commit should be imported.")
-    parser.add_argument("rev", help="Upstream commit id.")
+    parser.add_argument("-b", "--batch", action="store_true",
+                        help="Place multiple commits, given as arguments or "
+                        "read from stdin, as if each one was imported after "
+                        "the previous one. Print one line per commit with the "
+                        "full commit id, the position of the commit relative "
+                        "to the start of the series and the patch after which "
+                        "the commit is inserted, separated by tabs.")
+    parser.add_argument("--verify", action="store_true",
+                        help="Sort the whole sorted section instead of doing "
+                        "a binary search and check that it is sorted.")
+    parser.add_argument("rev", nargs="*", help="Upstream commit id.")
     args = parser.parse_args()
 
+    if args.batch:
+        args.rev = lib_server.batch_revs(args.rev)
+    elif len(args.rev) != 1:
+        parser.error("exactly one commit must be specified without --batch")
+
+    lib_server.run("sequence_insert", revs=args.rev, batch=args.batch,
+                   verify=args.verify)
+
+    # imported only when there is no server to avoid loading pygit2
+    import lib
+
     try:
-        (name, delta,) = lib.sequence_insert(open("series.conf"), args.rev,
-                                             None)
+        if args.batch:
+            plan = lib.sequence_insert_many(open("series.conf"), args.rev,
+                                            None, verify=args.verify)
+        else:
+            (name, delta,) = lib.sequence_insert(open("series.conf"),
+                                                 args.rev[0], None,
+                                                 verify=args.verify)
     except lib.KSException as err:
         print("Error: %s" % (err,), file=sys.stderr)
         sys.exit(1)
 
-    print(name)
+    if args.batch:
+        sys.stdout.write(lib.format_insert_plan(plan))
+    else:
+        print(name)
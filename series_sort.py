@@ -14,16 +14,43 @@ select the lines and filter them through the script:
     shift-v
     j j j j [...] # or ctrl-d or /pattern<enter>
     :'<,'>! ~/<path>/series_sort.py
+
+With --check, the script only verifies the order of the entries. For example,
+as a pre-commit hook in kernel-source:
+    #!/bin/sh
+    git diff --cached --quiet -- series.conf ||
+        ~/<path>/series_sort.py --check series.conf
 """
 
 from __future__ import print_function
 
 import argparse
 import os
-import pygit2
+import stat
 import sys
 
-import lib
+import lib_cache
+import lib_server
+import lib_trace
+
+
+@lib_trace.traced("write_series")
+def update_series(path, old, new):
+    """
+    Replace the lines "old" of the file at path with "new".
+
+    The file is not touched if the lines are the same. Otherwise it is
+    replaced atomically by a file with the same permissions.
+
+    Returns True if the file was written.
+    """
+    if old == new:
+        return False
+    # replace the target of a symlink, not the link
+    path = os.path.realpath(path)
+    lib_cache.replace(path, lambda f: f.writelines(new), mode="w",
+                      perm=stat.S_IMODE(os.stat(path).st_mode))
+    return True
 
 
 if __name__ == "__main__":
@@ -33,17 +60,20 @@ if __name__ == "__main__":
     parser.add_argument("-p", "--prefix", metavar="DIR",
                         help="Search for patches in this directory. Default: "
                         "current directory.")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of processes used to read the patches. "
+                        "Default: 1")
+    parser.add_argument("-c", "--check", action="store_true",
+                        help="Only check that the entries are sorted. Print "
+                        "the first entries that are out of order and exit "
+                        "with a non-zero status if they are not. Nothing is "
+                        "written.")
     parser.add_argument("series", nargs="?", metavar="series.conf",
                         help="series.conf file which will be modified in "
-                        "place. Default: read input from stdin.")
+                        "place, only if it is not already sorted. Default: "
+                        "read input from stdin.")
     args = parser.parse_args()
 
-    repo_path = lib.repo_path()
-    if "GIT_DIR" not in os.environ:
-        # this is for the `git log` call in git_sort.py
-        os.environ["GIT_DIR"] = repo_path
-    repo = pygit2.Repository(repo_path)
-
     if args.series is not None:
         args.series = os.path.abspath(args.series)
         f = open(args.series)
@@ -54,38 +84,37 @@ if __name__ == "__main__":
     if args.prefix is not None:
         os.chdir(args.prefix)
 
-    try:
-        before, inside, after = lib.split_series(lines)
-    except lib.KSNotFound:
-        before = []
-        inside = lines
-        after = []
-
-    input_entries = []
-    for patch in [lib.firstword(line) for line in inside if
-                  lib.filter_patches(line)]:
-        entry = lib.InputEntry("\t%s\n" % (patch,))
+    response = lib_server.run("series_sort", lines=lines, check=args.check)
+    if response is not None:
+        output = response["result"]
+    else:
+        # imported only when there is no server to avoid loading pygit2
+        import pygit2
+
+        import lib
+
+        repo_path = lib.repo_path()
+        if "GIT_DIR" not in os.environ:
+            # this is for the `git log` calls in lib_upstream.py
+            os.environ["GIT_DIR"] = repo_path
+        repo = pygit2.Repository(repo_path)
+
         try:
-            entry.from_patch(repo, patch)
-        except lib.KSError as err:
+            if args.check:
+                result = lib.check_sorted(repo, lines, jobs=args.jobs)
+            else:
+                output = lib.sort_series(repo, lines, jobs=args.jobs)
+        except lib.KSException as err:
             print("Error: %s" % (err,), file=sys.stderr)
             sys.exit(1)
-        input_entries.append(entry)
-    try:
-        sorted_entries = lib.series_sort(repo, input_entries)
-    except lib.KSException as err:
-        print("Error: %s" % (err,), file=sys.stderr)
-        sys.exit(1)
-
-    output = lib.flatten([
-        before,
-        lib.series_header(inside),
-        lib.series_format(sorted_entries),
-        lib.series_footer(inside),
-        after])
+
+        if args.check:
+            if result[0]:
+                sys.stdout.write(lib.describe_unsorted(result))
+                sys.exit(1)
+            sys.exit(0)
 
     if args.series is not None:
-        f = open(args.series, mode="w")
+        update_series(args.series, lines, output)
     else:
-        f = sys.stdout
-    f.writelines(output)
+        sys.stdout.writelines(output)
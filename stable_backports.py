@@ -0,0 +1,77 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Find the commits of the stable releases which backport upstream commits.
+
+The stable commits are found through an index (see lib_stable.py) of the
+"commit <id> upstream" lines of the commits of the stable release tags. The
+index is kept under the cache directory and updated when new tags are
+fetched.
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+
+import lib
+import lib_patch
+import lib_stable
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Print the stable release and the stable commit of the "
+        "backports of upstream commits, one per line. Without commits, print "
+        "the state of the index.")
+    parser.add_argument("-p", "--patch",
+                        help="Only print the backports released in the "
+                        "range of versions of this patches.kernel.org patch.")
+    parser.add_argument("-r", "--rebuild", action="store_true",
+                        help="Discard the index and build it again.")
+    parser.add_argument("rev", nargs="*", help="Upstream commit id.")
+    args = parser.parse_args()
+
+    try:
+        repo = lib.open_repo()
+        commits = lib.resolve_commits(repo, args.rev)
+    except lib.KSException as err:
+        print("Error: %s" % (err,), file=sys.stderr)
+        sys.exit(1)
+
+    index = lib_stable.StableIndex(repo)
+    index.load()
+    if args.rebuild:
+        index.rebuild()
+        index.save()
+    elif index.update():
+        index.save()
+
+    if not commits:
+        print("Index file: %s" % (index.path,))
+        try:
+            size = os.path.getsize(index.path)
+        except OSError:
+            size = 0
+        print("Size: %d bytes" % (size,))
+        print("Stable tags: %d" % (len(index.tags),))
+        print("Upstream commits: %d" % (len(index.backports),))
+        sys.exit(0)
+
+    versions = None
+    if args.patch:
+        versions = lib_stable.parse_range(args.patch)
+        if versions is None:
+            print("Error: \"%s\" is not the name of a patches.kernel.org "
+                  "patch." % (args.patch,), file=sys.stderr)
+            sys.exit(1)
+
+    status = 1
+    for commit in commits:
+        for stable_id, tag in index.find(commit, versions):
+            print("%s %s %s" % (tag, stable_id[:12],
+                                lib_patch.subject(repo[stable_id]),))
+            status = 0
+    sys.exit(status)
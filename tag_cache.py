@@ -0,0 +1,87 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Show statistics about the cache of patch header tags or rebuild it.
+
+The cache is used by series_sort.py, qgoto.py, sequence-insert.py,
+merge_tool.py, qdupcheck.py and qcp.py so that patches which did not change
+since the last run are not read again.
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import os.path
+import sys
+
+import lib
+import lib_tag
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Show statistics about the cache of patch header tags or "
+        "rebuild it.")
+    parser.add_argument("-r", "--rebuild", action="store_true",
+                        help="Discard the entries of the patches in the "
+                        "series and read them again.")
+    parser.add_argument("-c", "--clear", action="store_true",
+                        help="Discard all entries.")
+    parser.add_argument("-p", "--prefix", metavar="DIR",
+                        help="Search for patches in this directory. Default: "
+                        "the directory of the series file.")
+    parser.add_argument("series", nargs="?", metavar="series.conf",
+                        help="series.conf file whose patches are rebuilt or "
+                        "checked for validity. Default: \"series.conf\" if it "
+                        "exists, otherwise \"series\".")
+    args = parser.parse_args()
+
+    cache = lib_tag.tag_cache()
+    cache.load()
+
+    if args.clear:
+        cache.clear()
+        cache.save()
+        print("Cleared %s" % (cache.path,))
+        sys.exit(0)
+
+    cache.prune()
+    print("Cache file: %s" % (cache.path,))
+    try:
+        size = os.path.getsize(cache.path)
+    except OSError:
+        size = 0
+    print("Size: %d bytes" % (size,))
+    print("Entries: %d" % (len(cache.entries),))
+
+    series = args.series
+    if series is None:
+        for name in ("series.conf", "series",):
+            if os.path.exists(name):
+                series = name
+                break
+    if series is None:
+        sys.exit(0)
+
+    if args.prefix is None:
+        prefix = os.path.dirname(os.path.abspath(series))
+        if os.path.basename(series) == "series":
+            prefix = os.path.join(prefix, "patches")
+    else:
+        prefix = args.prefix
+
+    with open(series) as f:
+        patches = [os.path.join(prefix, lib.firstword(line))
+                   for line in f if lib.filter_patches(line)]
+    patches = [patch for patch in patches if os.path.exists(patch)]
+
+    if args.rebuild:
+        for patch in patches:
+            cache.entries.pop(os.path.abspath(patch), None)
+        cache.dirty = True
+    for patch in patches:
+        cache.get_all(patch)
+    print("Patches in %s: %d, valid entries: %d, (re)read: %d" % (
+        series, len(patches), cache.hits, cache.misses,))
@@ -0,0 +1,120 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Check that clean_header.py and the patches that qcp generates without git
+give the same result as clean_header.sh and `git format-patch`, on the
+patches of a real kernel-source.git tree.
+
+Set KSAPPLY_TEST_KERNEL_SOURCE to the base of a kernel-source.git checkout
+and LINUX_GIT to an upstream repository which contains the commits of its
+patches. KSAPPLY_TEST_NUMBER is the number of patches to compare (default
+200). The tests are skipped when these are not available, and also without
+GNU awk, which clean_header.sh needs.
+"""
+
+from __future__ import print_function
+
+import os
+import os.path
+import re
+import subprocess
+import sys
+import unittest
+
+libdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, libdir)
+
+import lib
+import lib_tag
+
+
+def gnu_awk():
+    try:
+        output = subprocess.check_output(("awk", "--version",),
+                                         stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError):
+        return False
+    return output.startswith(b"GNU Awk")
+
+
+def kernel_source():
+    path = os.environ.get("KSAPPLY_TEST_KERNEL_SOURCE")
+    if not path or "LINUX_GIT" not in os.environ:
+        return None
+    return path
+
+
+@unittest.skipUnless(kernel_source() and gnu_awk(),
+                     "needs KSAPPLY_TEST_KERNEL_SOURCE, LINUX_GIT and GNU awk")
+class CompareTest(unittest.TestCase):
+    def setUp(self):
+        self.tree = kernel_source()
+        self.number = int(os.environ.get("KSAPPLY_TEST_NUMBER", "200"))
+        self.environ = dict(os.environ)
+        os.environ.pop("CLEAN_HEADER_PY", None)
+        # neither implementation may start an editor
+        self.stdin = os.dup(0)
+        with open(os.devnull) as devnull:
+            os.dup2(devnull.fileno(), 0)
+
+    def tearDown(self):
+        os.dup2(self.stdin, 0)
+        os.close(self.stdin)
+        os.environ.clear()
+        os.environ.update(self.environ)
+
+    def patches(self):
+        with open(os.path.join(self.tree, "series.conf")) as f:
+            before, inside, after = lib.split_series(f)
+        return [os.path.join(self.tree, "patches", lib.firstword(line))
+                for line in inside if lib.filter_patches(line)][:self.number]
+
+    def test_series(self):
+        """
+        clean_header.py cleans the patches of series.conf like
+        clean_header.sh.
+        """
+        p = subprocess.Popen(
+            [sys.executable, os.path.join(libdir, "benchmarks",
+                                          "clean_header.py"),
+             "--diff", "--number", str(self.number)],
+            cwd=self.tree, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = p.communicate()[0].decode("utf-8", "replace")
+        self.assertEqual(p.returncode, 0, output)
+
+    def test_qcp(self):
+        """
+        qcp generates the same patches with both header cleaners.
+        """
+        import qcp
+
+        repo = lib.open_repo()
+        commits = []
+        for patch in self.patches():
+            tags = lib_tag.patch_tag_get(patch, "Git-commit")
+            if not tags:
+                continue
+            try:
+                commit = repo.revparse_single(lib.firstword(tags[0]))
+            except (KeyError, ValueError):
+                continue
+            commits.append(commit)
+        if not commits:
+            self.skipTest("no commit of the series found in LINUX_GIT")
+
+        targets = [(commit, "bsc#1", "patches.suse",) for commit in commits]
+        scripts = qcp.generate(repo, targets)
+        os.environ["CLEAN_HEADER_PY"] = "1"
+        natives = qcp.generate(repo, targets)
+        for commit, script, native in zip(commits, scripts, natives):
+            # `git format-patch` adds the mbox "From <id>" line and a
+            # signature with the version of git; quilt drops them anyway.
+            script = re.sub(r"\n-- \n[^\n]*\n+$", "\n", script)
+            script = re.sub(r"^From [0-9a-f]{40} [^\n]*\n", "", script)
+            self.assertEqual(script, native, "differs for commit %s" % (
+                str(commit.id)[:12],))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Check that lib_patch.format_patch() gives the same text as
+`git format-patch`, with and without renames, and that lib_patch.subject()
+is like git's "%s" format.
+"""
+
+import os
+import os.path
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+libdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, libdir)
+
+import pygit2
+
+import lib_patch
+
+
+class FormatPatchTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="test_lib_patch.")
+        self.environ = dict(os.environ)
+        os.environ.update({
+            "GIT_DIR": os.path.join(self.tmpdir, ".git"),
+            "GIT_WORK_TREE": self.tmpdir,
+            "GIT_AUTHOR_NAME": "Test",
+            "GIT_AUTHOR_EMAIL": "test@example.com",
+            "GIT_AUTHOR_DATE": "1500000000 +0200",
+            "GIT_COMMITTER_NAME": "Test",
+            "GIT_COMMITTER_EMAIL": "test@example.com",
+        })
+        self.git("init", "-q")
+        self.write("drivers/net/a/foo.c", "".join(
+            ["line %d\n" % (i,) for i in range(40)]))
+        self.write("drivers/net/bar.c", "bar\n")
+        self.commit("initial")
+        self.repo = pygit2.Repository(os.environ["GIT_DIR"])
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.tmpdir)
+
+    def git(self, *args):
+        return subprocess.check_output(("git",) + args).decode("utf-8")
+
+    def write(self, path, content):
+        path = os.path.join(self.tmpdir, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as f:
+            f.write(content)
+
+    def commit(self, subject):
+        self.git("add", "-A")
+        self.git("commit", "-q", "-m", "%s\n\nSigned-off-by: Test "
+                 "<test@example.com>" % (subject,))
+
+    def check(self):
+        commit = self.repo.revparse_single("HEAD")
+        expected = self.git("format-patch", "--stdout", "--notes",
+                            "--max-count=1", "--subject-prefix=",
+                            "--no-numbered", str(commit.id))
+        expected = re.sub(r"^From [0-9a-f]{40} [^\n]*\n", "", expected)
+        expected = re.sub(r"\n-- \n[^\n]*\n+$", "\n", expected)
+        self.assertEqual(lib_patch.format_patch(self.repo, commit), expected)
+
+    def test_modify(self):
+        self.write("drivers/net/bar.c", "bar\nbaz\n")
+        self.commit("net: change bar")
+        self.check()
+
+    def test_rename(self):
+        # git prints "drivers/net/{a => }/foo.c", libgit2 does not
+        self.git("mv", "drivers/net/a/foo.c", "drivers/net/foo.c")
+        self.commit("net: move foo")
+        self.assertTrue(lib_patch.has_renames(lib_patch.commit_diff(
+            self.repo, self.repo.revparse_single("HEAD"))))
+        self.check()
+
+
+class SubjectTest(unittest.TestCase):
+    def test_subject(self):
+        class Commit(object):
+            message = "\nnet: fix\n  the foo \n \nBody.\n"
+        self.assertEqual(lib_patch.subject(Commit()), "net: fix the foo")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Check that an incremental update of lib_upstream.UpstreamOrder gives the same
+index as a full walk, or is refused.
+"""
+
+import os
+import os.path
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+libdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, libdir)
+
+import pygit2
+
+import lib_upstream
+
+
+class UpdateTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix="test_lib_upstream.")
+        self.environ = dict(os.environ)
+        os.environ.update({
+            "GIT_DIR": os.path.join(self.tmpdir, ".git"),
+            "GIT_WORK_TREE": self.tmpdir,
+            "GIT_AUTHOR_NAME": "Test",
+            "GIT_AUTHOR_EMAIL": "test@example.com",
+            "GIT_COMMITTER_NAME": "Test",
+            "GIT_COMMITTER_EMAIL": "test@example.com",
+            "KSAPPLY_NO_CACHE": "1",
+        })
+        self.git("init", "-q")
+        self.git("symbolic-ref", "HEAD", "refs/heads/master")
+        self.number = 0
+
+        # master: a history with a merge, net: a branch of it
+        self.commit()
+        self.git("checkout", "-q", "-b", "side")
+        self.commit()
+        self.commit()
+        self.git("checkout", "-q", "master")
+        self.commit()
+        self.git("merge", "-q", "--no-ff", "-m", "merge side", "side")
+        self.commit()
+        self.git("checkout", "-q", "-b", "net")
+        self.commit()
+        self.commit()
+        self.git("checkout", "-q", "master")
+        self.repo = pygit2.Repository(os.environ["GIT_DIR"])
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.tmpdir)
+
+    def git(self, *args):
+        return subprocess.check_output(("git",) + args).decode("ascii")
+
+    def commit(self):
+        self.number += 1
+        path = os.path.join(self.tmpdir, "file%d" % (self.number,))
+        with open(path, "w") as f:
+            f.write("%d\n" % (self.number,))
+        self.git("add", path)
+        self.git("commit", "-q", "-m", "commit %d" % (self.number,))
+
+    def heads(self):
+        return [(name, self.git("rev-parse", name).strip(),)
+                for name in ("master", "net",)]
+
+    def indexed(self):
+        order = lib_upstream.UpstreamOrder(self.repo)
+        order.build(self.heads())
+        return order
+
+    def check_update(self, advance, expected):
+        """
+        Index the heads, call advance() to change them and check the result
+        of update().
+        """
+        order = self.indexed()
+        advance()
+        heads = self.heads()
+        self.assertEqual(order.update(heads), expected)
+        if expected:
+            full = lib_upstream.UpstreamOrder(self.repo)
+            full.build(heads)
+            self.assertEqual(bytes(order.data), bytes(full.data))
+
+    def test_linear(self):
+        def advance():
+            self.commit()
+            self.commit()
+            self.git("checkout", "-q", "net")
+            self.commit()
+            self.git("checkout", "-q", "master")
+        self.check_update(advance, True)
+
+    def test_merge(self):
+        def advance():
+            self.git("checkout", "-q", "-b", "other", "master~1")
+            self.commit()
+            self.git("checkout", "-q", "master")
+            self.git("merge", "-q", "--no-ff", "-m", "merge other", "other")
+        self.check_update(advance, False)
+
+    def test_moved(self):
+        # master catches up with net, whose commits were indexed under net
+        def advance():
+            self.git("merge", "-q", "--ff-only", "net")
+            self.git("checkout", "-q", "net")
+            self.commit()
+            self.git("checkout", "-q", "master")
+        self.check_update(advance, False)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Tests of the parsing of the .cmd files of kbuild and of BuildCache in
+qfmake.py.
+"""
+
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+import unittest
+
+libdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, libdir)
+
+import qfmake
+
+
+# like kbuild writes it, with "cmd_" before Linux 6.2
+cmd_template = """%(prefix)s_drivers/foo.o := gcc -Wp,-MMD,drivers/.foo.o.d -c -o drivers/foo.o drivers/foo.c
+
+source_drivers/foo.o := drivers/foo.c
+
+deps_drivers/foo.o := \\
+  include/linux/kconfig.h \\
+    $(wildcard include/config/FOO) \\
+  include/linux/foo.h \\
+
+drivers/foo.o: $(deps_drivers/foo.o)
+
+$(deps_drivers/foo.o):
+"""
+
+
+class ParseCmdTest(unittest.TestCase):
+    def check(self, prefix):
+        command, source, deps, wildcards = qfmake.parse_cmd(
+            cmd_template % {"prefix": prefix})
+        self.assertEqual(command, "gcc -Wp,-MMD,drivers/.foo.o.d -c -o "
+                         "drivers/foo.o drivers/foo.c")
+        self.assertEqual(source, "drivers/foo.c")
+        self.assertEqual(deps, ["include/linux/kconfig.h",
+                                "include/linux/foo.h"])
+        self.assertEqual(wildcards, ["include/config/FOO"])
+
+    def test_cmd(self):
+        self.check("cmd")
+
+    def test_savedcmd(self):
+        self.check("savedcmd")
+
+
+class BuildCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.top = tempfile.mkdtemp(prefix="test_qfmake.")
+        self.environ = dict(os.environ)
+        os.environ["KSAPPLY_NO_CACHE"] = "1"
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.top)
+
+    def write(self, path, content):
+        path = os.path.join(self.top, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as f:
+            f.write(content)
+
+    def tree(self, prefix):
+        self.write(".config", "CONFIG_FOO=y\n")
+        self.write("drivers/foo.c", "#include <linux/foo.h>\n")
+        self.write("drivers/foo.o", "object\n")
+        self.write("drivers/.foo.o.cmd", cmd_template % {"prefix": prefix})
+        self.write("include/linux/kconfig.h", "\n")
+        self.write("include/linux/foo.h", "#define FOO 1\n")
+
+    def check(self, prefix):
+        self.tree(prefix)
+        self.assertEqual(qfmake.header_users(["include/linux/foo.h"],
+                                             self.top), ["drivers/foo.o"])
+
+        cache = qfmake.BuildCache(self.top)
+        self.assertFalse(cache.hit("drivers/foo.o"))
+        cache.record(["drivers/foo.o"])
+        self.assertTrue(cache.hit("drivers/foo.o"))
+
+        self.write("include/linux/foo.h", "#define FOO 2\n")
+        cache.files = {}
+        self.assertFalse(cache.hit("drivers/foo.o"))
+
+    def test_cmd(self):
+        self.check("cmd")
+
+    def test_savedcmd(self):
+        self.check("savedcmd")
+
+    def test_deps(self):
+        self.tree("savedcmd")
+        cache = qfmake.BuildCache(self.top)
+        headers = ["include/linux/foo.h"]
+        self.assertEqual(qfmake.header_users(headers, self.top, cache),
+                         ["drivers/foo.o"])
+        self.assertTrue(cache.dirty)
+        self.assertEqual(list(cache.deps), ["drivers/.foo.o.cmd"])
+
+        # a .cmd file whose stamp did not change is not read again
+        cache.dirty = False
+        path = os.path.join(self.top, "drivers/.foo.o.cmd")
+        st = os.stat(path)
+        content = cmd_template.replace(
+            "include/linux/foo.h", "include/linux/bar.h") % {
+                "prefix": "savedcmd"}
+        self.write("drivers/.foo.o.cmd", content)
+        os.utime(path, (st.st_atime, st.st_mtime,))
+        self.assertEqual(qfmake.header_users(headers, self.top, cache),
+                         ["drivers/foo.o"])
+        self.assertFalse(cache.dirty)
+
+        # a changed one is
+        os.utime(path, (st.st_atime, st.st_mtime + 1,))
+        self.assertEqual(qfmake.header_users(headers, self.top, cache), [])
+        self.assertTrue(cache.dirty)
+
+        # and a removed one is dropped
+        os.unlink(path)
+        self.assertEqual(qfmake.header_users(headers, self.top, cache), [])
+        self.assertEqual(cache.deps, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Summarize a trace written by the tools when $KSAPPLY_TRACE is set (see
+lib_trace.py). For example, to trace a qdoit session:
+    kernel-source/tmp/current$ export KSAPPLY_TRACE=/tmp/qdoit.trace
+    kernel-source/tmp/current$ qdoit -j4
+    kernel-source/tmp/current$ trace_report.py /tmp/qdoit.trace
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import json
+import sys
+
+
+def aggregate(records, by_command=False):
+    """
+    Returns a dict
+        (command or None, phase name or None,): {"calls", "wall", "cpu",
+                                                 "bytes"}
+    The phase name None holds the totals of the processes.
+    """
+    result = {}
+
+    def add(key, calls, wall, cpu, size):
+        stats = result.setdefault(key, {"calls": 0, "wall": 0.0, "cpu": 0.0,
+                                        "bytes": 0})
+        stats["calls"] += calls
+        stats["wall"] += wall
+        stats["cpu"] += cpu
+        stats["bytes"] += size
+
+    for record in records:
+        command = record["command"] if by_command else None
+        add((command, None,), 1, record["wall"], record["cpu"], 0)
+        for name, stats in record["phases"].items():
+            add((command, name,), stats["calls"], stats["wall"], stats["cpu"],
+                stats["bytes"])
+    # each command first, then its phases
+    return collections.OrderedDict(sorted(
+        result.items(), key=lambda item: (item[0][0] or "",
+                                          item[0][1] is not None,
+                                          item[0][1],)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Aggregate the time spent in each phase over all the "
+        "processes of a trace.")
+    parser.add_argument("-c", "--by-command", action="store_true",
+                        help="Aggregate each command separately.")
+    parser.add_argument("-j", "--json", action="store_true",
+                        help="Print the result as JSON.")
+    parser.add_argument("trace", nargs="?",
+                        help="Trace file. Default: read from stdin.")
+    args = parser.parse_args()
+
+    if args.trace is not None:
+        f = open(args.trace)
+    else:
+        f = sys.stdin
+    records = []
+    for i, line in enumerate(f):
+        if not line.strip():
+            continue
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            print("Warning: line %d of the trace is not valid, skipping it." %
+                  (i + 1,), file=sys.stderr)
+
+    result = aggregate(records, args.by_command)
+    if args.json:
+        json.dump([dict(stats, command=command, phase=name)
+                   for (command, name), stats in result.items()],
+                  sys.stdout, indent=1, sort_keys=True)
+        print()
+        sys.exit(0)
+
+    print("%d processes" % (len(records),))
+    print("%-32s %8s %10s %10s %12s" % ("phase", "calls", "wall", "cpu",
+                                        "bytes",))
+    for (command, name), stats in result.items():
+        if name is None:
+            label = "%s (process)" % (command or "all",)
+        else:
+            label = "  %s" % (name,)
+        print("%-32s %8d %10.3f %10.3f %12d" % (
+            label, stats["calls"], stats["wall"], stats["cpu"],
+            stats["bytes"],))
@@ -0,0 +1,76 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+Show how the index of the upstream order of commits compares with the
+current remote heads, update it or rebuild it.
+
+The index is used by series_sort.py, qgoto.py, sequence-insert.py and
+merge_tool.py so that they do not walk the history of the remote heads. They
+update it themselves when a head advanced.
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import os.path
+import sys
+
+import lib
+import lib_upstream
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Show how stale the index of the upstream order of "
+        "commits is, update it or rebuild it.")
+    parser.add_argument("-u", "--update", action="store_true",
+                        help="Bring the index up to date with the remote "
+                        "heads.")
+    parser.add_argument("-r", "--rebuild", action="store_true",
+                        help="Discard the index and build it again.")
+    args = parser.parse_args()
+
+    try:
+        repo = lib.open_repo()
+    except lib.KSException as err:
+        print("Error: %s" % (err,), file=sys.stderr)
+        sys.exit(1)
+
+    order = lib_upstream.UpstreamOrder(repo)
+    if args.rebuild:
+        order.build(lib_upstream.get_heads(repo))
+        order.save()
+    elif args.update:
+        order.refresh()
+
+    print("Index file: %s" % (order.path,))
+    try:
+        size = os.path.getsize(order.path)
+    except OSError:
+        size = 0
+    print("Size: %d bytes" % (size,))
+
+    status = order.status()
+    print("Commits: %d" % (len(order),))
+    stale = False
+    for name, indexed_rev, rev, behind in status:
+        if indexed_rev is None:
+            state = "not indexed"
+        elif rev is None:
+            state = "no longer present"
+        elif behind is None:
+            state = "rewound since %s" % (indexed_rev[:12],)
+        elif behind:
+            state = "%d commits behind, indexed up to %s" % (
+                behind, indexed_rev[:12],)
+        else:
+            state = "up to date"
+        if behind != 0:
+            stale = True
+        print("%s: %s" % (name, state,))
+
+    if stale:
+        print("The index will be updated by the next command which uses it "
+              "or by running %s --update" % (os.path.basename(sys.argv[0]),))